@@ -39,7 +39,7 @@ class CompanyAdminForm(forms.ModelForm):
     def clean_company(self):
         company = self.cleaned_data['company']
         # Check for an existing company with the same name, excluding the current instance
-        if Company.objects.filter(company__iexact=company).exclude(pk=self.instance.pk).exists():
+        if Company.name_exists(company, exclude_pk=self.instance.pk):
             raise ValidationError("A company with this name already exists.")
         return company
 
@@ -1,6 +1,17 @@
+import threading
+from os import getenv
 from django.apps import AppConfig
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from api import signals  # noqa: F401 Connects the search index update receivers.
+
+        # Load the semantic search index and models ahead of the first search request.
+        # Done in a background thread so the worker starts serving other endpoints immediately.
+        if getenv('SEMANTIC_SEARCH_WARM_START', 'False') == 'True':
+            from api.semantic_search.engine import warm_up_search_engine
+            threading.Thread(target=warm_up_search_engine, name='semantic-search-warm-up', daemon=True).start()
@@ -0,0 +1,81 @@
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import Count, Exists, OuterRef
+from django.db.models.functions import Upper
+from rest_framework import serializers
+from .models import Company
+
+# Facets the company directory can be filtered by, as {query parameter: (relation, column)}.
+# Many-to-many facets are matched with EXISTS on their through table, so no join duplicates companies and no DISTINCT
+# over the whole company row is needed. The others are columns of the company table.
+COMPANY_FACETS = {
+    'tech_sectors': (Company.tech_sector.through, 'techsector_id'),
+    'vertex_entities': (Company.vertex_entity.through, 'entity_id'),
+    'hq_main_offices': (None, 'hq_main_office_id'),
+    'finance_stages': (None, 'finance_stage_id'),
+    'status': (None, 'status'),
+}
+
+# Modes of the company name search: names starting with the text, or names with a word close to it, typos included.
+# Both are served by the trigram index on UPPER(company).
+PREFIX = 'prefix'
+FUZZY = 'fuzzy'
+NAME_SEARCH_MODES = (PREFIX, FUZZY)
+NAME_SEARCH_LIMIT = 10
+
+
+def get_company_filters(query_params):
+    '''
+        {facet: values} from the repeated facet query parameters, without empty values.
+        Raises ValidationError for ids that are not integers.
+    '''
+    filters = {}
+    for facet, (_, column) in COMPANY_FACETS.items():
+        values = [value for value in query_params.getlist(facet) if value != '']
+        if values and column.endswith('_id'):
+            try:
+                values = [int(value) for value in values]
+            except ValueError:
+                raise serializers.ValidationError({facet: ["Expected a list of ids."]})
+        if values:
+            filters[facet] = values
+    return filters
+
+
+def filter_companies(queryset, filters, exclude=None):
+    # Companies having one of the values of every facet in `filters`, except the `exclude` facet.
+    for facet, values in filters.items():
+        if facet == exclude:
+            continue
+        through, column = COMPANY_FACETS[facet]
+        if through is None:
+            queryset = queryset.filter(**{f'{column}__in': values})
+        else:
+            queryset = queryset.filter(Exists(through.objects.filter(company_id=OuterRef('pk'),
+                                                                     **{f'{column}__in': values})))
+    return queryset
+
+
+def count_facets(queryset, filters):
+    '''
+        {facet: {value: number of companies}} for the filter panel. The counts of a facet apply the filters of the
+        other facets only, so they show how many companies each value adds to the current selection.
+    '''
+    counts = {}
+    for facet, (through, column) in COMPANY_FACETS.items():
+        companies = filter_companies(queryset.order_by().prefetch_related(None), filters, exclude=facet)
+        if through is None:
+            rows = companies.values_list(column).annotate(count=Count('pk'))
+        else:
+            rows = (through.objects.filter(company_id__in=companies.values('pk'))
+                    .values_list(column).annotate(count=Count('company_id')))
+        counts[facet] = {value: count for value, count in rows.order_by()}
+    return counts
+
+
+def search_company_names(queryset, text, mode=PREFIX):
+    # Companies of `queryset` matching `text` in `mode`, best first. Fuzzy matches are annotated with their score.
+    if mode == PREFIX:
+        return queryset.filter(company__istartswith=text).order_by(Upper('company'), 'id')
+    text = text.upper()
+    return (queryset.alias(company_upper=Upper('company')).filter(company_upper__trigram_word_similar=text)
+            .annotate(score=TrigramWordSimilarity(text, Upper('company'))).order_by('-score', 'id'))
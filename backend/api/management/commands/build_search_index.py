@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from api.semantic_search.ann import INDEX_TYPE, INDEX_TYPES
+from api.semantic_search.feeds import refresh_user_feeds
+from api.semantic_search.index_builder import (BUILD_BATCH_SIZE, MIN_ROWS_RATIO, build_search_index,
+                                                convert_legacy_index)
+from api.semantic_search.vector_index import IndexValidationError
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the semantic search index from the companies in the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BUILD_BATCH_SIZE,
+                            help=f"Number of companies embedded and written at a time (default {BUILD_BATCH_SIZE}).")
+        parser.add_argument('--index-type', choices=INDEX_TYPES, default=INDEX_TYPE,
+                            help=f"FAISS index to build (default {INDEX_TYPE}, see SEMANTIC_SEARCH_INDEX_TYPE).")
+        parser.add_argument('--from-legacy-store', action='store_true',
+                            help="Convert the index trained with the old FAISSDocumentStore instead of embedding "
+                                 "the companies again. Needs the database the old index was trained with.")
+        parser.add_argument('--skip-feeds', action='store_true',
+                            help="Do not refresh the user feeds, they are then refreshed on their next read.")
+        parser.add_argument('--force', action='store_true',
+                            help="Activate the new index even when it has far fewer rows than the active one "
+                                 "(see SEMANTIC_SEARCH_INDEX_MIN_ROWS_RATIO).")
+
+    def handle(self, *args, **options):
+        if options['from_legacy_store']:
+            document_count = convert_legacy_index(index_type=options['index_type'], batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Search index built with {document_count} documents."))
+            return
+
+        try:
+            company_count = build_search_index(
+                batch_size=options['batch_size'],
+                index_type=options['index_type'],
+                progress=lambda count: self.stdout.write(f"Indexed {count} companies"),
+                min_rows_ratio=0 if options['force'] else MIN_ROWS_RATIO,
+            )
+        except IndexValidationError as e:
+            raise CommandError(f"{e} The active search index was kept.")
+        self.stdout.write(self.style.SUCCESS(f"Search index built with {company_count} companies."))
+
+        if not options['skip_feeds']:
+            feed_count = refresh_user_feeds(progress=lambda count: self.stdout.write(f"Refreshed {count} user feeds"))
+            self.stdout.write(self.style.SUCCESS(f"Refreshed {feed_count} user feeds."))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from api.semantic_search.inference import ONNX_MODEL_DIR, export_onnx_models
+
+
+class Command(BaseCommand):
+    help = "Exports the embedding model and the cross-encoder to ONNX for SEMANTIC_SEARCH_INFERENCE_BACKEND=onnx."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=ONNX_MODEL_DIR,
+                            help=f"Directory of the exported models (default {ONNX_MODEL_DIR}, see SEMANTIC_SEARCH_ONNX_DIR).")
+        parser.add_argument('--quantize', action='store_true', help="Also quantize the exported weights to int8.")
+
+    def handle(self, *args, **options):
+        export_onnx_models(options['output_dir'], quantize=options['quantize'])
+        self.stdout.write(self.style.SUCCESS(f"Models exported to {options['output_dir']}."))
@@ -0,0 +1,57 @@
+import json
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from api.semantic_search.engine import SemanticSearchEngine
+from api.semantic_search.inference import INFERENCE_BACKENDS, compare_backends, create_embedder, create_ranker
+from api.semantic_search.semantic_search import DENSE_RETRIEVER_TOP_K, NUM_OF_RESULTS_TO_RETURN, SEARCH_INDEX_PATH
+from api.semantic_search.vector_index import CompanyVectorIndex
+
+
+class Command(BaseCommand):
+    help = "Compares the scores and latency of each inference backend against the torch models on the indexed companies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', choices=INFERENCE_BACKENDS, default=list(INFERENCE_BACKENDS))
+        parser.add_argument('--queries', type=int, default=50,
+                            help="Number of indexed company titles used as queries when no --queries-file is given.")
+        parser.add_argument('--queries-file', help="Text file with one search query per line.")
+        parser.add_argument('--json', help="Also write the report to this json file.")
+
+    def handle(self, *args, **options):
+        if CompanyVectorIndex.signature(SEARCH_INDEX_PATH) is None:
+            raise CommandError("No search index found. Run build_search_index first.")
+        index = CompanyVectorIndex.load(SEARCH_INDEX_PATH)
+
+        if options['queries_file']:
+            with open(options['queries_file']) as f:
+                queries = [line.strip() for line in f if line.strip()]
+        else:
+            rng = np.random.default_rng(0)
+            rows = rng.choice(len(index), size=min(options['queries'], len(index)), replace=False)
+            queries = [index.title(int(row)) for row in rows]
+
+        backends = {"torch": (create_embedder("torch"), create_ranker("torch"))}
+        for backend in options['backends']:
+            if backend not in backends:
+                try:
+                    backends[backend] = (create_embedder(backend), create_ranker(backend))
+                except (ImportError, FileNotFoundError) as e:
+                    self.stderr.write(f"Skipping {backend}: {e}")
+
+        # Every backend reranks the same candidates, retrieved with the torch embeddings.
+        embedder = backends["torch"][0]
+        candidates = [SemanticSearchEngine.retrieve(index, embedding, DENSE_RETRIEVER_TOP_K)
+                      for embedding in embedder.embed_queries(queries)]
+        report = compare_backends(backends, queries, candidates, top_k=NUM_OF_RESULTS_TO_RETURN)
+
+        self.stdout.write(f"{len(queries)} queries, {DENSE_RETRIEVER_TOP_K} candidates reranked per query")
+        self.stdout.write(f"{'backend':<11}{'cos min':>9}{'cos mean':>10}{'top-k':>8}{'score diff':>12}"
+                          f"{'embed p50':>11}{'embed p95':>11}{'rank p50':>10}{'rank p95':>10}")
+        for row in report:
+            self.stdout.write(f"{row['backend']:<11}{row['embedding_cosine_min']:>9.4f}"
+                              f"{row['embedding_cosine_mean']:>10.4f}{row['rerank_top_k_agreement']:>8.3f}"
+                              f"{row['rerank_max_score_diff']:>12.4f}{row['embed_p50_ms']:>11.2f}"
+                              f"{row['embed_p95_ms']:>11.2f}{row['rerank_p50_ms']:>10.2f}{row['rerank_p95_ms']:>10.2f}")
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({"queries": len(queries), "candidates": DENSE_RETRIEVER_TOP_K, "report": report}, f, indent=2)
@@ -0,0 +1,63 @@
+import json
+import tempfile
+from django.core.management.base import BaseCommand, CommandError
+from api.semantic_search.ann import INDEX_TYPES
+from api.semantic_search.benchmark import EXPANSIONS, compare_reports, run_benchmark
+from api.semantic_search.inference import INFERENCE_BACKENDS
+from api.semantic_search.rerank import RERANK_POLICIES
+from api.semantic_search.semantic_search import DENSE_RETRIEVER_TOP_K, NUM_OF_RESULTS_TO_RETURN
+
+
+class Command(BaseCommand):
+    help = ("Measures the relevance (recall, nDCG, MRR) and latency of the semantic search on a synthetic portfolio "
+            "with labelled queries, for each combination of the given settings. Needs neither the database nor the "
+            "network with the default stub models.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--index-types', nargs='+', choices=INDEX_TYPES, default=list(INDEX_TYPES))
+        parser.add_argument('--rerank-policies', nargs='+', choices=RERANK_POLICIES, default=["adaptive"])
+        parser.add_argument('--rerank-depths', nargs='+', type=int, default=[DENSE_RETRIEVER_TOP_K],
+                            help="Candidates reranked by the cross-encoder per query.")
+        parser.add_argument('--expansions', nargs='+', choices=EXPANSIONS, default=["off", "stub"],
+                            help="stub replaces the language model with a local keyword expansion.")
+        parser.add_argument('--caches', nargs='+', choices=["on", "off"], default=["off", "on"])
+        parser.add_argument('--models', choices=("stub",) + INFERENCE_BACKENDS, default="stub",
+                            help="stub uses hashed word vectors and word overlap instead of the search models.")
+        parser.add_argument('--companies', type=int, default=480, help="Size of the synthetic portfolio.")
+        parser.add_argument('--repeat', type=int, default=2, help="Times each query is searched.")
+        parser.add_argument('--llm-latency-ms', type=float, default=0, help="Latency of the stub language model.")
+        parser.add_argument('--json', help="Write the report to this json file.")
+        parser.add_argument('--baseline', help="Report to compare with. Exits with an error on regressions.")
+        parser.add_argument('--max-quality-drop', type=float, default=0.02)
+        parser.add_argument('--max-latency-ratio', type=float, default=1.5, help="0 does not compare latency.")
+
+    def handle(self, *args, **options):
+        if min(options['rerank_depths']) < NUM_OF_RESULTS_TO_RETURN:
+            raise CommandError(f"Rerank depths must be at least {NUM_OF_RESULTS_TO_RETURN}, the number of results.")
+
+        self.stdout.write(f"{'configuration':<48}{'recall':>8}{'ndcg':>8}{'mrr':>8}"
+                          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'qps':>9}")
+
+        def progress(result):
+            self.stdout.write(f"{result['name']:<48}{result['recall']:>8.3f}{result['ndcg']:>8.3f}"
+                              f"{result['mrr']:>8.3f}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+                              f"{result['p99_ms']:>9.2f}{result['qps']:>9.1f}")
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            report = run_benchmark(
+                work_dir, options['index_types'], options['rerank_policies'], options['rerank_depths'],
+                options['expansions'], [cache == "on" for cache in options['caches']], models=options['models'],
+                companies=options['companies'], repeat=options['repeat'], llm_latency_ms=options['llm_latency_ms'],
+                progress=progress,
+            )
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = compare_reports(report, baseline, options['max_quality_drop'], options['max_latency_ratio'])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
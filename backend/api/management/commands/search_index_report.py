@@ -0,0 +1,45 @@
+import json
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from api.semantic_search.ann import INDEX_TYPES, compare_index_types
+from api.semantic_search.semantic_search import DENSE_RETRIEVER_TOP_K, SEARCH_INDEX_PATH
+from api.semantic_search.vector_index import CompanyVectorIndex
+
+
+class Command(BaseCommand):
+    help = "Compares the recall and latency of each FAISS index type against exact (Flat) search on the indexed companies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=DENSE_RETRIEVER_TOP_K, help="Results per query to compare.")
+        parser.add_argument('--queries', type=int, default=200,
+                            help="Number of indexed documents used as queries when no --queries-file is given.")
+        parser.add_argument('--queries-file', help="Text file with one search query per line, embedded with the model.")
+        parser.add_argument('--index-types', nargs='+', choices=INDEX_TYPES, default=list(INDEX_TYPES))
+        parser.add_argument('--json', help="Also write the report to this json file.")
+
+    def handle(self, *args, **options):
+        if CompanyVectorIndex.signature(SEARCH_INDEX_PATH) is None:
+            raise CommandError("No search index found. Run build_search_index first.")
+
+        # The index files keep the exact vectors, whatever index type was built over them.
+        vectors = np.array(CompanyVectorIndex.load(SEARCH_INDEX_PATH).vectors)
+        if options['queries_file']:
+            from api.semantic_search.inference import create_embedder
+            with open(options['queries_file']) as f:
+                query_texts = [line.strip() for line in f if line.strip()]
+            queries = create_embedder().embed_queries(query_texts)
+        else:
+            rng = np.random.default_rng(0)
+            queries = vectors[rng.choice(len(vectors), size=min(options['queries'], len(vectors)), replace=False)]
+
+        report = compare_index_types(vectors, queries, k=options['k'], index_types=options['index_types'])
+
+        self.stdout.write(f"{len(vectors)} vectors, {len(queries)} queries, k={options['k']}")
+        self.stdout.write(f"{'index':<8}{'built as':<24}{'recall@k':>10}{'build s':>10}{'mean ms':>10}{'p95 ms':>10}")
+        for row in report:
+            self.stdout.write(f"{row['index_type']:<8}{row['built_as']:<24}{row['recall_at_k']:>10.3f}"
+                              f"{row['build_seconds']:>10.3f}{row['mean_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({"vectors": len(vectors), "queries": len(queries), "k": options['k'], "report": report}, f,
+                          indent=2)
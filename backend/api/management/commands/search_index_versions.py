@@ -0,0 +1,43 @@
+import json
+import os
+from datetime import datetime
+from django.core.management.base import BaseCommand, CommandError
+from api.semantic_search.semantic_search import SEARCH_INDEX_PATH
+from api.semantic_search.vector_index import (META_FILE, activate_version, current_version, list_versions,
+                                              rollback_version, version_path)
+
+
+class Command(BaseCommand):
+    help = "Lists the versions of the semantic search index, or switches the active one."
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--activate', metavar='VERSION', help="Make this version the active one.")
+        group.add_argument('--rollback', action='store_true',
+                           help="Go back to the version written before the active one.")
+        group.add_argument('--rollback-build', action='store_true',
+                           help="Go back to the last full build before the active version, undoing company updates.")
+
+    def handle(self, *args, **options):
+        try:
+            if options['activate']:
+                activate_version(SEARCH_INDEX_PATH, options['activate'])
+            elif options['rollback']:
+                rollback_version(SEARCH_INDEX_PATH)
+            elif options['rollback_build']:
+                rollback_version(SEARCH_INDEX_PATH, to_build=True)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        versions = list_versions(SEARCH_INDEX_PATH)
+        if not versions:
+            raise CommandError("No search index versions found. Run build_search_index first.")
+        current = current_version(SEARCH_INDEX_PATH)
+        for version in reversed(versions):
+            with open(os.path.join(version_path(SEARCH_INDEX_PATH, version), META_FILE)) as f:
+                meta = json.load(f)
+            created_at = datetime.fromtimestamp(meta["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+            kind = "update" if meta.get("update") else "build"
+            line = (f"{'*' if version == current else ' '} {version}  {meta['count']} rows  {meta['index_type']}  "
+                    f"{kind}  {created_at}")
+            self.stdout.write(self.style.SUCCESS(line) if version == current else line)
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:20
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_userfeed'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddConstraint(
+            model_name='company',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('company'), name='unique_company_name_upper', violation_error_message='A company with this name already exists.'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('company'), name='gin_trgm_ops'), name='company_name_trgm'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from backend.validators import ContactNumberValidator, NameValidator
 
 
@@ -74,6 +76,18 @@ class User(AbstractBaseUser):
     def has_module_perms(self, app_label):
         return self.is_active and (self.is_superuser or self.is_staff)
 
+
+class UserFeed(models.Model):
+    # Companies recommended to a user from their interests, see semantic_search/feeds.py.
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='feed')
+    interest_ids = models.JSONField(default=list)  # Interests the feed was computed from, sorted.
+    results = models.JSONField(default=list)  # [{"id": company id, "company": name, "score": score}], best first.
+    index_version = models.CharField(max_length=100, blank=True)  # Search index the feed was computed from.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Feed of {self.user}"
+
 # Model for Tech Sectors
 
 
@@ -143,9 +157,23 @@ class Company(models.Model):
         return self.company
 
     def save(self, *args, **kwargs):
-        if Company.objects.filter(company__iexact=self.company).exclude(pk=self.pk).exists():
+        if Company.name_exists(self.company, exclude_pk=self.pk):
             raise ValidationError(f"A company with the name '{self.company}' already exists.")
         super().save(*args, **kwargs)
 
+    @classmethod
+    def name_exists(cls, name, exclude_pk=None):
+        # Case-insensitive, a lookup of the unique index on UPPER(company).
+        return cls.objects.filter(company__iexact=name).exclude(pk=exclude_pk).exists()
+
     class Meta:
         verbose_name_plural = "companies"
+        constraints = [
+            # iexact lookups compare UPPER(company), so this index also serves name lookups and uniqueness checks.
+            models.UniqueConstraint(Upper('company'), name='unique_company_name_upper',
+                                    violation_error_message="A company with this name already exists."),
+        ]
+        indexes = [
+            # Trigram index for the prefix and fuzzy name searches, see CompanyViewSet.search.
+            GinIndex(OpClass(Upper('company'), name='gin_trgm_ops'), name='company_name_trgm'),
+        ]
@@ -0,0 +1,45 @@
+from os import getenv
+from rest_framework.pagination import CursorPagination
+from .semantic_search.cache import LRUCache
+
+# Companies per page by default, and the most a client can ask for with page_size.
+COMPANY_PAGE_SIZE = 6
+COMPANY_MAX_PAGE_SIZE = int(getenv('COMPANY_MAX_PAGE_SIZE', 60))
+# Time to live (in seconds) of the company counts returned with count=true. Counts are also dropped on company edits.
+COMPANY_COUNT_CACHE_TTL = int(getenv('COMPANY_COUNT_CACHE_TTL', 300))
+
+# Counts by filtered query, shared by the requests of this process.
+company_count_cache = LRUCache(256, COMPANY_COUNT_CACHE_TTL)
+
+
+def get_cached_count(queryset):
+    # Number of rows of `queryset`, counted once per query and cache ttl.
+    key = queryset.values('pk').query.sql_with_params()
+    count = company_count_cache.get(key)
+    if count is None:
+        count = queryset.count()
+        company_count_cache.set(key, count)
+    return count
+
+
+class CompanyCursorPagination(CursorPagination):
+    '''
+        Pages companies by id after the last company of the previous page, so every page costs the same query
+        however far the client scrolled. No count is run unless the client asks for it with count=true.
+    '''
+    ordering = 'id'
+    page_size = COMPANY_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = COMPANY_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get('count', '').lower() == 'true':
+            self.count = get_cached_count(queryset.order_by().prefetch_related(None))
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count is not None:
+            response.data['count'] = self.count
+        return response
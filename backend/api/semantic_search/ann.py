@@ -0,0 +1,178 @@
+import logging
+import math
+import time
+from os import getenv
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Type of FAISS index built for the semantic search: "Flat" (exact), "HNSW" or "IVFPQ" (both approximate).
+INDEX_TYPE = getenv('SEMANTIC_SEARCH_INDEX_TYPE', 'Flat')
+INDEX_TYPES = ("Flat", "HNSW", "IVFPQ")
+HNSW_M = int(getenv('SEMANTIC_SEARCH_HNSW_M', 32))  # Links per node.
+HNSW_EF_CONSTRUCTION = int(getenv('SEMANTIC_SEARCH_HNSW_EF_CONSTRUCTION', 80))
+HNSW_EF_SEARCH = int(getenv('SEMANTIC_SEARCH_HNSW_EF_SEARCH', 64))  # Higher is more accurate and slower.
+IVF_NLIST = int(getenv('SEMANTIC_SEARCH_IVF_NLIST', 0))  # Number of clusters, 0 picks 4 * sqrt(number of documents).
+IVF_NPROBE = int(getenv('SEMANTIC_SEARCH_IVF_NPROBE', 8))  # Clusters visited per search. Higher is more accurate.
+PQ_M = int(getenv('SEMANTIC_SEARCH_PQ_M', 48))  # Sub-quantizers, must divide the embedding dimension.
+PQ_NBITS = int(getenv('SEMANTIC_SEARCH_PQ_NBITS', 8))
+IVF_TRAINING_SAMPLE = int(getenv('SEMANTIC_SEARCH_IVF_TRAINING_SAMPLE', 20000))  # Documents used to train IVF-PQ.
+FILTER_MAX_WIDEN = 8  # Most efSearch or nprobe are multiplied by for a filtered search.
+
+
+def default_nlist(document_count):
+    return max(1, int(4 * math.sqrt(document_count)))
+
+
+def min_training_size(index_type, document_count, nlist=None, pq_nbits=PQ_NBITS):
+    # k-means needs at least one training vector per centroid, for the IVF clusters and for each PQ codebook.
+    if index_type != "IVFPQ":
+        return 0
+    return max(nlist or IVF_NLIST or default_nlist(document_count), 2 ** pq_nbits)
+
+
+def create_faiss_index(index_type, embedding_dim, document_count=0, hnsw_m=HNSW_M,
+                       hnsw_ef_construction=HNSW_EF_CONSTRUCTION, nlist=None, pq_m=PQ_M, pq_nbits=PQ_NBITS):
+    '''
+        Creates an empty inner product index of the given type. IVFPQ indexes have to be trained before vectors are added.
+        Falls back to Flat when there are too few documents to train IVFPQ.
+    '''
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Options: {', '.join(INDEX_TYPES)}")
+
+    if index_type == "IVFPQ" and document_count < min_training_size(index_type, document_count, nlist, pq_nbits):
+        logger.warning("%s documents are too few to train an IVFPQ index, using Flat instead", document_count)
+        index_type = "Flat"
+
+    if index_type == "HNSW":
+        index = faiss.IndexHNSWFlat(embedding_dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = hnsw_ef_construction
+    elif index_type == "IVFPQ":
+        nlist = nlist or IVF_NLIST or default_nlist(document_count)
+        index = faiss.index_factory(embedding_dim, f"IVF{nlist},PQ{pq_m}x{pq_nbits}", faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.IndexFlatIP(embedding_dim)
+    set_search_parameters(index)
+    return index
+
+
+def get_ivf(index):
+    if not isinstance(index, faiss.Index):
+        return None
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def set_search_parameters(index, ef_search=HNSW_EF_SEARCH, nprobe=IVF_NPROBE):
+    # Search time parameters are not part of every saved index, so they are applied after each load.
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+    ivf = get_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+
+
+def filtered_search_parameters(index, selector, selectivity=1.0, ef_search=HNSW_EF_SEARCH, nprobe=IVF_NPROBE):
+    '''
+        Search parameters restricting a search to the ids accepted by `selector`. HNSW and IVF look further when
+        only a `selectivity` share of the vectors is accepted, so they still find the top k among them.
+    '''
+    widen = min(1 / max(selectivity, 1e-6), FILTER_MAX_WIDEN)
+    if isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = int(ef_search * widen)
+    elif get_ivf(index) is not None:
+        params = faiss.SearchParametersIVF()
+        params.nprobe = min(int(nprobe * widen), get_ivf(index).nlist)
+    else:
+        params = faiss.SearchParameters()
+    params.sel = selector
+    return params
+
+
+def replace_vectors(index, removed_ids, vectors):
+    '''
+        Removes the vectors labelled `removed_ids` from a Flat or IVF index, renumbers the others so the labels stay
+        0 to ntotal - 1 in the same order and appends `vectors` after them. Nothing is trained again.
+        Returns False, leaving the index as it is, for HNSW indexes, whose graph can not drop vectors.
+    '''
+    if isinstance(index, faiss.IndexHNSW):
+        return False
+    removed_ids = np.unique(np.asarray(removed_ids, dtype=np.int64))
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, index.d)
+    ivf = get_ivf(index)
+    if len(removed_ids):
+        # Flat indexes shift the following vectors down themselves, IVF lists keep the labels they were added with.
+        index.remove_ids(removed_ids)
+        if ivf is not None:
+            renumber_ivf(ivf, removed_ids)
+    if ivf is not None:
+        index.add_with_ids(vectors, np.arange(index.ntotal, index.ntotal + len(vectors), dtype=np.int64))
+    else:
+        index.add(vectors)
+    return True
+
+
+def renumber_ivf(ivf, removed_ids):
+    # Lowers every label of the inverted lists by the number of `removed_ids` (sorted) below it.
+    invlists = ivf.invlists
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if not size:
+            continue
+        ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy()
+        codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size).copy()
+        ids -= np.searchsorted(removed_ids, ids)
+        invlists.update_entries(list_no, 0, size, faiss.swig_ptr(ids), faiss.swig_ptr(codes))
+
+
+def reconstruct_all(index):
+    # IVF indexes need a direct map to look vectors up by id. PQ vectors come back approximated.
+    ivf = get_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def compare_index_types(vectors, queries, k=10, index_types=INDEX_TYPES, **index_params):
+    '''
+        Builds every index type over `vectors` and compares its results for `queries` with the exact (Flat) results.
+        Returns one row per index type with the recall@k, the build time and the per query latency in milliseconds.
+    '''
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    dim = vectors.shape[1]
+    exact_index = faiss.IndexFlatIP(dim)
+    exact_index.add(vectors)
+    _, exact_ids = exact_index.search(queries, k)
+
+    report = []
+    for index_type in index_types:
+        build_start = time.perf_counter()
+        index = create_faiss_index(index_type, dim, len(vectors), **index_params)
+        if not index.is_trained:
+            sample = vectors[np.random.default_rng(0).permutation(len(vectors))[:IVF_TRAINING_SAMPLE]]
+            index.train(sample)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - build_start
+
+        latencies = []
+        hits = 0
+        for query, expected_ids in zip(queries, exact_ids):
+            search_start = time.perf_counter()
+            _, ids = index.search(query.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - search_start) * 1000)
+            hits += len(set(ids[0]) & set(expected_ids[expected_ids != -1]))
+
+        report.append({
+            "index_type": index_type,
+            "built_as": type(index).__name__,
+            "recall_at_k": hits / max(1, (exact_ids != -1).sum()),
+            "build_seconds": build_seconds,
+            "mean_ms": float(np.mean(latencies)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        })
+    return report
@@ -0,0 +1,72 @@
+import asyncio
+import contextvars
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import getenv
+from api.semantic_search.semantic_search import (DENSE_RETRIEVER_TOP_K, NUM_OF_RESULTS_TO_RETURN, finish_search,
+                                                 get_cached_search)
+
+logger = logging.getLogger(__name__)
+
+# Threads running the embedding model and the cross-encoder for async searches.
+INFERENCE_WORKERS = int(getenv('SEMANTIC_SEARCH_INFERENCE_WORKERS', 2))
+# Searches of one process expanding or running inference at the same time, the others wait for a slot.
+MAX_CONCURRENT_SEARCHES = int(getenv('SEMANTIC_SEARCH_MAX_CONCURRENT_SEARCHES', 32))
+
+_inference_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="search-inference")
+# asyncio semaphores belong to one event loop, each loop gets its own and drops it when it is garbage collected.
+_search_slots = weakref.WeakKeyDictionary()
+
+
+def get_search_slots():
+    loop = asyncio.get_running_loop()
+    slots = _search_slots.get(loop)
+    if slots is None:
+        slots = _search_slots[loop] = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+    return slots
+
+
+async def run_inference(function, *args, **kwargs):
+    # run_in_executor does not pass the context on, the spans of the function are timed for the calling request.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _inference_executor, partial(context.run, function, *args, **kwargs))
+
+
+async def search_companies_async(query, filters=None):
+    '''
+        search_companies for async views. The remote query expansion is awaited on the event loop and the models
+        run in the bounded inference executor, so waiting searches do not hold a thread each.
+    '''
+    from api.semantic_search.engine import get_search_engine, SearchIndexNotFound
+    from api.semantic_search.facet_index import normalize_filters
+    from api.semantic_search.query_expansion import expand_query_async
+    from api.semantic_search.timing import EXPAND, span
+
+    if query is None or query == "":
+        return None
+
+    search_engine = get_search_engine()
+    if not search_engine.is_loaded():
+        try:
+            await run_inference(search_engine.ensure_loaded)
+        except SearchIndexNotFound as e:
+            return str(e)
+
+    filters = normalize_filters(filters)
+    cache_key, results = get_cached_search(search_engine, query, filters)
+    if results is not None:
+        return results
+
+    async with get_search_slots():
+        generated_description, expansion_fell_back = query, False
+        matches = await run_inference(search_engine.keyword_match, query, NUM_OF_RESULTS_TO_RETURN, filters)
+        if matches is None:
+            with span(EXPAND):
+                generated_description, expansion_fell_back = await expand_query_async(query)
+        documents = await run_inference(search_engine.search, generated_description,
+                                        top_k_retrieve=DENSE_RETRIEVER_TOP_K, top_k_rank=NUM_OF_RESULTS_TO_RETURN,
+                                        keyword_query=query, filters=filters)
+    return finish_search(search_engine, cache_key, generated_description, documents, matches, expansion_fell_back)
@@ -0,0 +1,380 @@
+import itertools
+import math
+import os
+import random
+import re
+import time
+import zlib
+import numpy as np
+from haystack.schema import Document
+from api.semantic_search.cache import LRUCache
+from api.semantic_search.engine import SemanticSearchEngine
+from api.semantic_search.facet_index import FacetIndexWriter
+from api.semantic_search.keyword_index import KEYWORD_FIELDS, KeywordIndexWriter
+from api.semantic_search.query_expansion import KeywordExpander, NoOpExpander, QueryExpander, get_query_expander
+from api.semantic_search.rerank import RerankPolicy
+from api.semantic_search.semantic_search import (CHUNK_FIELDS, EMBEDDING_DIM, NUM_OF_RESULTS_TO_RETURN,
+                                                 create_company_chunk_document, create_company_document,
+                                                 search_companies)
+from api.semantic_search.timing import timed_search
+from api.semantic_search.vector_index import CompanyVectorIndex, VectorIndexWriter
+
+REPORT_FORMAT = 1
+# Query expansion of a configuration: "off", "stub" (local stand-in for the language model) or a backend name.
+EXPANSIONS = ("off", "stub", "keyword", "remote")
+QUALITY_METRICS = ("recall", "ndcg", "mrr")
+
+# Synthetic portfolio: each sector has a description and products, each product the words describing it.
+SECTORS = {
+    "Fintech": ("financial technology", {
+        "payments": "card payments, checkout and payouts for online merchants",
+        "lending": "credit scoring and loans for small businesses",
+        "accounting": "bookkeeping, invoicing and expense management software",
+    }),
+    "Healthtech": ("healthcare technology", {
+        "diagnostics": "medical imaging diagnostics with machine learning",
+        "telehealth": "remote doctor consultations and patient monitoring",
+        "pharmacy": "prescription delivery and pharmacy inventory management",
+    }),
+    "Climate": ("clean energy and sustainability", {
+        "solar": "solar panel installation, financing and monitoring",
+        "carbon": "carbon accounting and emissions reporting for enterprises",
+        "batteries": "grid scale battery storage and energy trading",
+    }),
+    "Logistics": ("supply chain and transportation", {
+        "freight": "freight brokerage and truck route optimisation",
+        "warehousing": "warehouse robotics and inventory tracking",
+        "delivery": "last mile parcel delivery and courier dispatch",
+    }),
+    "Edtech": ("education technology", {
+        "tutoring": "online tutoring and homework help for students",
+        "language": "language learning apps with speech recognition",
+        "upskilling": "corporate training and coding bootcamps",
+    }),
+    "Cybersecurity": ("security and data protection", {
+        "identity": "identity and access management with single sign on",
+        "threats": "threat detection and incident response for cloud workloads",
+        "privacy": "data privacy compliance and consent management",
+    }),
+    "Agritech": ("agriculture and food technology", {
+        "farming": "precision farming with drones and soil sensors",
+        "proteins": "plant based meat and alternative proteins",
+        "foodwaste": "food waste reduction for restaurants and grocers",
+    }),
+    "Proptech": ("real estate technology", {
+        "rentals": "rental property management and tenant screening",
+        "construction": "construction project planning and site monitoring",
+        "mortgages": "digital mortgages and online home buying",
+    }),
+}
+CITIES = ("Singapore", "London", "New York", "Berlin", "Jakarta", "Sydney")
+STAGES = ("Seed", "Series A", "Series B", "Growth")
+CUSTOMERS = ("banks", "hospitals", "retailers", "universities", "governments", "manufacturers")
+NAME_PREFIXES = ("Nova", "Blue", "Quant", "Green", "Bright", "Hyper", "Open", "True", "Deep", "Swift", "Clear", "Prime")
+NAME_SUFFIXES = ("ly", "io", "Labs", "AI", "Works", "Stack", "Base", "Flow", "Grid", "Path", "Loop", "Ware")
+FIRST_NAMES = ("Aisha", "Ben", "Chen", "Dana", "Elif", "Farid", "Grace", "Hiro", "Ines", "Jonas", "Kemi", "Luca")
+LAST_NAMES = ("Tan", "Okafor", "Muller", "Silva", "Nguyen", "Cohen", "Haddad", "Larsen", "Wong", "Patel")
+
+# Labelled queries: (query, sector, product). The companies of the product are highly relevant (grade 2) and the
+# other companies of the sector relevant (grade 1). Sector queries have no product, all the sector is grade 2.
+QUERIES = (
+    ("payment processing for e-commerce stores", "Fintech", "payments"),
+    ("loans for small businesses", "Fintech", "lending"),
+    ("invoice and expense software", "Fintech", "accounting"),
+    ("AI for medical scans", "Healthtech", "diagnostics"),
+    ("virtual doctor visits", "Healthtech", "telehealth"),
+    ("online pharmacy", "Healthtech", "pharmacy"),
+    ("solar energy startups", "Climate", "solar"),
+    ("measure company emissions", "Climate", "carbon"),
+    ("energy storage batteries", "Climate", "batteries"),
+    ("trucking and freight", "Logistics", "freight"),
+    ("robots in warehouses", "Logistics", "warehousing"),
+    ("parcel delivery", "Logistics", "delivery"),
+    ("tutoring for kids", "Edtech", "tutoring"),
+    ("learn a new language", "Edtech", "language"),
+    ("coding bootcamp", "Edtech", "upskilling"),
+    ("single sign on", "Cybersecurity", "identity"),
+    ("cloud threat detection", "Cybersecurity", "threats"),
+    ("privacy consent tools", "Cybersecurity", "privacy"),
+    ("drones for farms", "Agritech", "farming"),
+    ("plant based meat", "Agritech", "proteins"),
+    ("reduce restaurant food waste", "Agritech", "foodwaste"),
+    ("property management software", "Proptech", "rentals"),
+    ("construction site monitoring", "Proptech", "construction"),
+    ("buy a home online", "Proptech", "mortgages"),
+    ("fintech", "Fintech", None),
+    ("climate tech", "Climate", None),
+)
+NAME_QUERIES = 4  # Company names searched as queries, each with its company as the only relevant result.
+
+
+def synthetic_companies(count=480, seed=0):
+    '''
+        Deterministic synthetic portfolio of `count` companies, as dicts with the Company fields that are indexed
+        and the sector, product and city used to label the queries.
+    '''
+    rng = random.Random(seed)
+    names = [prefix + suffix for prefix, suffix in itertools.product(NAME_PREFIXES, NAME_SUFFIXES)]
+    rng.shuffle(names)
+    companies = []
+    for i in range(count):
+        sector = list(SECTORS)[i % len(SECTORS)]
+        sector_words, products = SECTORS[sector]
+        product = rng.choice(sorted(products))
+        name = names[i % len(names)] + (f" {i // len(names) + 1}" if i >= len(names) else "")
+        city = rng.choice(CITIES)
+        companies.append({
+            "id": i + 1,
+            "company": name,
+            "description": f"{name} is a {sector_words} company from {city}. It provides {products[product]}.",
+            "tech_sector": sector,
+            "products": f"{products[product]}, used by {rng.choice(CUSTOMERS)}",
+            "customers_partners": ", ".join(rng.sample(CUSTOMERS, 2)),
+            "founders": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "sector": sector,
+            "product": product,
+            "city": city,
+            "stage": rng.choice(STAGES),
+        })
+    return companies
+
+
+def labelled_queries(companies, seed=0):
+    # [(query, {company id: relevance grade})] for QUERIES and NAME_QUERIES company names.
+    queries = []
+    for query, sector, product in QUERIES:
+        relevance = {}
+        for company in companies:
+            if company["sector"] == sector:
+                relevance[company["id"]] = 2 if product is None or company["product"] == product else 1
+        queries.append((query, relevance))
+    for company in random.Random(seed).sample(companies, min(NAME_QUERIES, len(companies))):
+        queries.append((company["company"], {company["id"]: 2}))
+    return queries
+
+
+def recall_at_k(ranked_ids, relevance, k):
+    # Share of the highly relevant companies found in the top k, out of the most that fit in k results.
+    relevant = {company_id for company_id, grade in relevance.items() if grade == max(relevance.values())}
+    return len(relevant & set(ranked_ids[:k])) / min(k, len(relevant)) if relevant else 0.0
+
+
+def ndcg_at_k(ranked_ids, relevance, k):
+    dcg = sum((2 ** relevance.get(company_id, 0) - 1) / math.log2(rank + 2)
+              for rank, company_id in enumerate(ranked_ids[:k]))
+    ideal = sorted(relevance.values(), reverse=True)[:k]
+    ideal_dcg = sum((2 ** grade - 1) / math.log2(rank + 2) for rank, grade in enumerate(ideal))
+    return dcg / ideal_dcg if ideal_dcg else 0.0
+
+
+def reciprocal_rank(ranked_ids, relevance):
+    return next((1 / (rank + 1) for rank, company_id in enumerate(ranked_ids) if relevance.get(company_id)), 0.0)
+
+
+def _tokens(text):
+    return re.findall(r"\w+", text.lower())
+
+
+class StubEmbedder:
+    '''
+        Hashed bag of words and character trigrams, so the benchmark runs without the embedding model.
+        Close spellings ("payment", "payments") get close vectors, synonyms do not.
+    '''
+
+    def __init__(self, dim=EMBEDDING_DIM):
+        self.dim = dim
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in _tokens(text):
+            features = [token] + [token[i:i + 3] for i in range(max(len(token) - 2, 1))]
+            for feature in features:
+                vector[zlib.crc32(feature.encode()) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def embed_queries(self, queries):
+        return np.array([self.embed(query) for query in queries])
+
+    def embed_documents(self, documents):
+        return np.array([self.embed(document.content) for document in documents])
+
+
+class StubRanker:
+    '''
+        Stands in for the cross-encoder: scores a document by the share of the query words it contains.
+    '''
+
+    def predict(self, query, documents, top_k=None):
+        terms = set(_tokens(query))
+        ranked = []
+        for document in documents:
+            words = set(_tokens(document.content))
+            score = len(terms & words) / len(terms) if terms else 0.0
+            ranked.append(Document(content=document.content, meta=document.meta, score=score))
+        return sorted(ranked, key=lambda document: document.score, reverse=True)[:top_k]
+
+    def predict_batch(self, queries, documents, top_k=None):
+        return [self.predict(query, query_documents, top_k) for query, query_documents in zip(queries, documents)]
+
+
+class StubLLMExpander(QueryExpander):
+    '''
+        Local stand-in for the remote language model: the keyword expansion after `latency_ms` of waiting.
+    '''
+    name = "stub"
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+
+    def expand(self, query):
+        time.sleep(self.latency_ms / 1000)
+        return KeywordExpander().expand(query)
+
+
+def create_models(models):
+    # (embedder, ranker) of "stub" or an inference backend.
+    if models == "stub":
+        return StubEmbedder(), StubRanker()
+    from api.semantic_search.inference import create_embedder, create_ranker
+    return create_embedder(models), create_ranker(models)
+
+
+def create_expander(expansion, llm_latency_ms=0):
+    if expansion == "off":
+        return NoOpExpander()
+    if expansion == "stub":
+        return StubLLMExpander(llm_latency_ms)
+    return get_query_expander(expansion)
+
+
+def company_documents(companies):
+    # Main documents first, then the CHUNK_FIELDS texts, like index_builder.preprocess_company_documents.
+    documents = [create_company_document(company["id"], company["company"], company["description"],
+                                         company["tech_sector"]) for company in companies]
+    for company in companies:
+        for field in CHUNK_FIELDS:
+            if company.get(field):
+                chunk = create_company_chunk_document(company["id"], company["company"], field, company[field])
+                chunk.content = f"{company['company']}: {chunk.content}"
+                documents.append(chunk)
+    return documents
+
+
+def build_benchmark_index(path, companies, embedder, index_type):
+    '''
+        Writes the search index of the synthetic companies to `path`, with its keyword and facet indexes.
+        Returns the seconds it took, embedding included.
+    '''
+    start = time.perf_counter()
+    documents = company_documents(companies)
+    keywords = KeywordIndexWriter().add_companies(
+        (company["id"], {field: company.get(field) for field in KEYWORD_FIELDS}) for company in companies)
+    facets = FacetIndexWriter().add_companies(
+        (company["id"], {"tech_sectors": [company["sector"]], "hq_main_offices": [company["city"]],
+                         "finance_stages": [company["stage"]], "status": ["active"]}) for company in companies)
+    with VectorIndexWriter(path, EMBEDDING_DIM) as writer:
+        writer.add_documents(documents, embedder.embed_documents(documents))
+        writer.finish(index_type, keywords=keywords, facets=facets)
+    return time.perf_counter() - start
+
+
+def config_name(config):
+    return (f"{config['index_type']}/{config['rerank']}@{config['rerank_depth']}"
+            f"/expansion={config['expansion']}/cache={'on' if config['cache'] else 'off'}")
+
+
+def run_config(index_path, queries, config, embedder, ranker, expander, repeat=1, k=NUM_OF_RESULTS_TO_RETURN):
+    '''
+        Runs the labelled queries `repeat` times through search_companies with one configuration.
+        Quality is measured on the first pass, latency on every pass.
+    '''
+    engine = SemanticSearchEngine(index_path, embedder=embedder, ranker=ranker,
+                                  rerank_policy=RerankPolicy(config["rerank"]))
+    if not config["cache"]:
+        engine.result_cache = LRUCache(0)
+        engine.embedding_cache = LRUCache(0)
+    engine.load()
+
+    latencies, quality, rerank_paths, stages = [], {metric: [] for metric in QUALITY_METRICS}, {}, {}
+    start = time.perf_counter()
+    for repetition in range(repeat):
+        for query, relevance in queries:
+            query_start = time.perf_counter()
+            with timed_search("benchmark") as timings:
+                results = search_companies(query, search_engine=engine, expander=expander,
+                                           top_k_retrieve=config["rerank_depth"])
+            latencies.append((time.perf_counter() - query_start) * 1000)
+            for stage, duration_ms in timings.stages().items():
+                stages[stage] = stages.get(stage, 0.0) + duration_ms
+            if repetition == 0:
+                ranked_ids = [result["id"] for result in results]
+                quality["recall"].append(recall_at_k(ranked_ids, relevance, k))
+                quality["ndcg"].append(ndcg_at_k(ranked_ids, relevance, k))
+                quality["mrr"].append(reciprocal_rank(ranked_ids, relevance))
+                rerank_paths[results.rerank] = rerank_paths.get(results.rerank, 0) + 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        "name": config_name(config),
+        "config": config,
+        **{metric: float(np.mean(values)) for metric, values in quality.items()},
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "qps": len(latencies) / elapsed if elapsed else 0.0,
+        "rerank_paths": rerank_paths,
+        "stages_ms": {stage: total / len(latencies) for stage, total in stages.items()},
+    }
+
+
+def run_benchmark(work_dir, index_types, rerank_policies, rerank_depths, expansions, caches, models="stub",
+                  companies=480, repeat=2, llm_latency_ms=0, seed=0, progress=None):
+    '''
+        Builds the synthetic index once per index type in `work_dir`, then runs every combination of the
+        configuration values. Returns the report, a json serializable dict.
+    '''
+    corpus = synthetic_companies(companies, seed)
+    queries = labelled_queries(corpus, seed)
+    embedder, ranker = create_models(models)
+
+    indexes, results = {}, []
+    for index_type in index_types:
+        index_path = os.path.join(work_dir, index_type)
+        build_seconds = build_benchmark_index(index_path, corpus, embedder, index_type)
+        index = CompanyVectorIndex.load(index_path)
+        indexes[index_type] = {"built_as": index.index_type, "rows": len(index), "build_seconds": build_seconds}
+
+        for rerank, rerank_depth, expansion, cache in itertools.product(rerank_policies, rerank_depths, expansions,
+                                                                       caches):
+            config = {"index_type": index_type, "rerank": rerank, "rerank_depth": rerank_depth,
+                      "expansion": expansion, "cache": cache}
+            result = run_config(index_path, queries, config, embedder, ranker,
+                                create_expander(expansion, llm_latency_ms), repeat)
+            results.append(result)
+            if progress:
+                progress(result)
+
+    return {"format": REPORT_FORMAT, "created_at": time.time(), "models": models, "companies": len(corpus),
+            "queries": len(queries), "repeat": repeat, "k": NUM_OF_RESULTS_TO_RETURN, "indexes": indexes,
+            "results": results}
+
+
+def compare_reports(report, baseline, max_quality_drop=0.02, max_latency_ratio=1.5):
+    '''
+        Regressions of `report` against a `baseline` report, as messages: quality metrics more than
+        `max_quality_drop` lower, or a p95 latency more than `max_latency_ratio` times higher (0 to skip latency).
+        Only configurations found in both reports are compared.
+    '''
+    baseline_results = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        previous = baseline_results.get(result["name"])
+        if previous is None:
+            continue
+        for metric in QUALITY_METRICS:
+            if result[metric] < previous[metric] - max_quality_drop:
+                regressions.append(f"{result['name']}: {metric} {previous[metric]:.3f} -> {result[metric]:.3f}")
+        if max_latency_ratio and result["p95_ms"] > previous["p95_ms"] * max_latency_ratio:
+            regressions.append(f"{result['name']}: p95 {previous['p95_ms']:.1f}ms -> {result['p95_ms']:.1f}ms")
+    return regressions
@@ -0,0 +1,325 @@
+import logging
+import threading
+import numpy as np
+from haystack.schema import Document
+from api.semantic_search.cache import LRUCache
+from api.semantic_search.facet_index import normalize_filters
+from api.semantic_search.inference import create_embedder, create_ranker
+from api.semantic_search.keyword_index import HYBRID_SEARCH, NAME_MATCH, reciprocal_rank_fusion
+from api.semantic_search.neighbour_index import PRECOMPUTED, SEARCHED
+from api.semantic_search.rerank import KEYWORD, RerankPolicy
+from api.semantic_search.semantic_search import (CHUNK_OVERFETCH, CHUNK_POOLING, CHUNK_POOLINGS, EMBEDDING_CACHE_SIZE,
+                                                 EMBEDDING_CACHE_TTL, RESULT_CACHE_SIZE, RESULT_CACHE_TTL,
+                                                 SEARCH_INDEX_PATH, SearchResults)
+from api.semantic_search.timing import (ANN, EMBED, KEYWORD as KEYWORD_STAGE, LOAD_INDEX, LOAD_MODELS,
+                                       NEIGHBOURS as NEIGHBOURS_STAGE, RERANK, span)
+from api.semantic_search.vector_index import CompanyVectorIndex
+
+logger = logging.getLogger(__name__)
+
+
+class SearchIndexNotFound(Exception):
+    pass
+
+
+class SemanticSearchEngine:
+    '''
+        Long-lived semantic search engine shared by every request of a worker process.
+        The embedding model and the cross-encoder are loaded once, the index is memory-mapped once and
+        reloaded only when a new index is written to its directory. Searching does not touch the database.
+        Dense results are merged with the keyword index written with the vectors, when there is one.
+    '''
+
+    def __init__(self, index_path=SEARCH_INDEX_PATH, chunk_pooling=CHUNK_POOLING, embedder=None, ranker=None,
+                 rerank_policy=None):
+        # `embedder` and `ranker` replace the models of the configured inference backend, for benchmarks.
+        if chunk_pooling not in CHUNK_POOLINGS:
+            raise ValueError(f"Unknown chunk pooling '{chunk_pooling}'. Options: {', '.join(CHUNK_POOLINGS)}")
+        self.index_path = index_path
+        self.chunk_pooling = chunk_pooling
+        self._load_lock = threading.Lock()  # Only one thread (re)loads the models or the index at a time.
+        self._retriever = embedder
+        self._ranker = ranker
+        self.rerank_policy = rerank_policy or RerankPolicy()
+        self._index = None
+        self._loaded_signature = None
+        # Search results depend on the index and are dropped when it changes, embeddings only depend on the model.
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL)
+
+    def _index_signature(self):
+        # None when the index has not been built yet.
+        return CompanyVectorIndex.signature(self.index_path)
+
+    def _load_models(self):
+        if self._retriever is not None and self._ranker is not None:
+            return
+        with span(LOAD_MODELS):
+            if self._retriever is None:
+                # The retriever is only used to embed queries, the index is searched directly.
+                self._retriever = create_embedder()
+            if self._ranker is None:
+                self._ranker = create_ranker()
+
+    def load(self, models=True):
+        # `models=False` only loads the index, for lookups that do not embed or rerank anything.
+        signature = self._index_signature()
+        if signature is None:
+            raise SearchIndexNotFound("No search model found. Please train the search model first.")
+
+        with self._load_lock:
+            if models:
+                self._load_models()
+            if signature != self._loaded_signature:
+                logger.info("Loading semantic search index from %s", self.index_path)
+                # Swap the index in one assignment so in-flight searches keep using the one they started with.
+                with span(LOAD_INDEX):
+                    self._index = CompanyVectorIndex.load(self.index_path)
+                self._loaded_signature = signature
+                self.result_cache.clear()
+
+    def is_loaded(self):
+        return self._index is not None and self._loaded_signature == self._index_signature()
+
+    def ensure_loaded(self, models=True):
+        if not self.is_loaded() or (models and (self._retriever is None or self._ranker is None)):
+            self.load(models)
+
+    @property
+    def index_version(self):
+        return self._loaded_signature
+
+    @property
+    def index_name(self):
+        # Version name of the loaded index, the same in every process serving it. None before the index is loaded.
+        if self._index is None:
+            return None
+        return self._index.version or str(self._loaded_signature)
+
+    def embed_query(self, query):
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries):
+        # Queries missing from the cache are embedded together in one model call.
+        embeddings = [self.embedding_cache.get(query) for query in queries]
+        missing = list(dict.fromkeys(query for query, embedding in zip(queries, embeddings) if embedding is None))
+        if missing:
+            new_embeddings = dict(zip(missing, self._retriever.embed_queries(missing)))
+            for query, embedding in new_embeddings.items():
+                self.embedding_cache.set(query, embedding)
+            embeddings = [new_embeddings[query] if embedding is None else embedding
+                          for query, embedding in zip(queries, embeddings)]
+        return embeddings
+
+    def embed_texts(self, texts):
+        # Query embeddings outside of a search, loading the embedding model if needed.
+        with self._load_lock:
+            self._load_models()
+        return self.embed_queries(texts)
+
+    def embed_documents(self, documents):
+        # Shares the loaded embedding model with the index updates instead of loading a second copy.
+        with self._load_lock:
+            self._load_models()
+        return self._retriever.embed_documents(documents)
+
+    def cache_stats(self):
+        return {"results": self.result_cache.stats(), "embeddings": self.embedding_cache.stats()}
+
+    def search(self, query, top_k_retrieve, top_k_rank, keyword_query=None, filters=None):
+        keyword_queries = None if keyword_query is None else [keyword_query]
+        return self.search_batch([query], top_k_retrieve, top_k_rank, keyword_queries, filters)[0]
+
+    def search_batch(self, queries, top_k_retrieve, top_k_rank, keyword_queries=None, filters=None):
+        '''
+            Searches several queries at once: one embedding call, one FAISS search and one cross-encoder pass
+            over the (query, document) pairs the rerank policy keeps. Returns the ranked documents of each query
+            as SearchResults, with the rerank path that ran.
+            `keyword_queries` are searched in the keyword index, usually the queries before expansion, and their
+            matches are merged with the dense results by reciprocal rank fusion.
+            `filters` ({facet: values}, see facet_index.py) restrict every query to the matching companies.
+        '''
+        self.ensure_loaded()
+
+        index = self._index
+        allowed, allowed_companies = self.allowed(index, filters)
+        retrieve_depth = self.rerank_policy.retrieve_depth(top_k_retrieve)
+        with span(EMBED):
+            embeddings = self.embed_queries(queries)
+        with span(ANN):
+            hits = index.search_batch(embeddings, self.row_depth(index, retrieve_depth), allowed)
+            documents = [self.to_documents(index, query_hits, self.chunk_pooling)[:retrieve_depth]
+                         for query_hits in hits]
+        adaptive = [True] * len(documents)
+        if keyword_queries is not None and HYBRID_SEARCH and index.keywords is not None:
+            with span(KEYWORD_STAGE):
+                for i, keyword_query in enumerate(keyword_queries):
+                    keyword_hits = index.keywords.search(keyword_query, top_k_retrieve, allowed_companies)
+                    if keyword_hits:
+                        documents[i] = self.fuse(index, documents[i], keyword_hits)[:retrieve_depth]
+                        adaptive[i] = False
+        with span(RERANK):
+            ranked = self.rerank_policy.rerank(self._ranker, list(queries), documents, top_k_retrieve, top_k_rank,
+                                               adaptive)
+        return [SearchResults(query_documents, rerank=path) for query_documents, path in ranked]
+
+    def keyword_match(self, query, top_k, filters=None):
+        '''
+            The companies whose name, or the name of one of their products, is exactly the query, at most `top_k`.
+            Returns None when the query names no matching company. The caller lists them before the search results.
+        '''
+        self.ensure_loaded()
+
+        index = self._index
+        if not NAME_MATCH or index.keywords is None:
+            return None
+        with span(KEYWORD_STAGE):
+            company_ids = index.keywords.name_matches(query, self.allowed(index, filters)[1])[:top_k]
+        documents = [self.company_document(index, company_id, 1.0) for company_id in company_ids]
+        documents = [document for document in documents if document is not None]
+        return SearchResults(documents, rerank=KEYWORD) if documents else None
+
+    def similar_companies(self, company_id, top_k, filters=None):
+        '''
+            The `top_k` companies closest to a company, from its stored vector without running any model.
+            Returns (documents best first, PRECOMPUTED or SEARCHED), or None when the company is not indexed.
+            The neighbours precomputed with the index answer when they hold enough matching companies, the index is
+            searched with the company's vector otherwise.
+        '''
+        self.ensure_loaded(models=False)
+
+        index = self._index
+        row = index.company_row(company_id)
+        if row is None:
+            return None
+        allowed, allowed_companies = self.allowed(index, filters)
+        with span(NEIGHBOURS_STAGE):
+            if index.neighbours is not None:
+                neighbours = index.neighbours.get(company_id) or []
+                if allowed_companies is not None:
+                    allowed_ids = set(allowed_companies.tolist())
+                    neighbours = [hit for hit in neighbours if hit[0] in allowed_ids]
+                # Without filters, fewer than top_n neighbours means there are no other companies.
+                if len(neighbours) >= top_k or (allowed is None and top_k <= index.neighbours.top_n):
+                    documents = [self.company_document(index, neighbour_id, score)
+                                 for neighbour_id, score in neighbours[:top_k]]
+                    return [document for document in documents if document is not None], PRECOMPUTED
+
+            hits = index.search_batch([index.vectors[row]], self.row_depth(index, top_k + 1), allowed)[0]
+            documents = [document for document in self.to_documents(index, hits, self.chunk_pooling)
+                         if document.meta["company_id"] != company_id]
+        return documents[:top_k], SEARCHED
+
+    def interest_companies(self, interests, top_k):
+        '''
+            The `top_k` companies closest to each of `interests` ({interest id: name}), as {interest id: documents
+            best first}, and the ids of the interests new or renamed since the index was written.
+            They are read from the companies precomputed for each interest with the index, no model runs. Renamed
+            interests keep the companies of their previous name, new ones have none until the next index version.
+        '''
+        self.ensure_loaded(models=False)
+
+        index = self._index
+        companies, stale = {}, []
+        with span(NEIGHBOURS_STAGE):
+            for interest_id, name in interests.items():
+                hits = index.interests.companies(interest_id, name) if index.interests is not None else None
+                if hits is None:
+                    stale.append(interest_id)
+                    hits = index.interests.companies(interest_id) if index.interests is not None else None
+                    if hits is None:
+                        continue
+                documents = [self.company_document(index, company_id, score) for company_id, score in hits[:top_k]]
+                companies[interest_id] = [document for document in documents if document is not None]
+        return companies, stale
+
+    @staticmethod
+    def allowed(index, filters):
+        '''
+            Boolean mask of the index rows and array of the company ids matching the filters, None for both
+            when there are no filters.
+        '''
+        filters = normalize_filters(filters)
+        if not filters:
+            return None, None
+        if index.facets is None:
+            raise ValueError("The search index has no facets, rebuild it to filter searches.")
+        allowed = index.facets.mask(filters, len(index))
+        return allowed, np.unique(np.asarray(index.company_ids)[allowed])
+
+    @classmethod
+    def fuse(cls, index, dense_documents, keyword_hits):
+        # Dense and keyword candidates in reciprocal rank fusion order, scored by their fused score.
+        documents = {document.meta["company_id"]: document for document in dense_documents}
+        fused = reciprocal_rank_fusion([list(documents), [company_id for company_id, _, _ in keyword_hits]])
+        results = []
+        for company_id, score in fused:
+            document = documents.get(company_id)
+            if document is None:
+                document = cls.company_document(index, company_id, score)
+            if document is not None:
+                document.score = score
+                results.append(document)
+        return results
+
+    @staticmethod
+    def company_document(index, company_id, score):
+        row = index.company_row(company_id)
+        if row is None:
+            return None
+        return Document(content=index.content(row), score=score,
+                        meta={"title": index.title(row), "company_id": company_id})
+
+    @classmethod
+    def retrieve(cls, index, query_embedding, top_k):
+        return cls.to_documents(index, index.search(query_embedding, cls.row_depth(index, top_k)))[:top_k]
+
+    @staticmethod
+    def row_depth(index, top_k):
+        # Rows to fetch for `top_k` companies, more than top_k when companies have several chunks.
+        if index.company_count < len(index):
+            return top_k * CHUNK_OVERFETCH
+        return top_k
+
+    @staticmethod
+    def to_documents(index, hits, pooling="max"):
+        '''
+            One document per company among the hits, best first, read from the index files only.
+            The document is the company's best scoring chunk. Its score is that chunk's score with "max" pooling
+            and the sum of the scores of the company's hits with "sum" pooling.
+        '''
+        documents = {}
+        for row, score in hits:
+            company_id = index.company_id(row)
+            document = documents.get(company_id)
+            if document is None:
+                documents[company_id] = Document(content=index.content(row), score=score,
+                                                 meta={"title": index.title(row), "company_id": company_id})
+            elif pooling == "sum":
+                document.score += score
+        if pooling == "sum":
+            return sorted(documents.values(), key=lambda document: document.score, reverse=True)
+        return list(documents.values())
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_search_engine():
+    # One engine per worker process, created lazily on first use (or at startup, see ApiConfig.ready).
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = SemanticSearchEngine()
+    return _engine
+
+
+def warm_up_search_engine():
+    try:
+        get_search_engine().load()
+    except SearchIndexNotFound as e:
+        logger.warning(str(e))
+    except Exception:
+        logger.exception("Failed to warm up the semantic search engine")
@@ -0,0 +1,135 @@
+import json
+import os
+from collections import defaultdict
+import numpy as np
+from api.semantic_search.vector_index import _memmap
+
+# Facets a semantic search can be restricted to, named after the CompanyViewSet query parameters.
+# Values are compared as strings: ids for the related models, the status code for status.
+FACETS = ("tech_sectors", "hq_main_offices", "finance_stages", "status")
+
+# Written next to the vector index files, see VectorIndexWriter.finish:
+#   facets.json       for each facet value, the start and end of its rows in facet_rows.i32
+#   facet_rows.i32    sorted index rows of the companies having each facet value
+FACETS_FILE = "facets.json"
+FACET_ROWS_FILE = "facet_rows.i32"
+
+
+def normalize_filters(filters):
+    '''
+        {facet: values} as {facet: sorted tuple of string values}, without empty facets.
+        Raises ValueError for an unknown facet.
+    '''
+    normalized = {}
+    for facet, values in (filters or {}).items():
+        if facet not in FACETS:
+            raise ValueError(f"Unknown filter '{facet}'. Options: {', '.join(FACETS)}")
+        values = [values] if isinstance(values, (str, int)) else values
+        values = tuple(sorted({str(value) for value in values if value not in (None, "")}))
+        if values:
+            normalized[facet] = values
+    return normalized
+
+
+def iter_company_facets(company_ids=None):
+    # Yields (company id, {facet: [values]}) for every company, or the `company_ids` ones.
+    from api.models import Company
+
+    tech_sectors = defaultdict(list)
+    companies = Company.objects.order_by('id')
+    company_tech_sectors = Company.tech_sector.through.objects.all()
+    if company_ids is not None:
+        companies = companies.filter(id__in=company_ids)
+        company_tech_sectors = company_tech_sectors.filter(company_id__in=company_ids)
+    for company_id, tech_sector_id in company_tech_sectors.values_list('company_id', 'techsector_id'):
+        tech_sectors[company_id].append(tech_sector_id)
+    companies = companies.values_list('id', 'hq_main_office_id', 'finance_stage_id', 'status')
+    for company_id, hq_main_office_id, finance_stage_id, status in companies.iterator(chunk_size=2000):
+        yield company_id, {"tech_sectors": tech_sectors.get(company_id, []), "hq_main_offices": [hq_main_office_id],
+                           "finance_stages": [finance_stage_id], "status": [status]}
+
+
+class FacetIndexWriter:
+    '''
+        Collects the facet values of each company and writes, for every value, the index rows of its companies.
+    '''
+
+    def __init__(self):
+        self.company_facets = {}
+        self.previous = None
+        self.removed_rows = np.zeros(0, dtype=np.int64)
+
+    def add_index(self, previous, removed_rows=()):
+        '''
+            Keeps the facet rows of the `previous` FacetIndex, except `removed_rows`, renumbered for an index written
+            with the previous rows in the same order, without `removed_rows`, and the new rows after them.
+        '''
+        self.previous = previous
+        self.removed_rows = np.unique(np.asarray(list(removed_rows), dtype=np.int64))
+        return self
+
+    def add(self, company_id, facets):
+        self.company_facets[int(company_id)] = normalize_filters(facets)
+
+    def add_companies(self, companies=None, company_ids=None):
+        for company_id, facets in companies if companies is not None else iter_company_facets(company_ids):
+            self.add(company_id, facets)
+        return self
+
+    def write(self, directory, company_ids):
+        # `company_ids` holds the company id of each index row.
+        value_rows = {facet: defaultdict(list) for facet in FACETS}
+        if self.previous is not None:
+            for facet, values in self.previous.offsets.items():
+                for value, (start, end) in values.items():
+                    rows = np.asarray(self.previous.rows[start:end], dtype=np.int64)
+                    rows = rows[~np.isin(rows, self.removed_rows)]
+                    value_rows[facet][value] = (rows - np.searchsorted(self.removed_rows, rows)).tolist()
+        company_ids = np.asarray(company_ids)
+        for row in np.flatnonzero(np.isin(company_ids, list(self.company_facets))).tolist():
+            for facet, values in self.company_facets[int(company_ids[row])].items():
+                for value in values:
+                    value_rows[facet][value].append(row)
+
+        offsets = {facet: {} for facet in FACETS}
+        start = 0
+        with open(os.path.join(directory, FACET_ROWS_FILE), "wb") as f:
+            for facet in FACETS:
+                for value, rows in value_rows[facet].items():
+                    f.write(np.array(rows, dtype=np.int32).tobytes())
+                    offsets[facet][value] = [start, start + len(rows)]
+                    start += len(rows)
+        with open(os.path.join(directory, FACETS_FILE), "w") as f:
+            json.dump({"rows": start, "facets": offsets}, f)
+
+
+class FacetIndex:
+    '''
+        Rows of the vector index having each facet value, to restrict a search before any vector is scored.
+    '''
+
+    def __init__(self, path):
+        with open(os.path.join(path, FACETS_FILE)) as f:
+            meta = json.load(f)
+        self.offsets = meta["facets"]
+        self.rows = _memmap(os.path.join(path, FACET_ROWS_FILE), np.int32, (meta["rows"],))
+
+    @classmethod
+    def load(cls, path):
+        # None for indexes written without facets.
+        if not os.path.exists(os.path.join(path, FACETS_FILE)):
+            return None
+        return cls(path)
+
+    def mask(self, filters, count):
+        '''
+            Boolean mask of the `count` index rows matching the normalized filters: any value of a facet, every facet.
+        '''
+        mask = np.ones(count, dtype=bool)
+        for facet, values in filters.items():
+            facet_mask = np.zeros(count, dtype=bool)
+            for value in values:
+                start, end = self.offsets.get(facet, {}).get(value, (0, 0))
+                facet_mask[self.rows[start:end]] = True
+            mask &= facet_mask
+        return mask
@@ -0,0 +1,123 @@
+import logging
+import threading
+from datetime import timedelta
+from os import getenv
+from django.db import connections, transaction
+from django.utils import timezone
+from api.semantic_search.keyword_index import reciprocal_rank_fusion
+from api.semantic_search.semantic_search import FEED_SIZE
+
+logger = logging.getLogger(__name__)
+
+# A feed computed from an older search index is served as it is and refreshed in the background, at most once per
+# this many seconds. Company edits write a new index version every few seconds.
+FEED_REFRESH_INTERVAL = float(getenv('SEMANTIC_SEARCH_FEED_REFRESH_INTERVAL', 600))
+
+_refreshing = set()  # Ids of the users whose feed is being refreshed in the background.
+_refreshing_lock = threading.Lock()
+
+
+def rank_feed(interest_companies, size=FEED_SIZE):
+    '''
+        Merges the companies of each interest ({interest id: documents best first}) into one list by reciprocal rank
+        fusion, so a company close to several interests comes first. Returns [{"id", "company", "score"}].
+    '''
+    titles = {document.meta["company_id"]: document.meta["title"]
+              for documents in interest_companies.values() for document in documents}
+    fused = reciprocal_rank_fusion([[document.meta["company_id"] for document in documents]
+                                    for documents in interest_companies.values()])
+    return [{"id": int(company_id), "company": titles[company_id], "score": score}
+            for company_id, score in fused[:size]]
+
+
+def refresh_user_feed(user, search_engine=None):
+    '''
+        Computes the feed of `user` from their interests and stores it, no model runs. Interests new or renamed
+        since the search index was written queue an index update, which embeds them in the background, and count
+        with the companies of their previous name meanwhile. Raises SearchIndexNotFound when there is no index.
+    '''
+    from api.models import UserFeed
+    from api.semantic_search.engine import get_search_engine
+    from api.semantic_search.index_updates import AUTO_INDEX, index_update_queue
+
+    search_engine = search_engine or get_search_engine()
+    search_engine.ensure_loaded(models=False)
+    interests = {interest.id: interest.name for interest in user.interests.all()}
+    interest_companies, stale = search_engine.interest_companies(interests, FEED_SIZE) if interests else ({}, [])
+    if stale and AUTO_INDEX:
+        index_update_queue.enqueue_interests()
+    results = rank_feed(interest_companies)
+    feed, _ = UserFeed.objects.update_or_create(user=user, defaults={
+        "interest_ids": sorted(interests), "results": results, "index_version": search_engine.index_name})
+    return feed
+
+
+def get_user_feed(user):
+    '''
+        The stored feed of `user`, computed first when they have none or their interests changed since.
+        A feed of an older search index is returned as it is, and refreshed in the background once it is
+        FEED_REFRESH_INTERVAL seconds old.
+    '''
+    from api.models import UserFeed
+    from api.semantic_search.engine import get_search_engine
+
+    search_engine = get_search_engine()
+    search_engine.ensure_loaded(models=False)
+    feed = UserFeed.objects.filter(user=user).first()
+    if feed is None or feed.interest_ids != sorted(user.interests.values_list('id', flat=True)):
+        return refresh_user_feed(user, search_engine)
+    if feed.index_version != search_engine.index_name and \
+            timezone.now() - feed.updated_at >= timedelta(seconds=FEED_REFRESH_INTERVAL):
+        refresh_user_feed_in_background(user)
+    return feed
+
+
+def refresh_user_feed_in_background(user):
+    # Refreshes the feed of `user` from a thread, unless it is already being refreshed.
+    with _refreshing_lock:
+        if user.pk in _refreshing:
+            return
+        _refreshing.add(user.pk)
+
+    def refresh():
+        try:
+            refresh_user_feed(user)
+        except Exception:
+            logger.exception("Failed to refresh the feed of user %s", user.pk)
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(user.pk)
+            # This thread is not a request, so Django does not close its database connection.
+            connections.close_all()
+
+    threading.Thread(target=refresh, name="user-feed-refresh", daemon=True).start()
+
+
+def refresh_user_feeds(batch_size=500, progress=None):
+    # Refreshes the feed of every active user, after the search index was rebuilt. Returns the number of feeds.
+    from api.models import User
+    from api.semantic_search.engine import get_search_engine
+
+    search_engine = get_search_engine()
+    count = 0
+    for user in User.objects.filter(is_active=True).prefetch_related('interests').iterator(chunk_size=batch_size):
+        refresh_user_feed(user, search_engine)
+        count += 1
+        if progress and count % batch_size == 0:
+            progress(count)
+    return count
+
+
+def refresh_user_feed_on_commit(user):
+    # Recomputes the feed once the interest changes are saved. A failure only logs, the feed is refreshed on read.
+    from api.semantic_search.engine import SearchIndexNotFound
+
+    def refresh():
+        try:
+            refresh_user_feed(user)
+        except SearchIndexNotFound:
+            logger.info("No search index found, the feed of user %s is computed on its first read.", user.pk)
+        except Exception:
+            logger.exception("Failed to refresh the feed of user %s", user.pk)
+
+    transaction.on_commit(refresh)
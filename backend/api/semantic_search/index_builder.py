@@ -0,0 +1,138 @@
+import logging
+from collections import Counter
+from os import getenv
+from api.semantic_search.ann import INDEX_TYPE
+from api.semantic_search.facet_index import FacetIndexWriter
+from api.semantic_search.inference import create_embedder
+from api.semantic_search.interest_index import InterestIndexWriter
+from api.semantic_search.keyword_index import KeywordIndexWriter
+from api.semantic_search.semantic_search import (CHUNK_FIELDS, CHUNK_OVERLAP, CHUNK_WORDS, EMBEDDING_DIM,
+                                                 FIASS_LOAD_FILE_PATH, MAX_COMPANY_CHUNKS, SEARCH_INDEX_PATH,
+                                                 create_company_chunk_document, create_company_document,
+                                                 get_preprocessor)
+from api.semantic_search.vector_index import VectorIndexWriter, active_row_count, index_lock
+
+logger = logging.getLogger(__name__)
+
+BUILD_BATCH_SIZE = int(getenv('SEMANTIC_SEARCH_BUILD_BATCH_SIZE', 256))  # Companies embedded and written at a time.
+# A rebuild with fewer rows than this share of the active index is not activated, 0 disables the check.
+MIN_ROWS_RATIO = float(getenv('SEMANTIC_SEARCH_INDEX_MIN_ROWS_RATIO', 0.5))
+
+
+def company_to_document(company):
+    # Expects tech_sector to be prefetched.
+    tech_sector = ', '.join(sector.sector_name for sector in company.tech_sector.all())
+    return create_company_document(company.id, company.company, company.description, tech_sector)
+
+
+def company_to_documents(company):
+    # The main document of the company, then one document per non empty CHUNK_FIELDS text.
+    return [company_to_document(company)] + [
+        create_company_chunk_document(company.id, company.company, field, getattr(company, field))
+        for field in CHUNK_FIELDS if getattr(company, field)]
+
+
+def preprocess_company_documents(documents):
+    '''
+        Splits the main documents with the usual preprocessor and the CHUNK_FIELDS documents into chunks of
+        CHUNK_WORDS words. Each chunk starts with its company name, and a company keeps its first MAX_COMPANY_CHUNKS
+        chunks so the index grows with the number of companies only.
+    '''
+    main_documents = [document for document in documents if "field" not in document.meta]
+    field_documents = [document for document in documents if "field" in document.meta]
+    chunks = get_preprocessor(CHUNK_WORDS, CHUNK_OVERLAP).process(field_documents) if field_documents else []
+
+    chunk_counts = Counter()
+    kept_chunks = []
+    for chunk in chunks:
+        company_id = chunk.meta["company_id"]
+        if chunk_counts[company_id] < MAX_COMPANY_CHUNKS:
+            chunk_counts[company_id] += 1
+            chunk.content = f"{chunk.meta['title']}: {chunk.content}"
+            kept_chunks.append(chunk)
+    # Main documents first, so the first row of a company is its main document (see CompanyVectorIndex.company_row).
+    return get_preprocessor().process(main_documents) + kept_chunks
+
+
+def iter_company_documents(batch_size=BUILD_BATCH_SIZE):
+    '''
+        Streams the companies straight from the database and yields their documents in lists of `batch_size` companies.
+        Only one batch of rows is held in memory at a time.
+    '''
+    from api.models import Company
+
+    companies = (Company.objects.only('id', 'company', 'description', *CHUNK_FIELDS).order_by('id')
+                 .prefetch_related('tech_sector').iterator(chunk_size=batch_size))
+    batch = []
+    company_count = 0
+    for company in companies:
+        batch += company_to_documents(company)
+        company_count += 1
+        if company_count == batch_size:
+            yield batch
+            batch = []
+            company_count = 0
+    if batch:
+        yield batch
+
+
+def build_search_index(batch_size=BUILD_BATCH_SIZE, index_path=SEARCH_INDEX_PATH, index_type=INDEX_TYPE,
+                       progress=None, min_rows_ratio=MIN_ROWS_RATIO):
+    '''
+        Rebuilds the search index from the Company table. Each batch is split, embedded and appended to the index
+        files before the next one is read, so memory use does not grow with the number of companies.
+        Companies get one row per chunk of their main document and of their CHUNK_FIELDS texts.
+        The keyword index of the company names, descriptions, products and founders, the facet rows used to
+        filter searches and the embedding and closest companies of each interest are written with it.
+        The index is written as a new version, which becomes the active one once it is complete and validated.
+        Raises IndexValidationError, and keeps the active version, when the new one has fewer than
+        `min_rows_ratio` times its rows. Returns the number of companies indexed.
+        The update lock of the index is held during the build, company updates are applied to the new version.
+    '''
+    retriever = create_embedder()
+
+    company_count = 0
+    with index_lock(index_path), VectorIndexWriter(index_path, EMBEDDING_DIM) as writer:
+        min_count = int(active_row_count(index_path) * min_rows_ratio)
+        for documents in iter_company_documents(batch_size):
+            company_count += len({document.meta["company_id"] for document in documents})
+            docs_to_index = preprocess_company_documents(documents)
+            writer.add_documents(docs_to_index, retriever.embed_documents(docs_to_index))
+
+            logger.info("Indexed %s companies", company_count)
+            if progress:
+                progress(company_count)
+        writer.finish(index_type, keywords=KeywordIndexWriter().add_companies(),
+                      facets=FacetIndexWriter().add_companies(),
+                      interests=InterestIndexWriter().add_interests(retriever.embed_queries), min_count=min_count)
+    return company_count
+
+
+def convert_legacy_index(legacy_path=FIASS_LOAD_FILE_PATH, index_path=SEARCH_INDEX_PATH, index_type=INDEX_TYPE,
+                         batch_size=BUILD_BATCH_SIZE):
+    '''
+        Copies the documents and vectors of an index trained with the old SQL backed FAISSDocumentStore into a
+        search index, without embedding anything again. Documents are matched to their company by title when they
+        have no company id. Returns the number of documents copied.
+    '''
+    from haystack.document_stores import FAISSDocumentStore
+    from api.models import Company
+
+    document_store = FAISSDocumentStore.load(legacy_path)
+    company_ids = dict(Company.objects.values_list('company', 'id'))
+    with VectorIndexWriter(index_path, EMBEDDING_DIM) as writer:
+        batch = []
+        for document in document_store.get_all_documents_generator(return_embedding=True, batch_size=batch_size):
+            document.meta.setdefault("company_id", company_ids.get(document.meta.get("title")))
+            if document.meta["company_id"] is None:
+                logger.warning("Skipping '%s', no company has this name", document.meta.get("title"))
+                continue
+            batch.append(document)
+            if len(batch) == batch_size:
+                writer.add_documents(batch, [document.embedding for document in batch])
+                batch = []
+        if batch:
+            writer.add_documents(batch, [document.embedding for document in batch])
+        writer.finish(index_type, keywords=KeywordIndexWriter().add_companies(),
+                      facets=FacetIndexWriter().add_companies())
+        return writer.count
@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from os import getenv
+import numpy as np
+from django.db import connections
+from api.semantic_search.ann import replace_vectors
+from api.semantic_search.index_builder import company_to_documents, preprocess_company_documents
+from api.semantic_search.facet_index import FacetIndexWriter
+from api.semantic_search.interest_index import InterestIndexWriter
+from api.semantic_search.keyword_index import KeywordIndexWriter
+from api.semantic_search.semantic_search import SEARCH_INDEX_PATH
+from api.semantic_search.vector_index import (CompanyVectorIndex, IndexVersionConflict, VectorIndexWriter,
+                                              current_version, index_lock, version_path)
+
+logger = logging.getLogger(__name__)
+
+# Set to False to only refresh the search index with a full retrain.
+AUTO_INDEX = getenv('SEMANTIC_SEARCH_AUTO_INDEX', 'True') == 'True'
+INDEX_UPDATE_BATCH_SIZE = int(getenv('SEMANTIC_SEARCH_INDEX_UPDATE_BATCH_SIZE', 32))
+INDEX_UPDATE_DELAY = float(getenv('SEMANTIC_SEARCH_INDEX_UPDATE_DELAY', 2))  # Seconds to collect a burst of edits.
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+
+def apply_index_updates(updates, index_path=SEARCH_INDEX_PATH):
+    '''
+        Writes a batch of {company id: UPSERT or DELETE} to the search index on disk as a new version.
+        Only the upserted companies are read from the database and embedded. Their previous rows are removed from the
+        FAISS index of the active version and their new rows appended to it, without training it again, and the
+        keyword and facet rows of the other companies are carried over as they are, like the precomputed neighbours
+        of the companies not close to an updated one.
+        Processes applying updates to the same index path wait for each other on its update lock. The batch is
+        applied again when another version was activated while it was written, by a rollback for instance.
+        Running search engines pick the new index up on their next search.
+    '''
+    if CompanyVectorIndex.signature(index_path) is None:
+        logger.info("No search index found, skipping %s index update(s). Build the search index first.", len(updates))
+        return
+
+    with index_lock(index_path):
+        try:
+            _write_index_updates(updates, index_path)
+        except IndexVersionConflict:
+            logger.warning("The active search index version changed during the update, applying it again.")
+            _write_index_updates(updates, index_path)
+
+
+def _write_index_updates(updates, index_path):
+    # Writes the next version of the index at `index_path` from its active version. The caller holds the update lock.
+    from api.models import Company
+    from api.semantic_search.engine import get_search_engine
+
+    base_version = current_version(index_path)
+    current_index = CompanyVectorIndex(version_path(index_path, base_version) if base_version else index_path)
+
+    upsert_ids = [company_id for company_id, action in updates.items() if action == UPSERT]
+    companies = Company.objects.filter(id__in=upsert_ids).prefetch_related('tech_sector')
+    new_documents = preprocess_company_documents(
+        [document for company in companies for document in company_to_documents(company)])
+    new_vectors = np.asarray(get_search_engine().embed_documents(new_documents) if new_documents else [],
+                             dtype=np.float32).reshape(-1, current_index.dim)
+
+    # The kept rows stay in order and the new rows follow them, so the FAISS labels remain the row numbers.
+    affected_ids = np.array([int(company_id) for company_id in updates], dtype=np.int64)
+    removed_rows = np.flatnonzero(np.isin(current_index.company_ids, affected_ids))
+    faiss_index = current_index.read_faiss_index()
+    if not replace_vectors(faiss_index, removed_rows, new_vectors):
+        faiss_index = None  # HNSW graphs can not drop vectors, finish() adds them all to a new one.
+
+    keywords = KeywordIndexWriter()
+    if current_index.keywords is not None:
+        keywords.add_index(current_index.keywords, affected_ids).add_companies(company_ids=upsert_ids)
+    else:
+        keywords.add_companies()
+    facets = FacetIndexWriter()
+    if current_index.facets is not None:
+        facets.add_index(current_index.facets, removed_rows).add_companies(company_ids=upsert_ids)
+    else:
+        facets.add_companies()
+
+    with VectorIndexWriter(index_path, current_index.dim, base_version) as writer:
+        for company_ids, titles, contents, vectors in current_index.iter_rows():
+            kept = ~np.isin(company_ids, affected_ids)
+            writer.add(company_ids[kept], [title for title, keep in zip(titles, kept) if keep],
+                       [content for content, keep in zip(contents, kept) if keep], vectors[kept])
+        if new_documents:
+            writer.add_documents(new_documents, new_vectors)
+        # Every interest is read again, only the ones added or renamed since the active version are embedded.
+        writer.finish(current_index.index_type, keywords=keywords, facets=facets,
+                      interests=InterestIndexWriter().add_interests(get_search_engine().embed_texts,
+                                                                    previous=current_index.interests),
+                      faiss_index=faiss_index, neighbours=current_index.neighbours, changed_ids=affected_ids,
+                      update=True)
+    logger.info("Search index updated: %s upserted, %s deleted", len(upsert_ids), len(updates) - len(upsert_ids))
+
+
+class IndexUpdateQueue:
+    '''
+        Collects company upserts and deletes and applies them to the search index from a background thread.
+        A company queued several times is only indexed once per batch, the latest action wins.
+    '''
+
+    def __init__(self, batch_size=INDEX_UPDATE_BATCH_SIZE, delay=INDEX_UPDATE_DELAY, apply=apply_index_updates):
+        self.batch_size = batch_size
+        self.delay = delay
+        self.apply = apply
+        self._pending = {}
+        self._refresh_interests = False
+        self._condition = threading.Condition()
+        self._worker = None
+
+    def enqueue_upsert(self, company_id):
+        self._enqueue(company_id, UPSERT)
+
+    def enqueue_delete(self, company_id):
+        self._enqueue(company_id, DELETE)
+
+    def enqueue_interests(self):
+        # Writes a new version for the interests added or renamed since the index was written, with no company
+        # update if there is none.
+        with self._condition:
+            self._refresh_interests = True
+            self._start_worker()
+
+    def _enqueue(self, company_id, action):
+        with self._condition:
+            self._pending[company_id] = action
+            self._start_worker()
+
+    def _start_worker(self):
+        # The caller holds the condition.
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="search-index-updates", daemon=True)
+            self._worker.start()
+        self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return dict(self._pending)
+
+    def _take_batch(self):
+        # (updates, whether the interests have to be refreshed), an empty batch still refreshes them.
+        with self._condition:
+            company_ids = list(self._pending)[:self.batch_size]
+            refresh_interests, self._refresh_interests = self._refresh_interests, False
+            return {company_id: self._pending.pop(company_id) for company_id in company_ids}, refresh_interests
+
+    def _apply_batch(self, batch):
+        try:
+            self.apply(batch)
+        except Exception:
+            logger.exception("Failed to apply %s search index update(s)", len(batch))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._refresh_interests:
+                    self._condition.wait()
+            time.sleep(self.delay)
+            batch, refresh_interests = self._take_batch()
+            if batch or refresh_interests:
+                self._apply_batch(batch)
+                # This thread is not a request, so Django does not close its database connection.
+                connections.close_all()
+
+    def drain(self):
+        # Applies everything queued so far in the calling thread.
+        batch, refresh_interests = self._take_batch()
+        while batch or refresh_interests:
+            self._apply_batch(batch)
+            batch, refresh_interests = self._take_batch()
+
+index_update_queue = IndexUpdateQueue()
@@ -0,0 +1,231 @@
+import copy
+import logging
+import os
+import time
+from os import getenv
+import numpy as np
+from haystack.nodes import EmbeddingRetriever, SentenceTransformersRanker
+from api.semantic_search.semantic_search import CURRENT_DIR, EMBEDDING_DIM, EMBEDDING_MODEL, RANKER_MODEL
+
+logger = logging.getLogger(__name__)
+
+# How the embedding model and the cross-encoder run:
+#   "torch"      fp32 PyTorch through haystack, as trained.
+#   "quantized"  PyTorch with int8 dynamic quantization of the Linear layers, CPU only.
+#   "onnx"       ONNX Runtime on the models exported by `python manage.py export_onnx_models`. Needs onnxruntime.
+INFERENCE_BACKEND = getenv('SEMANTIC_SEARCH_INFERENCE_BACKEND', 'torch')
+INFERENCE_BACKENDS = ("torch", "quantized", "onnx")
+USE_GPU = getenv('SEMANTIC_SEARCH_USE_GPU', 'False') == 'True'
+ONNX_MODEL_DIR = getenv('SEMANTIC_SEARCH_ONNX_DIR', os.path.join(CURRENT_DIR, "onnx_models"))
+MAX_SEQ_LEN = 512  # Same truncation as the haystack nodes.
+
+
+def check_backend(backend):
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}'. Options: {', '.join(INFERENCE_BACKENDS)}")
+
+
+def quantize_dynamic(model):
+    import torch
+    # int8 weights for the Linear layers, activations are quantized on the fly.
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def create_embedder(backend=INFERENCE_BACKEND):
+    # Anything with embed_queries(list of str) and embed_documents(list of Document) returning numpy arrays.
+    check_backend(backend)
+    if backend == "onnx":
+        return OnnxEmbedder(os.path.join(ONNX_MODEL_DIR, "embedder"))
+
+    retriever = EmbeddingRetriever(
+        document_store=None,
+        embedding_model=EMBEDDING_MODEL,
+        use_gpu=USE_GPU,
+        scale_score=False,
+        progress_bar=False,
+    )
+    if backend == "quantized":
+        encoder = retriever.embedding_encoder
+        encoder.embedding_model = quantize_dynamic(encoder.embedding_model)
+    return retriever
+
+
+def create_ranker(backend=INFERENCE_BACKEND):
+    # Anything with the predict and predict_batch methods of SentenceTransformersRanker.
+    check_backend(backend)
+    if backend == "onnx":
+        return OnnxRanker(os.path.join(ONNX_MODEL_DIR, "ranker"))
+
+    ranker = SentenceTransformersRanker(model_name_or_path=RANKER_MODEL, use_gpu=USE_GPU, progress_bar=False)
+    if backend == "quantized":
+        ranker.transformer_model = quantize_dynamic(ranker.transformer_model)
+    return ranker
+
+
+def _onnx_session(model_dir):
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("The onnx inference backend needs onnxruntime, run `pip install onnxruntime`.")
+    from transformers import AutoTokenizer
+
+    model_path = os.path.join(model_dir, "model.onnx")
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"No ONNX model in {model_dir}. Run `python manage.py export_onnx_models` first.")
+    session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+    return session, AutoTokenizer.from_pretrained(model_dir)
+
+
+def _run_onnx(session, features):
+    inputs = {model_input.name: features[model_input.name].astype(np.int64) for model_input in session.get_inputs()}
+    return session.run(None, inputs)[0]
+
+
+def mean_pool_normalize(token_embeddings, attention_mask):
+    # Pooling and Normalize modules of all-MiniLM-L6-v2 in sentence-transformers.
+    mask = attention_mask[..., None].astype(np.float32)
+    pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+    return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+
+class OnnxEmbedder:
+    def __init__(self, model_dir, batch_size=32):
+        self.session, self.tokenizer = _onnx_session(model_dir)
+        self.batch_size = batch_size
+
+    def embed(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            features = self.tokenizer(texts[start:start + self.batch_size], padding=True, truncation=True,
+                                      max_length=MAX_SEQ_LEN, return_tensors="np")
+            embeddings.append(mean_pool_normalize(_run_onnx(self.session, features), features["attention_mask"]))
+        return np.concatenate(embeddings) if embeddings else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+
+    def embed_queries(self, queries):
+        return self.embed(list(queries))
+
+    def embed_documents(self, documents):
+        return self.embed([document.content for document in documents])
+
+
+class OnnxRanker:
+    '''
+        Cross-encoder on ONNX Runtime with the same scores as SentenceTransformersRanker: the logit of the
+        (query, document) pair, through a sigmoid for single label models.
+    '''
+
+    def __init__(self, model_dir, batch_size=16):
+        self.session, self.tokenizer = _onnx_session(model_dir)
+        self.batch_size = batch_size
+
+    def score(self, queries, contents):
+        scores = []
+        for start in range(0, len(queries), self.batch_size):
+            features = self.tokenizer(queries[start:start + self.batch_size], contents[start:start + self.batch_size],
+                                      padding=True, truncation=True, max_length=MAX_SEQ_LEN, return_tensors="np")
+            logits = _run_onnx(self.session, features)
+            scores.append(1 / (1 + np.exp(-logits[:, 0])) if logits.shape[1] == 1 else logits[:, -1])
+        return np.concatenate(scores) if scores else np.zeros(0)
+
+    def predict(self, query, documents, top_k=None):
+        return self.predict_batch([query], [documents], top_k)[0]
+
+    def predict_batch(self, queries, documents, top_k=None):
+        pairs = [(query, document) for query, query_documents in zip(queries, documents)
+                 for document in query_documents]
+        scores = iter(self.score([query for query, _ in pairs], [document.content for _, document in pairs]))
+        results = []
+        for query_documents in documents:
+            for document in query_documents:
+                document.score = float(next(scores))
+            results.append(sorted(query_documents, key=lambda document: document.score, reverse=True)[:top_k])
+        return results
+
+
+def export_onnx_models(output_dir=ONNX_MODEL_DIR, quantize=False):
+    '''
+        Exports the embedding model and the cross-encoder to ONNX, with their tokenizers, for the onnx backend.
+        `quantize` also applies ONNX Runtime int8 dynamic quantization to the exported weights.
+    '''
+    import torch
+    from transformers import AutoModel, AutoModelForSequenceClassification, AutoTokenizer
+
+    exports = (("embedder", EMBEDDING_MODEL, AutoModel, "token_embeddings"),
+               ("ranker", RANKER_MODEL, AutoModelForSequenceClassification, "logits"))
+    for name, model_name, model_class, output_name in exports:
+        model_dir = os.path.join(output_dir, name)
+        os.makedirs(model_dir, exist_ok=True)
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = model_class.from_pretrained(model_name).eval()
+
+        sample = tokenizer(["a query"], ["a company description"], return_tensors="pt")
+        input_names = list(sample.keys())
+        dynamic_axes = {input_name: {0: "batch", 1: "sequence"} for input_name in input_names}
+        dynamic_axes[output_name] = {0: "batch", 1: "sequence"} if name == "embedder" else {0: "batch"}
+        model_path = os.path.join(model_dir, "model.onnx")
+        torch.onnx.export(model, tuple(sample[input_name] for input_name in input_names), model_path,
+                          input_names=input_names, output_names=[output_name], dynamic_axes=dynamic_axes,
+                          opset_version=14)
+        tokenizer.save_pretrained(model_dir)
+
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic as quantize_onnx
+            quantized_path = os.path.join(model_dir, "model.quantized.onnx")
+            quantize_onnx(model_path, quantized_path, weight_type=QuantType.QInt8)
+            os.replace(quantized_path, model_path)
+        logger.info("Exported %s to %s", model_name, model_path)
+
+
+def _cosine(a, b):
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return (a * b).sum(axis=1) / np.clip(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12, None)
+
+
+def compare_backends(backends, queries, candidates, reference="torch", top_k=6):
+    '''
+        Parity check and latency benchmark of inference backends.
+        `backends` maps a backend name to its (embedder, ranker), `candidates` holds the documents to rerank for
+        each query. Every backend is compared with the `reference` one: cosine similarity of the query embeddings,
+        share of the reference top_k found in its top_k after reranking, and largest difference of the rerank
+        scores. Latencies are per query, in milliseconds.
+    '''
+    outputs = {}
+    for name, (embedder, ranker) in backends.items():
+        embed_ms, rerank_ms, embeddings, rankings = [], [], [], []
+        for query, documents in zip(queries, candidates):
+            start = time.perf_counter()
+            embeddings.append(np.asarray(embedder.embed_queries([query]))[0])
+            embed_ms.append((time.perf_counter() - start) * 1000)
+
+            documents = [copy.copy(document) for document in documents]  # Rankers overwrite the scores.
+            start = time.perf_counter()
+            ranked = ranker.predict(query=query, documents=documents, top_k=len(documents))
+            rerank_ms.append((time.perf_counter() - start) * 1000)
+            rankings.append({document.id: document.score for document in ranked})
+            rankings[-1]["_order"] = [document.id for document in ranked]
+        outputs[name] = (np.array(embeddings), rankings, embed_ms, rerank_ms)
+
+    reference_embeddings, reference_rankings, _, _ = outputs[reference]
+    report = []
+    for name, (embeddings, rankings, embed_ms, rerank_ms) in outputs.items():
+        cosines = _cosine(embeddings, reference_embeddings) if len(embeddings) else np.ones(1)
+        agreement, score_diff = [], 0.0
+        for ranking, reference_ranking in zip(rankings, reference_rankings):
+            expected = set(reference_ranking["_order"][:top_k])
+            if expected:
+                agreement.append(len(expected & set(ranking["_order"][:top_k])) / len(expected))
+            for document_id in reference_ranking["_order"]:
+                score_diff = max(score_diff, abs(ranking[document_id] - reference_ranking[document_id]))
+        report.append({
+            "backend": name,
+            "embedding_cosine_min": float(cosines.min()),
+            "embedding_cosine_mean": float(cosines.mean()),
+            "rerank_top_k_agreement": float(np.mean(agreement)) if agreement else 1.0,
+            "rerank_max_score_diff": score_diff,
+            "embed_p50_ms": float(np.percentile(embed_ms, 50)),
+            "embed_p95_ms": float(np.percentile(embed_ms, 95)),
+            "rerank_p50_ms": float(np.percentile(rerank_ms, 50)),
+            "rerank_p95_ms": float(np.percentile(rerank_ms, 95)),
+        })
+    return report
@@ -0,0 +1,121 @@
+import json
+import os
+import numpy as np
+from api.semantic_search.neighbour_index import pool_neighbours
+from api.semantic_search.semantic_search import CHUNK_OVERFETCH, FEED_SIZE
+from api.semantic_search.vector_index import _memmap
+
+# Written next to the vector index files, see VectorIndexWriter.finish:
+#   interests.json               interest ids and names, in row order, and the number of companies kept per interest
+#   interest_vectors.f32         query embedding of each interest name
+#   interest_company_ids.i64     for each interest, its closest companies best first, -1 padded
+#   interest_scores.f32          and their cosine similarity
+INTERESTS_FILE = "interests.json"
+VECTORS_FILE = "interest_vectors.f32"
+COMPANY_IDS_FILE = "interest_company_ids.i64"
+SCORES_FILE = "interest_scores.f32"
+
+
+def iter_interests():
+    # Yields (interest id, name) for every interest.
+    from api.models import Interest
+
+    yield from Interest.objects.order_by('id').values_list('id', 'name')
+
+
+class InterestIndexWriter:
+    '''
+        Collects the embedding of each interest and writes it with the companies closest to it.
+    '''
+
+    def __init__(self):
+        self.interests = {}  # interest id -> (name, vector)
+
+    def add(self, interest_id, name, vector):
+        self.interests[int(interest_id)] = (name, np.asarray(vector, dtype=np.float32))
+
+    def add_interests(self, embed_queries, interests=None, previous=None):
+        '''
+            Adds `interests` ([(interest id, name)], every interest by default). The vectors of the `previous`
+            InterestIndex are reused for unchanged names, the other names are embedded with `embed_queries`.
+        '''
+        missing = []
+        for interest_id, name in interests if interests is not None else iter_interests():
+            vector = previous.vector(interest_id, name) if previous is not None else None
+            if vector is None:
+                missing.append((interest_id, name))
+            else:
+                self.add(interest_id, name, vector)
+        if missing:
+            for (interest_id, name), vector in zip(missing, embed_queries([name for _, name in missing])):
+                self.add(interest_id, name, vector)
+        return self
+
+    def write(self, directory, faiss_index, company_ids, top_n=FEED_SIZE):
+        # `company_ids` holds the company id of each index row.
+        interest_ids = sorted(self.interests)
+        dim = faiss_index.d
+        vectors = np.array([self.interests[interest_id][1] for interest_id in interest_ids],
+                           dtype=np.float32).reshape(-1, dim)
+        ids = np.full((len(interest_ids), top_n), -1, dtype=np.int64)
+        scores = np.zeros((len(interest_ids), top_n), dtype=np.float32)
+        depth = min(top_n * CHUNK_OVERFETCH, len(company_ids))
+        if len(interest_ids) and depth:
+            found_scores, found_rows = faiss_index.search(vectors, depth)
+            for i, (rows, row_scores) in enumerate(zip(found_rows, found_scores)):
+                companies = pool_neighbours(company_ids, rows, row_scores, None, top_n)
+                if companies:
+                    ids[i, :len(companies)], scores[i, :len(companies)] = zip(*companies)
+
+        with open(os.path.join(directory, VECTORS_FILE), "wb") as f:
+            f.write(vectors.tobytes())
+        with open(os.path.join(directory, COMPANY_IDS_FILE), "wb") as f:
+            f.write(ids.tobytes())
+        with open(os.path.join(directory, SCORES_FILE), "wb") as f:
+            f.write(scores.tobytes())
+        with open(os.path.join(directory, INTERESTS_FILE), "w") as f:
+            json.dump({"ids": interest_ids, "names": [self.interests[interest_id][0] for interest_id in interest_ids],
+                       "dim": dim, "top_n": top_n}, f)
+
+
+class InterestIndex:
+    '''
+        Embedding of each interest and its closest companies when the index was written, so feeds need no model.
+    '''
+
+    def __init__(self, path):
+        with open(os.path.join(path, INTERESTS_FILE)) as f:
+            meta = json.load(f)
+        self.rows = {interest_id: row for row, interest_id in enumerate(meta["ids"])}
+        self.names = meta["names"]
+        self.top_n = meta["top_n"]
+        count = len(meta["ids"])
+        self.vectors = _memmap(os.path.join(path, VECTORS_FILE), np.float32, (count, meta["dim"]))
+        self.company_ids = _memmap(os.path.join(path, COMPANY_IDS_FILE), np.int64, (count, self.top_n))
+        self.scores = _memmap(os.path.join(path, SCORES_FILE), np.float32, (count, self.top_n))
+
+    @classmethod
+    def load(cls, path):
+        # None for indexes written without interests.
+        if not os.path.exists(os.path.join(path, INTERESTS_FILE)):
+            return None
+        return cls(path)
+
+    def items(self):
+        # [(interest id, name)] of the indexed interests.
+        return [(interest_id, self.names[row]) for interest_id, row in self.rows.items()]
+
+    def vector(self, interest_id, name):
+        # None when the interest is missing or was renamed since the index was written.
+        row = self.rows.get(interest_id)
+        if row is None or self.names[row] != name:
+            return None
+        return np.array(self.vectors[row])
+
+    def companies(self, interest_id, name=None):
+        # [(company id, score)] best first, None when the interest is missing or was renamed from `name`.
+        row = self.rows.get(interest_id)
+        if row is None or (name is not None and self.names[row] != name):
+            return None
+        return [(int(company_id), float(score))
+                for company_id, score in zip(self.company_ids[row], self.scores[row]) if company_id != -1]
@@ -0,0 +1,244 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from os import getenv
+import numpy as np
+from api.semantic_search.vector_index import _memmap
+
+# Company fields searched by keyword. A word of the company name counts NAME_WEIGHT times.
+KEYWORD_FIELDS = ("company", "description", "products", "founders")
+NAME_WEIGHT = 3
+BM25_K1 = float(getenv('SEMANTIC_SEARCH_BM25_K1', 1.2))
+BM25_B = float(getenv('SEMANTIC_SEARCH_BM25_B', 0.75))
+# Merge the keyword matches with the dense results of each search.
+HYBRID_SEARCH = getenv('SEMANTIC_SEARCH_HYBRID', 'True') == 'True'
+RRF_K = int(getenv('SEMANTIC_SEARCH_RRF_K', 60))
+# A query that is exactly the name of a company or of one of its products lists these companies first and skips the
+# query expansion. False always expands.
+NAME_MATCH = getenv('SEMANTIC_SEARCH_NAME_MATCH', 'True') == 'True'
+# Product names are the parts of the products field between these separators.
+PRODUCT_SEPARATORS = r"[,;\n|]"
+
+# Written next to the vector index files, see VectorIndexWriter.finish:
+#   keywords.json              vocabulary (sorted terms), company count, average company length and the company ids
+#                              of each company and product name
+#   keyword_company_ids.i64    Company primary key of each keyword document
+#   keyword_lengths.f32        weighted number of words of each company
+#   keyword_offsets.i64        start of the postings of each term (vocabulary size + 1 entries)
+#   keyword_postings.i32       keyword document numbers, grouped by term
+#   keyword_frequencies.f32    weighted count of the term in each of these documents
+KEYWORDS_FILE = "keywords.json"
+COMPANY_IDS_FILE = "keyword_company_ids.i64"
+LENGTHS_FILE = "keyword_lengths.f32"
+OFFSETS_FILE = "keyword_offsets.i64"
+POSTINGS_FILE = "keyword_postings.i32"
+FREQUENCIES_FILE = "keyword_frequencies.f32"
+
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+
+def normalize_name(text):
+    # Company and product names are compared by their words, ignoring case and punctuation.
+    return " ".join(tokenize(text or ""))
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    # Merges lists of ids, best first, into [(id, score)] best first. An id scores 1 / (k + rank) in each list.
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def iter_company_keywords(batch_size=2000, company_ids=None):
+    # Yields (company id, {field: text}) for every company, or the `company_ids` ones, streamed from the database.
+    from api.models import Company
+
+    companies = Company.objects.order_by('id')
+    if company_ids is not None:
+        companies = companies.filter(id__in=company_ids)
+    for row in companies.values_list('id', *KEYWORD_FIELDS).iterator(chunk_size=batch_size):
+        yield row[0], dict(zip(KEYWORD_FIELDS, row[1:]))
+
+
+class KeywordIndexWriter:
+    '''
+        Collects the keyword fields of each company and writes the BM25 inverted index into an index directory.
+    '''
+
+    def __init__(self):
+        self.company_ids = []
+        self.term_counts = []
+        self.names = {}  # normalized company or product name -> company ids
+        self.previous = None
+        self.removed_ids = np.zeros(0, dtype=np.int64)
+
+    def add_index(self, previous, removed_ids=()):
+        '''
+            Keeps the companies of the `previous` KeywordIndex, except `removed_ids`, without reading or tokenizing
+            them again. They are written before the companies added to this writer.
+        '''
+        self.previous = previous
+        self.removed_ids = np.asarray(list(removed_ids), dtype=np.int64)
+        return self
+
+    def add(self, company_id, fields):
+        counts = Counter()
+        for field, text in fields.items():
+            for term in tokenize(text or ""):
+                counts[term] += NAME_WEIGHT if field == "company" else 1
+        self.company_ids.append(int(company_id))
+        self.term_counts.append(counts)
+        names = [fields.get("company")] + re.split(PRODUCT_SEPARATORS, fields.get("products") or "")
+        for name in filter(None, map(normalize_name, names)):
+            company_ids = self.names.setdefault(name, [])
+            if int(company_id) not in company_ids:
+                company_ids.append(int(company_id))
+
+    def add_companies(self, companies=None, company_ids=None):
+        if companies is None:
+            companies = iter_company_keywords(company_ids=company_ids)
+        for company_id, fields in companies:
+            self.add(company_id, fields)
+        return self
+
+    def write(self, directory):
+        # Postings as parallel arrays of terms, documents and frequencies, the kept ones of the previous index first.
+        terms, documents, frequencies = [], [], []
+        for document, counts in enumerate(self.term_counts):
+            for term, count in counts.items():
+                terms.append(term)
+                documents.append(document)
+                frequencies.append(count)
+        documents = np.array(documents, dtype=np.int64)
+        frequencies = np.array(frequencies, dtype=np.float32)
+        company_ids = np.array(self.company_ids, dtype=np.int64)
+        lengths = np.array([sum(counts.values()) for counts in self.term_counts], dtype=np.float32)
+        names = {}
+        previous_terms = np.zeros(0, dtype=np.int64)
+        previous_vocabulary = []
+
+        if self.previous is not None:
+            previous = self.previous
+            kept = ~np.isin(previous.company_ids, self.removed_ids)
+            kept_postings = kept[previous.postings]
+            previous_terms = np.repeat(np.arange(len(previous.vocabulary)), np.diff(previous.offsets))[kept_postings]
+            previous_vocabulary = previous.vocabulary
+            # Kept documents are numbered in their previous order, the added ones follow them.
+            documents = np.concatenate([(np.cumsum(kept) - 1)[previous.postings[kept_postings]],
+                                        documents + int(kept.sum())])
+            frequencies = np.concatenate([np.asarray(previous.frequencies[kept_postings]), frequencies])
+            company_ids = np.concatenate([np.asarray(previous.company_ids)[kept], company_ids])
+            lengths = np.concatenate([np.asarray(previous.lengths)[kept], lengths])
+            removed = set(self.removed_ids.tolist())
+            for name, name_company_ids in previous.names.items():
+                name_company_ids = [company_id for company_id in name_company_ids if company_id not in removed]
+                if name_company_ids:
+                    names[name] = name_company_ids
+        for name, name_company_ids in self.names.items():
+            merged = names.setdefault(name, [])
+            merged += [company_id for company_id in name_company_ids if company_id not in merged]
+
+        vocabulary = sorted({previous_vocabulary[term_id] for term_id in np.unique(previous_terms).tolist()}
+                            | set(terms))
+        term_ids = {term: term_id for term_id, term in enumerate(vocabulary)}
+        previous_term_ids = np.array([term_ids.get(term, -1) for term in previous_vocabulary], dtype=np.int64)
+        terms = np.concatenate([previous_term_ids[previous_terms],
+                                np.array([term_ids[term] for term in terms], dtype=np.int64)])
+        order = np.lexsort((documents, terms))
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(terms, minlength=len(vocabulary)))
+
+        arrays = {
+            COMPANY_IDS_FILE: company_ids,
+            LENGTHS_FILE: lengths,
+            OFFSETS_FILE: offsets,
+            POSTINGS_FILE: documents[order].astype(np.int32),
+            FREQUENCIES_FILE: frequencies[order],
+        }
+        for name, array in arrays.items():
+            array.tofile(os.path.join(directory, name))
+        with open(os.path.join(directory, KEYWORDS_FILE), "w") as f:
+            json.dump({"count": len(company_ids), "postings": len(order),
+                       "average_length": float(lengths.mean()) if len(lengths) else 0.0, "vocabulary": vocabulary,
+                       "names": names}, f)
+
+
+class KeywordIndex:
+    '''
+        BM25 inverted index over the keyword fields of the companies, memory-mapped like the vector index.
+        Scoring a query only reads the postings of its terms.
+    '''
+
+    def __init__(self, path):
+        with open(os.path.join(path, KEYWORDS_FILE)) as f:
+            meta = json.load(f)
+        self.count = meta["count"]
+        self.average_length = meta["average_length"] or 1.0
+        self.vocabulary = meta["vocabulary"]
+        self.term_ids = {term: term_id for term_id, term in enumerate(self.vocabulary)}
+        self.names = meta.get("names", {})
+        self.company_ids = _memmap(os.path.join(path, COMPANY_IDS_FILE), np.int64, (self.count,))
+        self.lengths = _memmap(os.path.join(path, LENGTHS_FILE), np.float32, (self.count,))
+        self.offsets = _memmap(os.path.join(path, OFFSETS_FILE), np.int64, (len(self.term_ids) + 1,))
+        self.postings = _memmap(os.path.join(path, POSTINGS_FILE), np.int32, (meta["postings"],))
+        self.frequencies = _memmap(os.path.join(path, FREQUENCIES_FILE), np.float32, (meta["postings"],))
+
+    @classmethod
+    def load(cls, path):
+        # None for indexes written without keywords.
+        if not os.path.exists(os.path.join(path, KEYWORDS_FILE)):
+            return None
+        return cls(path)
+
+    def __len__(self):
+        return self.count
+
+    def score(self, query):
+        '''
+            Returns the BM25 score of every company for the query, the number of query terms each company contains
+            and the number of distinct query terms.
+        '''
+        terms = set(tokenize(query))
+        scores = np.zeros(self.count, dtype=np.float32)
+        matched = np.zeros(self.count, dtype=np.int32)
+        for term in terms:
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            documents = self.postings[start:end]
+            frequencies = self.frequencies[start:end]
+            idf = math.log(1 + (self.count - len(documents) + 0.5) / (len(documents) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[documents] / self.average_length)
+            scores[documents] += idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+            matched[documents] += 1
+        return scores, matched, len(terms)
+
+    def name_matches(self, query, company_ids=None):
+        # Ids of the companies named `query` or selling a product named `query`, restricted to `company_ids`.
+        matches = self.names.get(normalize_name(query), [])
+        if company_ids is not None:
+            allowed = set(company_ids.tolist())
+            matches = [company_id for company_id in matches if company_id in allowed]
+        return matches
+
+    def search(self, query, top_k, company_ids=None):
+        '''
+            Returns [(company id, score, all query terms found)] best first, only companies with a query term.
+            `company_ids` restricts the search to these companies.
+        '''
+        scores, matched, term_count = self.score(query)
+        if company_ids is not None:
+            matched[~np.isin(self.company_ids, company_ids)] = 0
+        candidates = np.flatnonzero(matched)
+        if len(candidates) > top_k:
+            candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(self.company_ids[document]), float(scores[document]), bool(matched[document] == term_count))
+                for document in candidates]
@@ -0,0 +1,144 @@
+import json
+import os
+from os import getenv
+import numpy as np
+from api.semantic_search.semantic_search import CHUNK_OVERFETCH
+from api.semantic_search.vector_index import ADD_CHUNK_SIZE, _memmap
+
+# Most similar companies precomputed for each company when the index is written, 0 to skip them.
+NEIGHBOURS_TOP_N = int(getenv('SEMANTIC_SEARCH_NEIGHBOURS_TOP_N', 20))
+
+# Written next to the vector index files, see VectorIndexWriter.finish:
+#   neighbours.json            number of companies and of neighbours per company
+#   neighbour_companies.i64    sorted Company primary keys
+#   neighbour_ids.i64          for each of these companies, its most similar companies best first, -1 padded
+#   neighbour_scores.f32       and their cosine similarity
+NEIGHBOURS_FILE = "neighbours.json"
+COMPANIES_FILE = "neighbour_companies.i64"
+IDS_FILE = "neighbour_ids.i64"
+SCORES_FILE = "neighbour_scores.f32"
+
+# How similar companies were found, see SemanticSearchEngine.similar_companies.
+PRECOMPUTED = "precomputed"  # Read from the precomputed neighbours.
+SEARCHED = "searched"  # Searched in the vector index with the company's vector.
+
+
+def company_vector_rows(company_ids):
+    # (sorted company ids, first row of each), the first row of a company is its main document.
+    return np.unique(np.asarray(company_ids), return_index=True)
+
+
+def pool_neighbours(company_ids, rows, scores, exclude_id, top_n):
+    # The `top_n` best companies among rows found by a search, except `exclude_id`, as [(company id, score)].
+    neighbours = {}
+    for row, score in zip(rows, scores):
+        if row == -1:
+            continue
+        neighbour_id = int(company_ids[row])
+        if neighbour_id != exclude_id and neighbour_id not in neighbours:
+            neighbours[neighbour_id] = float(score)
+    return list(neighbours.items())[:top_n]
+
+
+def search_neighbours(ids, scores, positions, faiss_index, vectors, company_ids, companies, first_rows, depth):
+    # Searches the neighbours of the companies at `positions` of `companies` into these rows of `ids` and `scores`.
+    top_n = ids.shape[1]
+    for start in range(0, len(positions), ADD_CHUNK_SIZE):
+        batch = positions[start:start + ADD_CHUNK_SIZE]
+        found_scores, rows = faiss_index.search(np.ascontiguousarray(vectors[first_rows[batch]]), depth)
+        for position, query_rows, query_scores in zip(batch, rows, found_scores):
+            neighbours = pool_neighbours(company_ids, query_rows, query_scores, int(companies[position]), top_n)
+            ids[position], scores[position] = -1, 0
+            if neighbours:
+                ids[position, :len(neighbours)], scores[position, :len(neighbours)] = zip(*neighbours)
+
+
+def carry_over_neighbours(ids, scores, companies, previous, changed_ids):
+    '''
+        Copies the `previous` neighbours of the companies that did not change and have no changed neighbour.
+        Returns the positions of the other companies, whose neighbours have to be searched.
+    '''
+    searched = [np.zeros(0, dtype=np.int64)]
+    for start in range(0, len(companies), ADD_CHUNK_SIZE):
+        batch = companies[start:start + ADD_CHUNK_SIZE]
+        positions = np.minimum(np.searchsorted(previous.companies, batch), len(previous.companies) - 1)
+        previous_ids = np.asarray(previous.ids[positions])
+        kept = ((previous.companies[positions] == batch) & ~np.isin(batch, changed_ids)
+                & ~np.isin(previous_ids, changed_ids).any(axis=1))
+        ids[start:start + len(batch)][kept] = previous_ids[kept]
+        scores[start:start + len(batch)][kept] = previous.scores[positions[kept]]
+        searched.append(start + np.flatnonzero(~kept))
+    return np.concatenate(searched)
+
+
+def write_neighbours(directory, faiss_index, vectors, company_ids, top_n=NEIGHBOURS_TOP_N, previous=None,
+                     changed_ids=()):
+    '''
+        Searches the FAISS index with the vector of every company and writes its `top_n` most similar companies.
+        The searches run ADD_CHUNK_SIZE companies at a time and the results are written to memory-mapped files,
+        so memory use does not grow with the index.
+        With the `previous` NeighbourIndex, only the companies in `changed_ids`, the companies that had one of
+        them as a neighbour and the companies a changed company is now closer to than their last neighbour are
+        searched again, the others keep their previous neighbours.
+    '''
+    companies, first_rows = company_vector_rows(company_ids)
+    depth = top_n + 1 if len(companies) == len(company_ids) else (top_n + 1) * CHUNK_OVERFETCH
+    depth = min(depth, len(company_ids))
+    with open(os.path.join(directory, NEIGHBOURS_FILE), "w") as f:
+        json.dump({"companies": len(companies), "top_n": top_n}, f)
+    with open(os.path.join(directory, COMPANIES_FILE), "wb") as f:
+        f.write(companies.astype(np.int64).tobytes())
+    if not len(companies):
+        for name in (IDS_FILE, SCORES_FILE):
+            open(os.path.join(directory, name), "wb").close()
+        return
+
+    shape = (len(companies), top_n)
+    ids = np.memmap(os.path.join(directory, IDS_FILE), dtype=np.int64, mode='w+', shape=shape)
+    scores = np.memmap(os.path.join(directory, SCORES_FILE), dtype=np.float32, mode='w+', shape=shape)
+    ids[:], scores[:] = -1, 0
+    search = (faiss_index, vectors, company_ids, companies, first_rows, depth)
+    if previous is None or previous.top_n != top_n or not len(previous.companies):
+        search_neighbours(ids, scores, np.arange(len(companies)), *search)
+    else:
+        changed_ids = np.asarray(list(changed_ids), dtype=np.int64)
+        searched = carry_over_neighbours(ids, scores, companies, previous, changed_ids)
+        search_neighbours(ids, scores, searched, *search)
+        # Similarity goes both ways, so the companies close to a changed company are the ones it may have joined.
+        changed = np.flatnonzero(np.isin(companies, changed_ids))
+        neighbour_ids, neighbour_scores = np.asarray(ids[changed]).ravel(), np.asarray(scores[changed]).ravel()
+        found = neighbour_ids != -1
+        positions = np.searchsorted(companies, neighbour_ids[found])
+        closer = (ids[positions, -1] == -1) | (scores[positions, -1] < neighbour_scores[found])
+        search_neighbours(ids, scores, np.setdiff1d(positions[closer], searched), *search)
+    ids.flush()
+    scores.flush()
+
+
+class NeighbourIndex:
+    '''
+        Precomputed most similar companies of each indexed company, read with one binary search.
+    '''
+
+    def __init__(self, path):
+        with open(os.path.join(path, NEIGHBOURS_FILE)) as f:
+            meta = json.load(f)
+        self.top_n = meta["top_n"]
+        self.companies = _memmap(os.path.join(path, COMPANIES_FILE), np.int64, (meta["companies"],))
+        self.ids = _memmap(os.path.join(path, IDS_FILE), np.int64, (meta["companies"], self.top_n))
+        self.scores = _memmap(os.path.join(path, SCORES_FILE), np.float32, (meta["companies"], self.top_n))
+
+    @classmethod
+    def load(cls, path):
+        # None for indexes written without neighbours.
+        if not os.path.exists(os.path.join(path, NEIGHBOURS_FILE)):
+            return None
+        return cls(path)
+
+    def get(self, company_id):
+        # [(company id, score)] best first, None when the company is not indexed.
+        position = int(np.searchsorted(self.companies, company_id))
+        if position == len(self.companies) or self.companies[position] != company_id:
+            return None
+        return [(int(neighbour_id), float(score))
+                for neighbour_id, score in zip(self.ids[position], self.scores[position]) if neighbour_id != -1]
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from os import getenv
+import httpx
+from api.semantic_search.semantic_search import FALCON_MODEL_PROMPT, falcon_request, parse_falcon_response, prompt_node
+
+logger = logging.getLogger(__name__)
+
+# Which backend rewrites the user query before it is embedded: "remote" (Falcon on Hugging Face), "keyword" or "none".
+QUERY_EXPANSION_BACKEND = getenv('QUERY_EXPANSION_BACKEND', 'remote')
+QUERY_EXPANSION_TIMEOUT = float(getenv('QUERY_EXPANSION_TIMEOUT', 5))  # Seconds per remote attempt.
+QUERY_EXPANSION_RETRIES = int(getenv('QUERY_EXPANSION_RETRIES', 1))  # Extra remote attempts after the first one.
+# Total time a search waits for the expansion before it embeds the raw query instead, retries and time spent waiting
+# for a worker included. Attempts are cut short to fit in it.
+QUERY_EXPANSION_BUDGET = float(getenv('QUERY_EXPANSION_BUDGET', 8))
+QUERY_EXPANSION_WORKERS = int(getenv('QUERY_EXPANSION_WORKERS', 4))
+# Remote expansions running or waiting for a worker. Searches use the raw query right away once there are this many.
+QUERY_EXPANSION_MAX_PENDING = int(getenv('QUERY_EXPANSION_MAX_PENDING', 16))
+MIN_ATTEMPT_TIMEOUT = 0.1  # Seconds, no remote attempt is started with less budget left.
+
+# Common portfolio jargon and the words the company descriptions use for it.
+SECTOR_KEYWORDS = {
+    "ai": "artificial intelligence machine learning",
+    "ml": "machine learning data",
+    "llm": "large language models generative artificial intelligence",
+    "genai": "generative artificial intelligence",
+    "fintech": "financial technology payments banking",
+    "insurtech": "insurance technology",
+    "healthtech": "healthcare medical technology",
+    "medtech": "medical devices healthcare",
+    "biotech": "biotechnology life sciences",
+    "edtech": "education technology learning",
+    "proptech": "real estate property technology",
+    "agritech": "agriculture food technology",
+    "cleantech": "clean energy sustainability climate",
+    "climate": "sustainability clean energy carbon",
+    "saas": "software as a service cloud platform",
+    "b2b": "business software enterprise",
+    "iot": "internet of things connected devices sensors",
+    "ecommerce": "e-commerce online retail marketplace",
+    "crypto": "blockchain digital assets",
+    "web3": "blockchain decentralized applications",
+    "cybersecurity": "security threat detection data protection",
+    "logistics": "supply chain delivery transportation",
+}
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "companies", "company", "for", "from", "in", "into", "is", "of",
+    "on", "or", "sector", "startup", "startups", "that", "the", "to", "with",
+}
+
+
+class QueryExpander:
+    '''
+        Turns a short user query into text that reads like the company descriptions in the index.
+    '''
+    name = None
+
+    def expand(self, query):
+        raise NotImplementedError
+
+    async def expand_async(self, query, deadline=None):
+        # Local expanders are cheap enough to run on the event loop, they do not need the deadline.
+        return self.expand(query)
+
+
+class NoOpExpander(QueryExpander):
+    name = "none"
+
+    def expand(self, query):
+        return query
+
+
+class KeywordExpander(QueryExpander):
+    '''
+        Local template expander. Keeps the meaningful words of the query and adds the description vocabulary
+        of the sectors it mentions, e.g. "ai healthcare" also mentions "artificial intelligence machine learning".
+    '''
+    name = "keyword"
+
+    def expand(self, query):
+        keywords = [word for word in re.findall(r"[\w+-]+", query.lower()) if word not in STOP_WORDS]
+        if not keywords:
+            return query
+        related = [SECTOR_KEYWORDS[word] for word in keywords if word in SECTOR_KEYWORDS]
+        description = f"A company that works on {' '.join(keywords)}."
+        if related:
+            description += f" Its products involve {', '.join(related)}."
+        return description
+
+
+class RemoteFalconExpander(QueryExpander):
+    '''
+        Generates a company description with Falcon-7b-instruct on the Hugging Face inference API.
+        Failed or timed out calls are retried, then the query is returned unchanged. With a `deadline`
+        (time.monotonic() value), each attempt is given the time left at most and none starts once it is too short.
+    '''
+    name = "remote"
+
+    def __init__(self, timeout=QUERY_EXPANSION_TIMEOUT, retries=QUERY_EXPANSION_RETRIES, fallback=None):
+        self.timeout = timeout
+        self.retries = retries
+        self.fallback = fallback or NoOpExpander()
+
+    @staticmethod
+    def prompt(query):
+        return (FALCON_MODEL_PROMPT + f" Query: {query}. company description:").strip()
+
+    def attempt_timeout(self, deadline):
+        # Timeout of the next attempt, None when the time left before `deadline` is too short for one.
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        return min(self.timeout, remaining) if remaining >= MIN_ATTEMPT_TIMEOUT else None
+
+    def retry_delay(self, attempt, deadline):
+        # Pause before the attempt after `attempt`, None when there is no attempt left or no time for it.
+        delay = 0.2 * (attempt + 1)
+        if attempt >= self.retries or (deadline is not None and time.monotonic() + delay >= deadline):
+            return None
+        return delay
+
+    def expand(self, query, deadline=None):
+        for attempt in range(self.retries + 1):
+            timeout = self.attempt_timeout(deadline)
+            if timeout is None:
+                break
+            try:
+                return prompt_node(self.prompt(query), timeout=timeout)
+            except Exception as e:
+                logger.warning("Query expansion attempt %s failed: %s", attempt + 1, e)
+                delay = self.retry_delay(attempt, deadline)
+                if delay is None:
+                    break
+                time.sleep(delay)
+        return self.fallback.expand(query)
+
+    async def expand_async(self, query, deadline=None):
+        # Same as expand, without holding a thread while waiting for Hugging Face.
+        url, headers, data = falcon_request(self.prompt(query))
+        for attempt in range(self.retries + 1):
+            timeout = self.attempt_timeout(deadline)
+            if timeout is None:
+                break
+            try:
+                response = await get_async_client().post(url, headers=headers, json=data, timeout=timeout)
+                response.raise_for_status()
+                return parse_falcon_response(response.json())
+            except Exception as e:
+                logger.warning("Query expansion attempt %s failed: %s", attempt + 1, e)
+                delay = self.retry_delay(attempt, deadline)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+        return await self.fallback.expand_async(query)
+
+
+QUERY_EXPANDERS = {
+    NoOpExpander.name: NoOpExpander,
+    KeywordExpander.name: KeywordExpander,
+    RemoteFalconExpander.name: RemoteFalconExpander,
+}
+
+# Expansions run here so a search can stop waiting for one without blocking on it.
+_executor = ThreadPoolExecutor(max_workers=QUERY_EXPANSION_WORKERS, thread_name_prefix="query-expansion")
+# Released when an expansion finishes or is cancelled before it started.
+_pending = threading.BoundedSemaphore(QUERY_EXPANSION_MAX_PENDING)
+# One pooled HTTP client per event loop, a client can not be shared between loops.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = httpx.AsyncClient()
+    return _async_clients[loop]
+
+
+def get_query_expander(backend=QUERY_EXPANSION_BACKEND):
+    if backend not in QUERY_EXPANDERS:
+        raise ValueError(f"Unknown query expansion backend '{backend}'. Options: {', '.join(QUERY_EXPANDERS)}")
+    return QUERY_EXPANDERS[backend]()
+
+
+def submit_expansion(expander, query, deadline):
+    # Future of the remote expansion, None when QUERY_EXPANSION_MAX_PENDING expansions are already pending.
+    if not _pending.acquire(blocking=False):
+        return None
+    future = _executor.submit(expander.expand, query, deadline)
+    future.add_done_callback(lambda _: _pending.release())
+    return future
+
+
+def expand_query(query, expander=None, budget=QUERY_EXPANSION_BUDGET):
+    '''
+        Returns (text to embed, whether the expansion fell back to the raw query).
+        Local expanders run inline, the remote one is given at most `budget` seconds from now, time spent waiting
+        for a worker included. The raw query is used right away when too many expansions are pending.
+    '''
+    expander = expander or get_query_expander()
+    if not isinstance(expander, RemoteFalconExpander):
+        return expander.expand(query), False
+
+    deadline = time.monotonic() + budget
+    future = submit_expansion(expander, query, deadline)
+    if future is None:
+        logger.warning("Too many pending query expansions, searching with the raw query")
+        return query, True
+    try:
+        expanded_query = future.result(timeout=max(0, deadline - time.monotonic()))
+    except TimeoutError:
+        future.cancel()
+        logger.warning("Query expansion exceeded its %ss budget, searching with the raw query", budget)
+        return query, True
+    return expanded_query, expanded_query == query
+
+
+async def expand_query_async(query, expander=None, budget=QUERY_EXPANSION_BUDGET):
+    # expand_query for async views, the remote call is cancelled once it runs out of budget.
+    expander = expander or get_query_expander()
+    try:
+        expanded_query = await asyncio.wait_for(expander.expand_async(query, time.monotonic() + budget),
+                                                timeout=budget)
+    except asyncio.TimeoutError:
+        logger.warning("Query expansion exceeded its %ss budget, searching with the raw query", budget)
+        return query, True
+    return expanded_query, isinstance(expander, RemoteFalconExpander) and expanded_query == query
+
+
+def expand_queries(queries, expander=None, budget=QUERY_EXPANSION_BUDGET):
+    '''
+        expand_query for several queries. Remote expansions run in parallel and share one `budget`,
+        queries not expanded in time fall back to their raw text.
+    '''
+    expander = expander or get_query_expander()
+    if not isinstance(expander, RemoteFalconExpander):
+        return [(expander.expand(query), False) for query in queries]
+
+    deadline = time.monotonic() + budget
+    futures = [submit_expansion(expander, query, deadline) for query in queries]
+    expansions = []
+    for query, future in zip(queries, futures):
+        if future is None:
+            expansions.append((query, True))
+            continue
+        try:
+            expanded_query = future.result(timeout=max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            future.cancel()
+            expansions.append((query, True))
+        else:
+            expansions.append((expanded_query, expanded_query == query))
+    fell_back = sum(fell_back for _, fell_back in expansions)
+    if fell_back:
+        logger.warning("%s of %s query expansions fell back to the raw query", fell_back, len(queries))
+    return expansions
@@ -0,0 +1,94 @@
+import time
+from os import getenv
+
+# "fixed" always reranks the top_k_retrieve dense hits with the cross-encoder.
+# "adaptive" picks the depth from the dense scores of each query, see RerankPolicy.
+RERANK_POLICY = getenv('SEMANTIC_SEARCH_RERANK_POLICY', 'adaptive')
+RERANK_POLICIES = ("fixed", "adaptive")
+# Dense score gap between the last returned company and the next one above which the cross-encoder is skipped.
+RERANK_SKIP_MARGIN = float(getenv('SEMANTIC_SEARCH_RERANK_SKIP_MARGIN', 0.1))
+# Dense score gap at the usual depth below which more candidates are reranked.
+RERANK_DEEP_MARGIN = float(getenv('SEMANTIC_SEARCH_RERANK_DEEP_MARGIN', 0.01))
+RERANK_MAX_DEPTH = int(getenv('SEMANTIC_SEARCH_RERANK_MAX_DEPTH', 24))
+# Candidates still waiting once the budget is spent keep their dense order. 0 disables the budget.
+RERANK_BUDGET_MS = float(getenv('SEMANTIC_SEARCH_RERANK_BUDGET_MS', 0))
+
+# Which path ran, reported with the search results.
+DENSE = "dense"  # Dense order, the cross-encoder was skipped.
+RERANKED = "reranked"  # The usual top_k_retrieve candidates were reranked.
+DEEP = "deep"  # More candidates than usual were reranked.
+BUDGET = "budget"  # The time budget ran out before every candidate was reranked.
+KEYWORD = "keyword"  # The query names a company or a product, listed first and searched without the expansion.
+
+
+class RerankPolicy:
+    '''
+        Decides how many dense candidates of a query the cross-encoder reranks, from the gaps between their
+        dense scores (cosine similarities, best first), and reranks them within an optional time budget.
+    '''
+
+    def __init__(self, policy=RERANK_POLICY, skip_margin=RERANK_SKIP_MARGIN, deep_margin=RERANK_DEEP_MARGIN,
+                 max_depth=RERANK_MAX_DEPTH, budget_ms=RERANK_BUDGET_MS):
+        if policy not in RERANK_POLICIES:
+            raise ValueError(f"Unknown rerank policy '{policy}'. Options: {', '.join(RERANK_POLICIES)}")
+        self.policy = policy
+        self.skip_margin = skip_margin
+        self.deep_margin = deep_margin
+        self.max_depth = max_depth
+        self.budget_ms = budget_ms
+
+    def retrieve_depth(self, top_k_retrieve):
+        # Dense hits to fetch so a deep rerank has candidates to look at.
+        return top_k_retrieve if self.policy == "fixed" else max(top_k_retrieve, self.max_depth)
+
+    def depth(self, scores, top_k_retrieve, top_k_rank, adaptive=True):
+        '''
+            Returns (number of candidates to rerank, path) for the dense scores of a query's candidates.
+            Candidates that are not in dense order (adaptive=False) always get the usual depth.
+        '''
+        if self.policy == "fixed" or not adaptive:
+            return min(len(scores), top_k_retrieve), RERANKED
+        # The returned companies are clearly ahead of the others, the cross-encoder would only reorder them.
+        if len(scores) > top_k_rank and scores[top_k_rank - 1] - scores[top_k_rank] >= self.skip_margin:
+            return 0, DENSE
+        # The usual cut falls between near ties, the candidates after it are as likely to be relevant.
+        if len(scores) > top_k_retrieve and scores[top_k_retrieve - 1] - scores[top_k_retrieve] < self.deep_margin:
+            return min(len(scores), self.max_depth), DEEP
+        return min(len(scores), top_k_retrieve), RERANKED
+
+    def rerank(self, ranker, queries, candidates, top_k_retrieve, top_k_rank, adaptive=None):
+        '''
+            Reranks the candidates (dense order) of each query and returns ([documents], path) for each one.
+            `adaptive` tells for each query whether the candidate scores are dense scores, by default they all are.
+            Without a budget each query is reranked in one cross-encoder pass. With one, candidates are reranked
+            top_k_rank at a time, best dense scores first, until the budget is spent.
+        '''
+        adaptive = adaptive or [True] * len(candidates)
+        depths, paths = zip(*(self.depth([document.score for document in documents], top_k_retrieve, top_k_rank,
+                                         query_adaptive) for documents, query_adaptive in zip(candidates, adaptive)))
+        chunk_size = top_k_rank if self.budget_ms else max(depths, default=0)
+        deadline = time.perf_counter() + self.budget_ms / 1000
+        done = [0] * len(queries)
+        reranked = [[] for _ in queries]
+
+        while chunk_size:
+            pending = [i for i in range(len(queries)) if done[i] < depths[i]]
+            if not pending:
+                break
+            chunks = [candidates[i][done[i]:min(done[i] + chunk_size, depths[i])] for i in pending]
+            if len(pending) == 1:
+                ranked = [ranker.predict(query=queries[pending[0]], documents=chunks[0], top_k=len(chunks[0]))]
+            else:
+                ranked = ranker.predict_batch(queries=[queries[i] for i in pending], documents=chunks,
+                                              top_k=max(len(chunk) for chunk in chunks))
+            for i, chunk, documents in zip(pending, chunks, ranked):
+                done[i] += len(chunk)
+                reranked[i].extend(documents)
+            if self.budget_ms and time.perf_counter() >= deadline:
+                break
+
+        results = []
+        for i, documents in enumerate(candidates):
+            ranked = sorted(reranked[i], key=lambda document: document.score, reverse=True) + documents[done[i]:]
+            results.append((ranked[:top_k_rank], BUDGET if done[i] < depths[i] else paths[i]))
+        return results
@@ -1,82 +1,74 @@
 import os
-from haystack.document_stores import FAISSDocumentStore
 from haystack.schema import Document
-from haystack.nodes import EmbeddingRetriever, PreProcessor, SentenceTransformersRanker
-from haystack.pipelines import Pipeline
+from haystack.nodes import PreProcessor
 from os import getenv
 from dotenv import load_dotenv
 
 load_dotenv()
 
 NUM_OF_RESULTS_TO_RETURN = 6
+DENSE_RETRIEVER_TOP_K = 12
 (EMBEDDING_MODEL, EMBEDDING_DIM) = ("sentence-transformers/all-MiniLM-L6-v2", 384)
 RANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 FIASS_LOAD_FILE_NAME = "semantic_search"
-FIASS_LOAD_FILE_PATH = os.path.join(CURRENT_DIR, FIASS_LOAD_FILE_NAME + ".fiass")
+FIASS_LOAD_FILE_PATH = os.path.join(CURRENT_DIR, FIASS_LOAD_FILE_NAME + ".fiass")  # Old SQL backed document store.
+# Directory of the search index that is queried without the database (see vector_index.py).
+SEARCH_INDEX_PATH = getenv('SEMANTIC_SEARCH_INDEX_PATH', os.path.join(CURRENT_DIR, "semantic_search_index"))
+# Longer company texts indexed as separate chunks of CHUNK_WORDS words, at most MAX_COMPANY_CHUNKS per company.
+CHUNK_FIELDS = tuple(field for field in getenv('SEMANTIC_SEARCH_CHUNK_FIELDS', 'products,customers_partners,founders')
+                     .split(',') if field)
+CHUNK_WORDS = int(getenv('SEMANTIC_SEARCH_CHUNK_WORDS', 128))
+CHUNK_OVERLAP = 16
+MAX_COMPANY_CHUNKS = int(getenv('SEMANTIC_SEARCH_MAX_COMPANY_CHUNKS', 8))
+# How the scores of a company's chunks make its score: "max" keeps the best chunk, "sum" adds the retrieved ones.
+CHUNK_POOLING = getenv('SEMANTIC_SEARCH_CHUNK_POOLING', 'max')
+CHUNK_POOLINGS = ("max", "sum")
+# Index rows fetched per company wanted when companies have several rows, so chunks do not crowd other companies out.
+CHUNK_OVERFETCH = int(getenv('SEMANTIC_SEARCH_CHUNK_OVERFETCH', 3))
+# Most queries accepted by one batch search request.
+MAX_BATCH_QUERIES = int(getenv('SEMANTIC_SEARCH_MAX_BATCH_QUERIES', 64))
+# Most similar companies returned for one company.
+MAX_SIMILAR_COMPANIES = int(getenv('SEMANTIC_SEARCH_MAX_SIMILAR_COMPANIES', 50))
+# Companies kept in the feed of each user, and precomputed for each interest with the index.
+FEED_SIZE = int(getenv('SEMANTIC_SEARCH_FEED_SIZE', 24))
+# Size limits and time to live (in seconds) of the search result cache and the query embedding cache.
+RESULT_CACHE_SIZE = int(getenv('SEMANTIC_SEARCH_RESULT_CACHE_SIZE', 256))
+RESULT_CACHE_TTL = int(getenv('SEMANTIC_SEARCH_RESULT_CACHE_TTL', 600))
+EMBEDDING_CACHE_SIZE = int(getenv('SEMANTIC_SEARCH_EMBEDDING_CACHE_SIZE', 1024))
+EMBEDDING_CACHE_TTL = int(getenv('SEMANTIC_SEARCH_EMBEDDING_CACHE_TTL', 3600))
 FALCON_MODEL_PROMPT = f"""Generate a concise company description based on the provided query below. Ensure it remains under 100 words, omit any company names or fabricated achievements and clearly outlines the company's activities. Query may be vague. Understand the context and craft a succinct description accordingly. Do not repeat yourself and keep within the 100 words limit."""
 
 
-def train_search_model():
-    import requests
-    import pandas as pd
+def create_company_document(company_id, company, description, tech_sector):
+    # tech_sector is the comma separated sector names. company_id lets single companies be updated in the index.
+    return Document(
+        content=str(company) + " " + str(description) + " " + str(tech_sector),
+        meta={"title": str(company), "abstract": str(description), "sector": str(tech_sector),
+              "company_id": int(company_id)},
+    )
 
-    # Get all the company data from the API. Only contains the following fields: company, description, tech_sector.
-    api_url = getenv('API_URL')
-    response = requests.get(api_url + "companies-for-model-training/")
-    companies = response.json()
 
-    df = pd.DataFrame(companies)
-    df['tech_sector'] = df['tech_sector'].apply(', '.join)  # Convert the tech_sector list to a string.
+def create_company_chunk_document(company_id, company, field, text):
+    # Split into chunks by the index builder, the company name is added to each chunk after the split.
+    return Document(content=str(text), meta={"title": str(company), "field": field, "company_id": int(company_id)})
 
-    # Create a new FAISSDocumentStore or load the existing one if it exists.
-    if os.path.exists(FIASS_LOAD_FILE_PATH):
-        document_store = FAISSDocumentStore.load(FIASS_LOAD_FILE_PATH)
-    else:
-        user = getenv('DB_USER')
-        password = getenv('DB_PASSWORD')
-        host = getenv('DB_HOST')
-        port = getenv('DB_PORT')
-        sql_url = f"postgresql://{user}:{password}@{host}:{port}/postgres"
-        document_store = FAISSDocumentStore(
-            sql_url=sql_url, faiss_index_factory_str="Flat", embedding_dim=EMBEDDING_DIM)
-
-    documents = []
-    for index, doc in df.iterrows():
-        documents.append(
-            Document(
-                content=str(doc["company"]) + " " + str(doc["description"]) + " " + str(doc["tech_sector"]),
-                meta={"title": str(doc["company"]), "abstract": str(
-                    doc["description"]), "sector": str(doc["tech_sector"])},
-            )
-        )
-
-    preprocessor = PreProcessor(
+
+def get_preprocessor(split_length=512, split_overlap=32):
+    return PreProcessor(
         clean_empty_lines=True,
         clean_whitespace=True,
         clean_header_footer=True,
         split_by="word",
-        split_length=512,
-        split_overlap=32,
+        split_length=split_length,
+        split_overlap=split_overlap,
         split_respect_sentence_boundary=True,
-    )
-    docs_to_index = preprocessor.process(documents)
-
-    dense_retriever = EmbeddingRetriever(
-        document_store=document_store,
-        embedding_model=EMBEDDING_MODEL,
-        use_gpu=True,
-        scale_score=False,
+        progress_bar=False,
     )
 
-    document_store.delete_documents()
-    document_store.write_documents(docs_to_index)
-    document_store.update_embeddings(retriever=dense_retriever)
-    document_store.save(FIASS_LOAD_FILE_PATH)
 
-
-def prompt_node(query):
-    import requests
+def falcon_request(query):
+    # Url, headers and body of a Falcon-7b-instruct call on the Hugging Face inference API.
     falcon_7b_instruct_url = "https://api-inference.huggingface.co/models/tiiuae/falcon-7b-instruct"
     huggingface_api_token = getenv('HUGGINGFACE_API_TOKEN')
     headers = {"Authorization": f"Bearer {huggingface_api_token}"}
@@ -91,54 +83,211 @@ def prompt_node(query):
             "num_return_sequences": 1,  # specify how many sequences to generate. Our use case only requires one output.
         }
     }
+    return falcon_7b_instruct_url, headers, data
+
 
-    response = requests.post(falcon_7b_instruct_url, headers=headers, json=data)
-    sequences = response.json()[0]['generated_text']
+def parse_falcon_response(response_json):
+    sequences = response_json[0]['generated_text']
     description = sequences.split("company description:")[1]
     return description.strip()
 
 
-def search_model(query):
+def prompt_node(query, timeout=None):
+    import requests
+    url, headers, data = falcon_request(query)
+    response = requests.post(url, headers=headers, json=data, timeout=timeout)
+    response.raise_for_status()
+    return parse_falcon_response(response.json())
+
+
+class SearchResults(list):
+    '''
+        Results of one search, best first, with the rerank path that produced them (see rerank.py).
+    '''
+
+    def __init__(self, results=(), rerank=None):
+        super().__init__(results)
+        self.rerank = rerank
+
+    def to_cache(self):
+        return self.rerank, tuple(tuple(result.items()) for result in self)
+
+    @classmethod
+    def from_cache(cls, entry):
+        rerank, results = entry
+        return cls((dict(result) for result in results), rerank=rerank)
+
+
+def name_matches_first(matches, documents, top_k=NUM_OF_RESULTS_TO_RETURN):
+    # The companies named by the query, then the searched companies that are not among them, up to top_k.
+    named = {document.meta["company_id"] for document in matches}
+    padded = list(matches) + [document for document in documents if document.meta["company_id"] not in named]
+    return SearchResults(padded[:top_k], rerank=matches.rerank)
+
+
+def search_cache_key(search_engine, query, filters):
+    # The index version is part of the key so results never outlive the index they were computed on.
+    from api.semantic_search.cache import normalize_query
+
+    return search_engine.index_version, normalize_query(query), tuple(filters.items())
+
+
+def get_cached_search(search_engine, query, filters):
+    '''
+        Returns (cache key, SearchResults or None) for one search with normalized `filters`.
+        Repeated queries are answered from the cache without calling the LLM or the models.
+    '''
+    from api.semantic_search.timing import annotate
+
+    cache_key = search_cache_key(search_engine, query, filters)
+    results = search_engine.result_cache.get(cache_key)
+    annotate(cached=results is not None)
+    return cache_key, None if results is None else SearchResults.from_cache(results)
+
+
+def search_results(search_engine, cache_key, text, documents, matches=None, expansion_fell_back=False):
+    '''
+        SearchResults of the ranked `documents`, after the companies named by the query (`matches`, see
+        SemanticSearchEngine.keyword_match). `text` is the query the documents were searched with.
+        Degraded results are not kept when the expansion fell back, the next search may get a proper expansion.
+    '''
+    if matches is not None:
+        documents = name_matches_first(matches, documents)
+    results = SearchResults(get_company_results({"query": text, "documents": documents}), rerank=documents.rerank)
+    if not expansion_fell_back:
+        search_engine.result_cache.set(cache_key, results.to_cache())
+    return results
+
+
+def finish_search(search_engine, cache_key, text, documents, matches=None, expansion_fell_back=False):
+    # search_results of one search, reported in the request log line.
+    from api.semantic_search.timing import annotate
+
+    results = search_results(search_engine, cache_key, text, documents, matches, expansion_fell_back)
+    annotate(rerank=results.rerank, expansion_fell_back=expansion_fell_back)
+    return results
+
+
+def search_companies(query, filters=None, search_engine=None, expander=None, top_k_retrieve=DENSE_RETRIEVER_TOP_K):
+    '''
+        Returns the best matching companies as SearchResults [{"id": company id, "company": title}], best first.
+        `filters` ({facet: values}, see facet_index.py) restrict the search to the matching companies.
+        Returns the error message instead when no search index has been built.
+        `search_engine`, `expander` and `top_k_retrieve` replace the process wide engine, the configured query
+        expansion and the number of reranked candidates, for benchmarks.
+    '''
+    from api.semantic_search.engine import get_search_engine, SearchIndexNotFound
+    from api.semantic_search.facet_index import normalize_filters
+    from api.semantic_search.query_expansion import expand_query
+    from api.semantic_search.timing import EXPAND, span
+
     if query is None or query == "":
         return None
 
-    # Generate a company description based on the query.
-    falcon_model_prompt_input = FALCON_MODEL_PROMPT + f" Query: {query}. company description:"
-    generated_description = prompt_node(falcon_model_prompt_input.strip())
+    # The engine keeps the index and both models loaded across requests.
+    search_engine = search_engine or get_search_engine()
+    try:
+        search_engine.ensure_loaded()
+    except SearchIndexNotFound as e:
+        return str(e)
 
-    if os.path.exists(FIASS_LOAD_FILE_PATH):
-        document_store = FAISSDocumentStore.load(FIASS_LOAD_FILE_PATH)
-    else:
-        return "No search model found. Please train the search model first."
+    filters = normalize_filters(filters)
+    cache_key, results = get_cached_search(search_engine, query, filters)
+    if results is not None:
+        return results
 
-    dense_retriever = EmbeddingRetriever(
-        document_store=document_store,
-        embedding_model=EMBEDDING_MODEL,
-        use_gpu=True,
-        scale_score=False,
-    )
+    # A company or product name is listed first and the query is searched as typed, without the LLM.
+    generated_description, expansion_fell_back = query, False
+    matches = search_engine.keyword_match(query, NUM_OF_RESULTS_TO_RETURN, filters)
+    if matches is None:
+        # Generate a company description based on the query. Falls back to the raw query when the expansion is too slow.
+        with span(EXPAND):
+            generated_description, expansion_fell_back = expand_query(query, expander)
+    documents = search_engine.search(generated_description, top_k_retrieve=top_k_retrieve,
+                                     top_k_rank=NUM_OF_RESULTS_TO_RETURN, keyword_query=query, filters=filters)
+    return finish_search(search_engine, cache_key, generated_description, documents, matches, expansion_fell_back)
 
-    rerank = SentenceTransformersRanker(model_name_or_path=RANKER_MODEL)
 
-    pipeline = Pipeline()
-    pipeline.add_node(component=dense_retriever, name="DenseRetriever", inputs=["Query"])
-    pipeline.add_node(component=rerank, name="ReRanker", inputs=["DenseRetriever"])
+def search_companies_batch(queries, filters=None):
+    '''
+        search_companies for a list of queries. Cached queries are answered directly, the others are expanded in
+        parallel, unless they name a company, and searched together with SemanticSearchEngine.search_batch.
+        `filters` apply to every query.
+        Returns one result list per query, or the error message when no search index has been built.
+    '''
+    from api.semantic_search.engine import get_search_engine, SearchIndexNotFound
+    from api.semantic_search.facet_index import normalize_filters
+    from api.semantic_search.query_expansion import expand_queries
+    from api.semantic_search.timing import EXPAND, annotate, span
 
-    prediction = pipeline.run(
-        query=generated_description,
-        params={
-            "DenseRetriever": {"top_k": 12},
-            "ReRanker": {"top_k": NUM_OF_RESULTS_TO_RETURN},
-        },
-    )
-    return get_title_results(prediction)  # Uncomment this line to return only the titles. (Production purposes)
-    # return prediction  # Uncomment this line to return the full prediction. (Debugging purposes)
+    search_engine = get_search_engine()
+    try:
+        search_engine.ensure_loaded()
+    except SearchIndexNotFound as e:
+        return str(e)
+
+    filters = normalize_filters(filters)
+    cache_keys = [search_cache_key(search_engine, query, filters) for query in queries]
+    results = [search_engine.result_cache.get(cache_key) for cache_key in cache_keys]
+    # Duplicated queries are only searched once.
+    missing = list(dict.fromkeys(key for key, result in zip(cache_keys, results) if result is None))
+    annotate(queries=len(queries), searched=len(missing))
+    if missing:
+        missing_queries = [queries[cache_keys.index(cache_key)] for cache_key in missing]
+        # Company and product names are searched as typed, the other queries are expanded first.
+        name_matches = [search_engine.keyword_match(query, NUM_OF_RESULTS_TO_RETURN, filters)
+                        for query in missing_queries]
+        expansions = [(query, False) for query in missing_queries]
+        to_expand = [i for i, matches in enumerate(name_matches) if matches is None]
+        if to_expand:
+            with span(EXPAND):
+                for i, expansion in zip(to_expand, expand_queries([missing_queries[i] for i in to_expand])):
+                    expansions[i] = expansion
+        ranked_documents = search_engine.search_batch(
+            [text for text, _ in expansions], top_k_retrieve=DENSE_RETRIEVER_TOP_K,
+            top_k_rank=NUM_OF_RESULTS_TO_RETURN, keyword_queries=missing_queries, filters=filters)
+
+        searched = {}
+        for cache_key, (text, fell_back), documents, matches in zip(missing, expansions, ranked_documents,
+                                                                    name_matches):
+            searched[cache_key] = search_results(search_engine, cache_key, text, documents, matches,
+                                                 fell_back).to_cache()
+        results = [searched[key] if result is None else result for key, result in zip(cache_keys, results)]
+    return [SearchResults.from_cache(query_results) for query_results in results]
+
+
+def find_similar_companies(company_id, top_k=NUM_OF_RESULTS_TO_RETURN, filters=None):
+    '''
+        Returns ([{"id": company id, "company": title, "score": similarity}] best first, how they were found) for the
+        companies closest to `company_id` in the search index, or None when the company is not indexed.
+        No model runs, the company's stored vector is compared with the others.
+        Returns the error message instead when no search index has been built.
+    '''
+    from api.semantic_search.engine import get_search_engine, SearchIndexNotFound
+
+    search_engine = get_search_engine()
+    try:
+        found = search_engine.similar_companies(company_id, top_k, filters)
+    except SearchIndexNotFound as e:
+        return str(e)
+    if found is None:
+        return None
+    documents, source = found
+    return [{"id": int(doc.meta["company_id"]), "company": doc.meta["title"], "score": float(doc.score)}
+            for doc in documents], source
+
+
+def search_model(query):
+    results = search_companies(query)
+    if not isinstance(results, list):
+        return results
+    return [result["company"] for result in results]  # Only the titles. (Production purposes)
 
 
 def pretty_print_results(prediction):
     for doc in prediction["documents"]:
         print(doc.meta["title"], "\t", doc.score)
-        print(doc.meta["abstract"])
+        print(doc.content)
         print("\n", "\n")
 
 
@@ -149,6 +298,13 @@ def get_title_results(prediction):
     return titles
 
 
+def get_company_results(prediction):
+    results = []
+    for doc in prediction["documents"]:
+        results.append({"id": int(doc.meta["company_id"]), "company": doc.meta["title"]})
+    return results
+
+
 def main():
     query = "AI and machine learning company in the healthcare sector."  # Static query for debugging purposes.
     prediction = search_model(query)
@@ -160,5 +316,5 @@ def main():
 
 
 if __name__ == "__main__":
-    # train_search_model()  # Uncomment this line to (re)train the search model.
+    # Build the search index first with `python manage.py build_search_index`.
     main()
@@ -0,0 +1,148 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from os import getenv
+
+logger = logging.getLogger(__name__)
+
+# Adds a Server-Timing header with the duration of each stage to the semantic search responses.
+SERVER_TIMING = getenv('SEMANTIC_SEARCH_SERVER_TIMING', 'False') == 'True'
+# Logs one json line per search with the duration of each stage, at INFO level on this module's logger.
+TIMING_LOG = getenv('SEMANTIC_SEARCH_TIMING_LOG', 'True') == 'True'
+# Who may read the stage histograms: "off", "token" (requests sending "Authorization: Bearer <METRICS_TOKEN>") or
+# "all". Behind a proxy every request comes from the proxy's address, so the client address is not checked.
+METRICS_ACCESS = getenv('SEMANTIC_SEARCH_METRICS', 'off')
+METRICS_TOKEN = getenv('SEMANTIC_SEARCH_METRICS_TOKEN', '')
+# Upper bounds of the histogram buckets, in milliseconds.
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Stages of a search, recorded by span().
+LOAD_MODELS = "load_models"  # Loading the embedding model and the cross-encoder.
+LOAD_INDEX = "load_index"  # Loading a new version of the index.
+KEYWORD = "keyword"  # Keyword index lookups and their fusion with the dense results.
+EXPAND = "expand"  # Query expansion by the language model.
+EMBED = "embed"  # Query embedding.
+ANN = "ann"  # Vector index search.
+RERANK = "rerank"  # Cross-encoder.
+NEIGHBOURS = "neighbours"  # Similar companies of a company, see SemanticSearchEngine.similar_companies.
+CARDS = "cards"  # Company cards read from the database.
+TOTAL = "total"
+
+_current_timings = contextvars.ContextVar("search_timings", default=None)
+
+
+class StageHistograms:
+    '''
+        Cumulative histograms of the stage durations of this process, in the Prometheus text format.
+    '''
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stages = {}  # stage: [count per bucket (+Inf last), sum of the durations]
+
+    def observe(self, stage, duration_ms):
+        with self._lock:
+            counts, total = self._stages.setdefault(stage, [[0] * (len(self.buckets) + 1), 0.0])
+            counts[next((i for i, bound in enumerate(self.buckets) if duration_ms <= bound), len(self.buckets))] += 1
+            self._stages[stage][1] = total + duration_ms
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: (list(counts), total) for stage, (counts, total) in self._stages.items()}
+
+    def clear(self):
+        with self._lock:
+            self._stages.clear()
+
+    def to_prometheus(self):
+        lines = ["# HELP semantic_search_stage_seconds Duration of each stage of the semantic searches.",
+                 "# TYPE semantic_search_stage_seconds histogram"]
+        for stage, (counts, total) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else f"{bound / 1000:g}"
+                lines.append(f'semantic_search_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'semantic_search_stage_seconds_sum{{stage="{stage}"}} {total / 1000:.6f}')
+            lines.append(f'semantic_search_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+stage_histograms = StageHistograms()
+
+
+class SearchTimings:
+    '''
+        Stage durations (milliseconds) of one search request, in the order the stages ended, with a few fields
+        describing the search for the log line.
+    '''
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.spans = []
+        self.fields = {}
+
+    def add(self, stage, duration_ms):
+        self.spans.append((stage, duration_ms))
+
+    def stages(self):
+        # Total duration of each stage, a stage can run several times per request.
+        stages = {}
+        for stage, duration_ms in self.spans:
+            stages[stage] = stages.get(stage, 0.0) + duration_ms
+        return stages
+
+    def server_timing(self):
+        return ", ".join(f"{stage};dur={duration_ms:.1f}" for stage, duration_ms in self.stages().items())
+
+    def log_record(self):
+        return {"event": "semantic_search", "endpoint": self.endpoint, **self.fields,
+                "stages_ms": {stage: round(duration_ms, 2) for stage, duration_ms in self.stages().items()}}
+
+
+@contextmanager
+def timed_search(endpoint):
+    '''
+        Collects the spans of one search request. Yields its SearchTimings, which also get the total duration.
+        Threads started with copy_context() (see run_inference) add their spans to the same request.
+    '''
+    timings = SearchTimings(endpoint)
+    token = _current_timings.set(timings)
+    try:
+        with span(TOTAL):
+            yield timings
+    finally:
+        _current_timings.reset(token)
+        if TIMING_LOG:
+            logger.info(json.dumps(timings.log_record()))
+
+
+@contextmanager
+def span(stage):
+    # Times the block: added to the current request's timings, if any, and to the stage histograms.
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        stage_histograms.observe(stage, duration_ms)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(stage, duration_ms)
+
+
+def annotate(**fields):
+    # Adds fields to the log line of the current request.
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.fields.update(fields)
+
+
+def add_server_timing(response, timings):
+    if SERVER_TIMING:
+        response["Server-Timing"] = timings.server_timing()
+    return response
@@ -0,0 +1,479 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from os import getenv
+import faiss
+import numpy as np
+from api.semantic_search.ann import (INDEX_TYPE, IVF_TRAINING_SAMPLE, create_faiss_index, filtered_search_parameters,
+                                   set_search_parameters)
+
+logger = logging.getLogger(__name__)
+
+# An index is a directory holding one row per indexed document:
+#   meta.json                     format version, row count, embedding dimension and index type
+#   vectors.f32                   float32 embeddings, row major
+#   company_ids.i64               Company primary key of each row
+#   title.bin / title.off         utf-8 titles and their int64 start offsets (row count + 1 entries)
+#   content.bin / content.off     utf-8 document text, read by the cross-encoder
+#   index.faiss                   FAISS index over the vectors, its labels are the row numbers
+# Everything except meta.json is memory-mapped read-only, so the worker processes of a server share the same pages.
+#
+# The index path keeps several versions of the index and names the one searches use:
+#   CURRENT                       name of the active version, replaced atomically to switch versions
+#   versions/<version>/           one index as described above, versions sort by the time they were written
+#   .update.lock                  locked by the process building or updating the next version, see index_lock
+#   .publish.lock                 locked while a version is added, activated or removed
+# Paths written before index versions existed hold the index files directly and are read as they are.
+FORMAT_VERSION = 1
+META_FILE = "meta.json"
+VECTORS_FILE = "vectors.f32"
+COMPANY_IDS_FILE = "company_ids.i64"
+FAISS_FILE = "index.faiss"
+STRING_COLUMNS = ("title", "content")
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+UPDATE_LOCK_FILE = ".update.lock"
+PUBLISH_LOCK_FILE = ".publish.lock"
+ADD_CHUNK_SIZE = 10000  # Vectors added to the FAISS index at a time.
+# Versions kept on disk for rollbacks, the active one included. The newest full build up to the active version is
+# kept as well, however many company updates were published after it.
+KEEP_VERSIONS = max(int(getenv('SEMANTIC_SEARCH_INDEX_KEEP_VERSIONS', 3)), 1)
+# A new version must find the company of each of these rows in the top SMOKE_TOP_K results of the row's vector.
+SMOKE_QUERIES = 8
+SMOKE_TOP_K = 10
+# Filtered searches allowing at most this many rows score them all exactly instead of searching the FAISS index.
+FILTER_EXACT_ROWS = int(getenv('SEMANTIC_SEARCH_FILTER_EXACT_ROWS', 20000))
+
+
+def _memmap(path, dtype, shape):
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)  # Empty files can not be memory-mapped.
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class IndexValidationError(ValueError):
+    pass
+
+
+class IndexVersionConflict(IndexValidationError):
+    # Another version was activated after the writer read the one it was based on.
+    pass
+
+
+@contextmanager
+def index_lock(path, name=UPDATE_LOCK_FILE):
+    '''
+        Holds an exclusive lock on the file `name` of the index at `path` until the block exits. The lock is taken on
+        a new open file each time, so it excludes other threads of the process as well as other processes.
+    '''
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, name), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def current_version(path):
+    # Name of the active version of the index at `path`, None for unversioned paths.
+    try:
+        with open(os.path.join(path, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_path(path, version):
+    return os.path.join(path, VERSIONS_DIR, version)
+
+
+def resolve_index_path(path):
+    # Directory holding the files of the active index.
+    version = current_version(path)
+    return version_path(path, version) if version else path
+
+
+def list_versions(path):
+    # Complete versions of the index at `path`, oldest first.
+    try:
+        names = os.listdir(os.path.join(path, VERSIONS_DIR))
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names
+                  if not name.startswith(".") and os.path.exists(os.path.join(version_path(path, name), META_FILE)))
+
+
+def is_build_version(path, version):
+    # False for the versions written by company updates, see VectorIndexWriter.finish.
+    with open(os.path.join(version_path(path, version), META_FILE)) as f:
+        return not json.load(f).get("update", False)
+
+
+def last_build_version(path, before=None):
+    # Newest full build of the index at `path`, among the versions up to `before` when given. None when there is none.
+    builds = [version for version in list_versions(path)
+              if (before is None or version <= before) and is_build_version(path, version)]
+    return builds[-1] if builds else None
+
+
+def active_row_count(path):
+    # Rows of the active index at `path`, 0 when there is none.
+    try:
+        with open(os.path.join(resolve_index_path(path), META_FILE)) as f:
+            return json.load(f)["count"]
+    except FileNotFoundError:
+        return 0
+
+
+def activate_version(path, version):
+    '''
+        Points the index at `path` to one of its versions with an atomic rename. Running search engines switch to it
+        on their next search.
+    '''
+    with index_lock(path, PUBLISH_LOCK_FILE):
+        _activate_version(path, version)
+
+
+def _activate_version(path, version):
+    # The caller holds the publish lock.
+    if version not in list_versions(path):
+        raise ValueError(f"No index version '{version}' in {path}.")
+    tmp_file = os.path.join(path, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(tmp_file, "w") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, os.path.join(path, CURRENT_FILE))
+    logger.info("Search index version %s activated in %s", version, path)
+
+
+def rollback_version(path, to_build=False):
+    '''
+        Activates the newest version older than the active one and returns its name. With `to_build`, the newest
+        full build older than it, skipping the versions written by company updates.
+    '''
+    with index_lock(path, PUBLISH_LOCK_FILE):
+        current = current_version(path)
+        older = [version for version in list_versions(path) if current is None or version < current]
+        if to_build:
+            older = [version for version in older if is_build_version(path, version)]
+        if not older:
+            raise ValueError(f"No older index {'build' if to_build else 'version'} to roll back to in {path}.")
+        _activate_version(path, older[-1])
+    return older[-1]
+
+
+def prune_versions(path, keep=None):
+    # Keeps the newest `keep` (default KEEP_VERSIONS) versions, the active one and the full build it comes from.
+    # Open memory maps of a removed version stay valid.
+    with index_lock(path, PUBLISH_LOCK_FILE):
+        _prune_versions(path, keep)
+
+
+def _prune_versions(path, keep=None):
+    # The caller holds the publish lock.
+    keep = keep or KEEP_VERSIONS
+    current = current_version(path)
+    build = last_build_version(path, current)
+    inactive = [version for version in list_versions(path) if version not in (current, build)]
+    for version in inactive[:max(len(inactive) - (keep - 1), 0)]:
+        shutil.rmtree(version_path(path, version), ignore_errors=True)
+
+
+def validate_index(path, expected_count=None, min_count=0):
+    '''
+        Checks the index files in `path` before they are activated: they load, hold `expected_count` rows and at
+        least `min_count`, and the vectors of a few rows find their own company. Raises IndexValidationError.
+    '''
+    try:
+        index = CompanyVectorIndex(path)
+    except (OSError, ValueError, RuntimeError) as e:
+        raise IndexValidationError(f"The index in {path} can not be loaded: {e}") from e
+    if expected_count is not None and len(index) != expected_count:
+        raise IndexValidationError(f"The index in {path} has {len(index)} rows, {expected_count} were written.")
+    if len(index) < min_count:
+        raise IndexValidationError(f"The index in {path} has {len(index)} rows, at least {min_count} are expected.")
+
+    rows = np.unique(np.linspace(0, len(index) - 1, min(len(index), SMOKE_QUERIES)).astype(np.int64))
+    results = index.search_batch(np.asarray(index.vectors[rows]), SMOKE_TOP_K) if len(rows) else []
+    for row, hits in zip(rows, results):
+        if index.company_id(row) not in {index.company_id(hit) for hit, _ in hits}:
+            raise IndexValidationError(f"The smoke query of row {row} in {path} does not find its company.")
+    return index
+
+
+class StringColumn:
+    def __init__(self, directory, name, count):
+        self.offsets = _memmap(os.path.join(directory, f"{name}.off"), np.int64, (count + 1,))
+        data_path = os.path.join(directory, f"{name}.bin")
+        size = os.path.getsize(data_path)
+        self.data = np.memmap(data_path, dtype=np.uint8, mode='r') if size else np.zeros(0, dtype=np.uint8)
+
+    def __getitem__(self, row):
+        return self.data[self.offsets[row]:self.offsets[row + 1]].tobytes().decode('utf-8')
+
+
+class CompanyVectorIndex:
+    '''
+        Read-only search index that answers queries without the database: it returns row numbers with their
+        score, and each row knows its company id, title and text.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported search index format in {path}, rebuild the index.")
+
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+        self.index_type = self.meta["index_type"]
+        self.version = self.meta.get("version")
+        self.company_count = self.meta.get("companies", self.count)  # Less than count when companies have chunks.
+        self.vectors = _memmap(os.path.join(path, VECTORS_FILE), np.float32, (self.count, self.dim))
+        self.company_ids = _memmap(os.path.join(path, COMPANY_IDS_FILE), np.int64, (self.count,))
+        self.titles = StringColumn(path, "title", self.count)
+        self.contents = StringColumn(path, "content", self.count)
+
+        faiss_path = os.path.join(path, FAISS_FILE)
+        try:
+            self.faiss_index = faiss.read_index(faiss_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            # Not every index type can be memory-mapped.
+            self.faiss_index = faiss.read_index(faiss_path)
+        set_search_parameters(self.faiss_index)
+
+        from api.semantic_search.facet_index import FacetIndex
+        from api.semantic_search.interest_index import InterestIndex
+        from api.semantic_search.keyword_index import KeywordIndex
+        from api.semantic_search.neighbour_index import NeighbourIndex
+        self.keywords = KeywordIndex.load(path)
+        self.facets = FacetIndex.load(path)
+        self.neighbours = NeighbourIndex.load(path)
+        self.interests = InterestIndex.load(path)
+        self._company_rows = None
+
+    @classmethod
+    def load(cls, path):
+        # Loads the active version of the index at `path`.
+        return cls(resolve_index_path(path))
+
+    @staticmethod
+    def signature(path):
+        # Changes every time a version of the index at `path` is activated, None when there is no index.
+        for name in (CURRENT_FILE, META_FILE):
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except FileNotFoundError:
+                continue
+            return (stat.st_mtime_ns, stat.st_ino)
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def search(self, embedding, top_k):
+        # Returns [(row, score)] best first.
+        return self.search_batch([embedding], top_k)[0]
+
+    def search_batch(self, embeddings, top_k, allowed=None):
+        '''
+            One FAISS search for every query, returns a [(row, score)] list per query.
+            `allowed` is a boolean mask of the rows that may be returned, see FacetIndex.mask.
+        '''
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if self.count == 0:
+            return [[] for _ in queries]
+        if allowed is None:
+            scores, rows = self.faiss_index.search(queries, top_k)
+        else:
+            allowed_rows = np.flatnonzero(allowed)
+            if len(allowed_rows) <= FILTER_EXACT_ROWS:
+                return self._exact_search(queries, top_k, allowed_rows)
+            bitmap = np.packbits(allowed, bitorder='little')  # Must outlive the search.
+            selector = faiss.IDSelectorBitmap(self.count, faiss.swig_ptr(bitmap))
+            params = filtered_search_parameters(self.faiss_index, selector, len(allowed_rows) / self.count)
+            scores, rows = self.faiss_index.search(queries, top_k, params=params)
+        return [[(int(row), float(score)) for row, score in zip(query_rows, query_scores) if row != -1]
+                for query_rows, query_scores in zip(rows, scores)]
+
+    def _exact_search(self, queries, top_k, rows):
+        # Inner products with the stored vectors of `rows` only.
+        if len(rows) == 0:
+            return [[] for _ in queries]
+        scores = queries @ np.asarray(self.vectors[rows]).T
+        results = []
+        for query_scores in scores:
+            best = np.argsort(-query_scores, kind="stable")[:top_k]
+            results.append([(int(rows[i]), float(query_scores[i])) for i in best])
+        return results
+
+    def company_id(self, row):
+        return int(self.company_ids[row])
+
+    def company_row(self, company_id):
+        # First row of a company, None when it is not indexed.
+        if self._company_rows is None:
+            company_ids, rows = np.unique(self.company_ids, return_index=True)
+            self._company_rows = dict(zip(company_ids.tolist(), rows.tolist()))
+        return self._company_rows.get(company_id)
+
+    def title(self, row):
+        return self.titles[row]
+
+    def content(self, row):
+        return self.contents[row]
+
+    def read_faiss_index(self):
+        # A writable copy of the FAISS index, to update it into a new version.
+        faiss_index = faiss.read_index(os.path.join(self.path, FAISS_FILE))
+        set_search_parameters(faiss_index)
+        return faiss_index
+
+    def iter_rows(self, batch_size=ADD_CHUNK_SIZE):
+        # Yields (company_ids, titles, contents, vectors) for consecutive rows, for rewriting the index.
+        for start in range(0, self.count, batch_size):
+            rows = range(start, min(start + batch_size, self.count))
+            yield (np.array(self.company_ids[start:rows.stop]), [self.titles[row] for row in rows],
+                   [self.contents[row] for row in rows], np.array(self.vectors[start:rows.stop]))
+
+
+class VectorIndexWriter:
+    '''
+        Writes a new version of the index at `path` one batch of rows at a time. finish() validates it, then makes
+        it the active version. Use as a context manager, the active version stays in place if the block raises,
+        finish() is not called or the validation fails.
+        The new version replaces `base_version`, the version its rows were read from, by default the one active when
+        the writer was created. finish() raises IndexVersionConflict when another one was activated in between, take
+        the update lock (see index_lock) to write versions one after the other.
+    '''
+
+    def __init__(self, path, dim, base_version=None):
+        self.path = path
+        self.dim = dim
+        self.count = 0
+        self.version = None
+        self.base_version = base_version or current_version(path)
+        os.makedirs(os.path.join(path, VERSIONS_DIR), exist_ok=True)
+        # A directory of its own for each writer, readable by the server processes like the other versions.
+        self.tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.join(path, VERSIONS_DIR))
+        os.chmod(self.tmp_path, 0o755)
+
+        self._vectors = open(os.path.join(self.tmp_path, VECTORS_FILE), "wb")
+        self._company_ids = open(os.path.join(self.tmp_path, COMPANY_IDS_FILE), "wb")
+        self._strings = {}
+        for name in STRING_COLUMNS:
+            data = open(os.path.join(self.tmp_path, f"{name}.bin"), "wb")
+            offsets = open(os.path.join(self.tmp_path, f"{name}.off"), "wb")
+            offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+            self._strings[name] = [data, offsets, 0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self._close_files()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def _close_files(self):
+        files = [self._vectors, self._company_ids]
+        for data, offsets, _ in self._strings.values():
+            files += [data, offsets]
+        for f in files:
+            f.close()
+
+    def add(self, company_ids, titles, contents, embeddings):
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if not len(vectors) == len(company_ids) == len(titles) == len(contents):
+            raise ValueError("Every row needs a company id, a title, a content and an embedding.")
+        self._vectors.write(vectors.tobytes())
+        self._company_ids.write(np.asarray(company_ids, dtype=np.int64).tobytes())
+        for name, values in zip(STRING_COLUMNS, (titles, contents)):
+            column = self._strings[name]
+            encoded = [value.encode('utf-8') for value in values]
+            column[0].write(b"".join(encoded))
+            ends = column[2] + np.cumsum([len(value) for value in encoded], dtype=np.int64)
+            column[1].write(ends.tobytes())
+            if len(ends):
+                column[2] = int(ends[-1])
+        self.count += len(vectors)
+
+    def add_documents(self, documents, embeddings):
+        # Haystack documents as built by create_company_document.
+        self.add([int(document.meta["company_id"]) for document in documents],
+                 [document.meta["title"] for document in documents],
+                 [document.content for document in documents], embeddings)
+
+    def finish(self, index_type=INDEX_TYPE, keywords=None, facets=None, interests=None, min_count=0, faiss_index=None,
+               neighbours=None, changed_ids=(), update=False):
+        # `faiss_index` already holds the vectors of every row, labelled by row number, see replace_vectors.
+        # A new one of `index_type` is built otherwise.
+        # `keywords` is a KeywordIndexWriter written with the rows, indexes without one are searched by vector only.
+        # `facets` is a FacetIndexWriter, indexes without one can not filter searches.
+        # `interests` is an InterestIndexWriter, feeds leave out the interests missing from the index.
+        # The new version is not activated when it has fewer than `min_count` rows.
+        # The most similar companies of each company are precomputed, see neighbour_index.py. Given the
+        # `neighbours` of the previous version, only the ones affected by the `changed_ids` companies are searched.
+        # `update` marks a version written by company updates, the full build before it is kept for rollbacks.
+        from api.semantic_search.neighbour_index import NEIGHBOURS_TOP_N, write_neighbours
+
+        self._close_files()
+        vectors = _memmap(os.path.join(self.tmp_path, VECTORS_FILE), np.float32, (self.count, self.dim))
+        company_ids = _memmap(os.path.join(self.tmp_path, COMPANY_IDS_FILE), np.int64, (self.count,))
+
+        if faiss_index is None:
+            faiss_index = create_faiss_index(index_type, self.dim, self.count)
+            if not faiss_index.is_trained:
+                sample = np.random.default_rng(0).permutation(self.count)[:IVF_TRAINING_SAMPLE]
+                faiss_index.train(np.ascontiguousarray(vectors[np.sort(sample)]))
+            for start in range(0, self.count, ADD_CHUNK_SIZE):
+                faiss_index.add(np.ascontiguousarray(vectors[start:start + ADD_CHUNK_SIZE]))
+        elif faiss_index.ntotal != self.count:
+            raise IndexValidationError(
+                f"The FAISS index holds {faiss_index.ntotal} vectors, {self.count} rows were written.")
+        faiss.write_index(faiss_index, os.path.join(self.tmp_path, FAISS_FILE))
+
+        if keywords is not None:
+            keywords.write(self.tmp_path)
+        if facets is not None:
+            facets.write(self.tmp_path, company_ids)
+        set_search_parameters(faiss_index)
+        if NEIGHBOURS_TOP_N:
+            write_neighbours(self.tmp_path, faiss_index, vectors, company_ids, previous=neighbours,
+                             changed_ids=changed_ids)
+        if interests is not None:
+            interests.write(self.tmp_path, faiss_index, company_ids)
+
+        version = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        built_as = "Flat" if isinstance(faiss_index, faiss.IndexFlat) else index_type
+        with open(os.path.join(self.tmp_path, META_FILE), "w") as f:
+            json.dump({"format_version": FORMAT_VERSION, "count": self.count, "dim": self.dim,
+                       "companies": len(np.unique(company_ids)),
+                       "index_type": built_as, "created_at": time.time(), "version": version, "update": update}, f)
+        self._publish(version, min_count)
+        logger.info("Search index version %s with %s rows written to %s", version, self.count, self.path)
+
+    def _publish(self, version, min_count):
+        # Under the publish lock, so no other writer activates a version or prunes this one in between.
+        path = version_path(self.path, version)
+        with index_lock(self.path, PUBLISH_LOCK_FILE):
+            os.rename(self.tmp_path, path)
+            try:
+                validate_index(path, self.count, min_count)
+                if current_version(self.path) != self.base_version:
+                    raise IndexVersionConflict(f"Version {current_version(self.path)} of {self.path} was activated "
+                                               f"after this writer started from {self.base_version}.")
+            except IndexValidationError:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+            _activate_version(self.path, version)
+            _prune_versions(self.path)
+        self.version = version
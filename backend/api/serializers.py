@@ -77,7 +77,38 @@ class FinanceStageSerializer(serializers.ModelSerializer):
         model = FinanceStage
         fields = ['id', 'stage_name']
 
-class CompanySerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    '''
+        On GET requests, returns only the fields listed in the `fields` query parameter and drops those listed in
+        `omit` (both comma-separated). `id` is always returned. Unknown field names are a validation error.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is not None and request.method == 'GET':
+            selected = self.selected_fields(request.query_params)
+            for name in set(self.fields) - set(selected):
+                self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, query_params):
+        names = list(cls.Meta.fields)
+        fields = [name for name in query_params.get('fields', '').split(',') if name]
+        omit = [name for name in query_params.get('omit', '').split(',') if name]
+        unknown = set(fields + omit) - set(names)
+        if unknown:
+            raise serializers.ValidationError({'fields': [f"Unknown fields: {', '.join(sorted(unknown))}. "
+                                                          f"Options: {', '.join(names)}"]})
+        return [name for name in names if name == 'id' or ((not fields or name in fields) and name not in omit)]
+
+
+# Columns read for the company relations rendered as slugs, and the relations prefetched as lists of slugs.
+COMPANY_RELATION_COLUMNS = {'hq_main_office': 'hq_main_office__hq_name', 'finance_stage': 'finance_stage__stage_name'}
+COMPANY_MANY_TO_MANY = ('tech_sector', 'vertex_entity')
+
+
+class CompanySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     tech_sector = serializers.SlugRelatedField(
         slug_field='sector_name',
         queryset=TechSector.objects.all(),
@@ -93,11 +124,8 @@ class CompanySerializer(serializers.ModelSerializer):
     finance_stage = serializers.SlugRelatedField(slug_field='stage_name', queryset=FinanceStage.objects.all())
 
     def validate_company(self, value):
-        # If creating a new company, ensure the name is unique
-        if not self.instance and Company.objects.filter(company__iexact=value).exists():
-            raise serializers.ValidationError("A company with this name already exists.")
-        # If updating an existing company, ensure the new name is unique
-        elif self.instance and Company.objects.filter(company__iexact=value).exclude(pk=self.instance.pk).exists():
+        # Ensure the name is unique, ignoring the company being updated
+        if Company.name_exists(value, exclude_pk=self.instance.pk if self.instance else None):
             raise serializers.ValidationError("A company with this name already exists.")
         return value
 
@@ -107,6 +135,20 @@ class CompanySerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("This field is required.")
         return value
 
+    @classmethod
+    def eager_load(cls, queryset, fields=None):
+        '''
+            Loads the relations rendered above with the companies, so a page costs the same queries for any page size.
+            With `fields` (names of this serializer's fields), only their columns and relations are loaded.
+        '''
+        if fields is None:
+            fields = cls.Meta.fields
+        relations = [name for name in fields if name in COMPANY_RELATION_COLUMNS]
+        columns = [name for name in fields if name not in COMPANY_MANY_TO_MANY]
+        columns += [COMPANY_RELATION_COLUMNS[name] for name in relations]
+        return (queryset.only(*columns).select_related(*relations)
+                .prefetch_related(*[name for name in fields if name in COMPANY_MANY_TO_MANY]))
+
     class Meta:
         model = Company
         fields = ['id', 'company', 'description', 'tech_sector', 'hq_main_office',
@@ -115,10 +157,20 @@ class CompanySerializer(serializers.ModelSerializer):
                   'facebook_url', 'twitter_url', 'linkedin_url', 'instagram_url']
 
 
+class CompanyCardSerializer(CompanySerializer):
+    # Compact company for the directory cards, without the long texts of the profile page.
+    class Meta(CompanySerializer.Meta):
+        fields = ['id', 'company', 'description', 'tech_sector', 'hq_main_office', 'finance_stage', 'status']
+
+
 class CompanySerializerForModelTraining(serializers.ModelSerializer):
     # This will return the names of the tech sectors instead of their IDs.
     tech_sector = serializers.StringRelatedField(many=True)
 
+    @staticmethod
+    def eager_load(queryset):
+        return queryset.prefetch_related('tech_sector')
+
     class Meta:
         model = Company
-        fields = ('company', 'description', 'tech_sector')
+        fields = ('id', 'company', 'description', 'tech_sector')
@@ -0,0 +1,66 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from .models import Company, TechSector
+from .pagination import company_count_cache
+from .semantic_search.index_updates import AUTO_INDEX, index_update_queue
+
+# Keep the semantic search index in sync with company edits (admin, API and imports).
+# Updates are queued only once the transaction commits, so rolled back edits never reach the index.
+
+
+def queue_upserts(company_ids):
+    if AUTO_INDEX:
+        for company_id in company_ids:
+            transaction.on_commit(partial(index_update_queue.enqueue_upsert, company_id))
+
+
+def queue_delete(company_id):
+    if AUTO_INDEX:
+        transaction.on_commit(partial(index_update_queue.enqueue_delete, company_id))
+
+
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, raw=False, **kwargs):
+    company_count_cache.clear()
+    if not raw:
+        queue_upserts([instance.pk])
+
+
+@receiver(post_delete, sender=Company)
+def company_deleted(sender, instance, **kwargs):
+    company_count_cache.clear()
+    queue_delete(instance.pk)
+
+
+@receiver(m2m_changed, sender=Company.vertex_entity.through)
+def company_entities_changed(sender, action, **kwargs):
+    # The company counts of filtered directory pages change with the companies' entities and sectors.
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        company_count_cache.clear()
+
+
+@receiver(m2m_changed, sender=Company.tech_sector.through)
+def company_tech_sectors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        company_count_cache.clear()
+    if action == 'pre_clear' and reverse:
+        # pk_set is not given for clear, remember the companies of the tech sector before they are removed.
+        instance._cleared_company_ids = list(instance.companies_tech_sector.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        queue_upserts(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        queue_upserts(getattr(instance, '_cleared_company_ids', []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=TechSector)
+def tech_sector_saved(sender, instance, created, raw=False, **kwargs):
+    # The sector name is part of every indexed company document in this sector.
+    if not created and not raw:
+        queue_upserts(instance.companies_tech_sector.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=TechSector)
+def tech_sector_deleted(sender, instance, **kwargs):
+    queue_upserts(list(instance.companies_tech_sector.values_list('id', flat=True)))
@@ -0,0 +1,70 @@
+import faiss
+import numpy as np
+from django.test import SimpleTestCase
+from api.semantic_search.ann import (compare_index_types, create_faiss_index, get_ivf, reconstruct_all, replace_vectors,
+                                    set_search_parameters)
+
+
+class AnnIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((1000, 16)).astype(np.float32)
+        self.index_params = {"nlist": 8, "pq_m": 4, "pq_nbits": 4}
+
+    def test_create_each_index_type(self):
+        self.assertIsInstance(create_faiss_index("Flat", 16, 1000), faiss.IndexFlatIP)
+        self.assertIsInstance(create_faiss_index("HNSW", 16, 1000), faiss.IndexHNSWFlat)
+        ivfpq = create_faiss_index("IVFPQ", 16, 1000, **self.index_params)
+        self.assertIsNotNone(get_ivf(ivfpq))
+        self.assertFalse(ivfpq.is_trained)
+        with self.assertRaises(ValueError):
+            create_faiss_index("LSH", 16, 1000)
+
+    def test_ivfpq_falls_back_to_flat_for_small_corpus(self):
+        self.assertIsInstance(create_faiss_index("IVFPQ", 16, 10, nlist=8, pq_m=4, pq_nbits=8), faiss.IndexFlatIP)
+
+    def test_set_search_parameters(self):
+        hnsw = create_faiss_index("HNSW", 16, 1000)
+        ivfpq = create_faiss_index("IVFPQ", 16, 1000, **self.index_params)
+        set_search_parameters(hnsw, ef_search=99, nprobe=5)
+        set_search_parameters(ivfpq, ef_search=99, nprobe=5)
+        self.assertEqual(hnsw.hnsw.efSearch, 99)
+        self.assertEqual(get_ivf(ivfpq).nprobe, 5)
+
+    def test_reconstruct_all_from_ivf(self):
+        ivfpq = create_faiss_index("IVFPQ", 16, 1000, **self.index_params)
+        ivfpq.train(self.vectors)
+        ivfpq.add(self.vectors)
+        self.assertEqual(reconstruct_all(ivfpq).shape, (1000, 16))
+
+    def test_replace_vectors_keeps_labels_consecutive(self):
+        flat = create_faiss_index("Flat", 16)
+        flat.add(self.vectors[:10])
+        self.assertTrue(replace_vectors(flat, [1, 5], self.vectors[10:12]))
+        self.assertEqual(flat.ntotal, 10)
+        _, labels = flat.search(self.vectors[[7, 11]], 1)
+        self.assertEqual(labels[:, 0].tolist(), [5, 9])
+
+        ivfpq = create_faiss_index("IVFPQ", 16, 1000, **self.index_params)
+        ivfpq.train(self.vectors)
+        ivfpq.add(self.vectors[:990])
+        self.assertTrue(replace_vectors(ivfpq, [0, 500], self.vectors[990:]))
+        invlists = ivfpq.invlists
+        labels = np.concatenate([faiss.rev_swig_ptr(invlists.get_ids(i), invlists.list_size(i))
+                                 for i in range(ivfpq.nlist) if invlists.list_size(i)])
+        np.testing.assert_array_equal(np.sort(labels), np.arange(998))
+
+        hnsw = create_faiss_index("HNSW", 16)
+        hnsw.add(self.vectors[:10])
+        self.assertFalse(replace_vectors(hnsw, [1], self.vectors[10:11]))
+        self.assertEqual(hnsw.ntotal, 10)
+
+    def test_compare_index_types(self):
+        report = compare_index_types(self.vectors, self.vectors[:50], k=5, **self.index_params)
+        rows = {row["index_type"]: row for row in report}
+
+        self.assertEqual(set(rows), {"Flat", "HNSW", "IVFPQ"})
+        self.assertEqual(rows["Flat"]["recall_at_k"], 1.0)
+        self.assertGreater(rows["HNSW"]["recall_at_k"], 0.8)
+        self.assertEqual(rows["IVFPQ"]["built_as"], "IndexIVFPQ")
+        self.assertTrue(all(row["p95_ms"] >= 0 for row in report))
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+from unittest import mock
+import httpx
+from django.test import SimpleTestCase
+from api.semantic_search import async_search, query_expansion
+from api.semantic_search.async_search import search_companies_async
+from api.semantic_search.cache import LRUCache
+from api.semantic_search.query_expansion import NoOpExpander, RemoteFalconExpander, expand_query_async
+from api.semantic_search.semantic_search import SearchResults
+
+
+class SearchCompaniesAsyncTestCase(SimpleTestCase):
+    def setUp(self):
+        self.search_engine = mock.Mock()
+        self.search_engine.is_loaded.return_value = True
+        self.search_engine.index_version = (1, 1)
+        self.search_engine.result_cache = LRUCache(max_size=10)
+        self.search_engine.keyword_match.return_value = None
+        self.search_threads = []
+
+        def search(query, **kwargs):
+            self.search_threads.append(threading.current_thread().name)
+            return SearchResults([mock.Mock(meta={"title": "Test Company", "company_id": 7})], rerank="reranked")
+
+        self.search_engine.search.side_effect = search
+        self.expand_query_async = mock.AsyncMock(return_value=("generated description", False))
+        patchers = [
+            mock.patch("api.semantic_search.engine.get_search_engine", return_value=self.search_engine),
+            mock.patch("api.semantic_search.query_expansion.expand_query_async", self.expand_query_async),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_search_runs_in_the_inference_executor_and_is_cached(self):
+        self.assertEqual(await search_companies_async("AI Healthcare"), [{"id": 7, "company": "Test Company"}])
+        results = await search_companies_async("ai healthcare")
+        self.assertEqual(results, [{"id": 7, "company": "Test Company"}])
+        self.assertEqual(results.rerank, "reranked")
+
+        self.assertEqual(self.expand_query_async.await_count, 1)
+        self.assertEqual(len(self.search_threads), 1)
+        self.assertTrue(self.search_threads[0].startswith("search-inference"))
+
+    @mock.patch.object(async_search, "MAX_CONCURRENT_SEARCHES", 2)
+    async def test_concurrent_searches_are_limited(self):
+        running = 0
+        most_running = 0
+
+        async def expand(query):
+            nonlocal running, most_running
+            running += 1
+            most_running = max(most_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return query, False
+
+        self.expand_query_async.side_effect = expand
+        async_search._search_slots.clear()
+        await asyncio.gather(*(search_companies_async(f"query {i}") for i in range(6)))
+
+        self.assertEqual(most_running, 2)
+        self.assertEqual(len(self.search_threads), 6)
+
+    def test_each_event_loop_keeps_its_own_slots(self):
+        async def get_slots():
+            return async_search.get_search_slots()
+
+        loops = [asyncio.new_event_loop() for _ in range(2)]
+        for loop in loops:
+            self.addCleanup(loop.close)
+        first_slots = loops[0].run_until_complete(get_slots())
+        self.assertIsNot(loops[1].run_until_complete(get_slots()), first_slots)
+        self.assertIs(loops[0].run_until_complete(get_slots()), first_slots)
+
+
+class ExpandQueryAsyncTestCase(SimpleTestCase):
+    async def test_remote_expansion_uses_the_async_client(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json=[{"generated_text": "Query: ai. company description: AI startups"}])
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with mock.patch.object(query_expansion, "get_async_client", return_value=client):
+            result = await expand_query_async("ai", expander=RemoteFalconExpander(retries=0))
+
+        self.assertEqual(result, ("AI startups", False))
+        self.assertEqual(len(requests), 1)
+
+    async def test_remote_expansion_retries_then_falls_back(self):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+        with mock.patch.object(query_expansion, "get_async_client", return_value=client), \
+                mock.patch.object(query_expansion.asyncio, "sleep", mock.AsyncMock()):
+            result = await expand_query_async("ai", expander=RemoteFalconExpander(retries=1))
+        self.assertEqual(result, ("ai", True))
+
+    async def test_expansion_over_budget_uses_the_raw_query(self):
+        async def slow_expansion(query, deadline=None):
+            await asyncio.sleep(1)
+
+        expander = RemoteFalconExpander()
+        expander.expand_async = slow_expansion
+        self.assertEqual(await expand_query_async("ai", expander=expander, budget=0.01), ("ai", True))
+
+    async def test_local_expander(self):
+        self.assertEqual(await expand_query_async("ai", expander=NoOpExpander()), ("ai", False))
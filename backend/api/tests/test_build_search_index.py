@@ -0,0 +1,96 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+import numpy as np
+from django.core.management import call_command
+from django.test import TestCase
+from haystack.schema import Document
+from api.models import Company, TechSector, MainOffice, FinanceStage
+from api.semantic_search import index_builder
+from api.semantic_search.index_builder import build_search_index, iter_company_documents
+from api.semantic_search.vector_index import CompanyVectorIndex, IndexValidationError
+
+
+class BuildSearchIndexTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tech_sectors = [TechSector.objects.create(sector_name=f"Test Sector {i}") for i in range(2)]
+        hq_main_office = MainOffice.objects.create(hq_name="Test HQ")
+        finance_stage = FinanceStage.objects.create(stage_name="Test Stage")
+        for i in range(5):
+            company = Company.objects.create(company=f"Test Company {i}", description="Test Description",
+                                             hq_main_office=hq_main_office, finance_stage=finance_stage,
+                                             website="https://test.test")
+            company.tech_sector.set(tech_sectors)
+
+    def test_documents_are_streamed_in_batches(self):
+        # One (chunked) query for the companies and one for the tech sectors of each chunk.
+        with self.assertNumQueries(4):
+            batches = list(iter_company_documents(batch_size=2))
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        document = batches[0][0]
+        self.assertEqual(document.meta["title"], "Test Company 0")
+        self.assertEqual(document.meta["sector"], "Test Sector 0, Test Sector 1")
+        self.assertEqual(document.content, "Test Company 0 Test Description Test Sector 0, Test Sector 1")
+
+    @mock.patch.object(index_builder, "create_embedder")
+    @mock.patch.object(index_builder, "get_preprocessor")
+    def test_index_written_batch_by_batch(self, get_preprocessor, retriever_class):
+        get_preprocessor.return_value.process.side_effect = lambda docs: docs
+        embed_documents = retriever_class.return_value.embed_documents
+        embed_documents.side_effect = lambda docs: np.ones((len(docs), 384))
+        progress = []
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_path = os.path.join(temp_dir, "index")
+            company_count = build_search_index(batch_size=2, index_path=index_path, progress=progress.append)
+            index = CompanyVectorIndex.load(index_path)
+
+            self.assertEqual(company_count, 5)
+            self.assertEqual(progress, [2, 4, 5])
+            self.assertEqual(embed_documents.call_count, 3)
+            companies = Company.objects.order_by('id')
+            self.assertEqual([index.company_id(row) for row in range(len(index))], [c.id for c in companies])
+            self.assertEqual(index.title(4), "Test Company 4")
+            self.assertEqual(len(index.keywords), 5)
+
+            # A rebuild that lost most of the companies keeps the active version.
+            Company.objects.exclude(company="Test Company 0").delete()
+            with self.assertRaises(IndexValidationError):
+                build_search_index(index_path=index_path)
+            self.assertEqual(len(CompanyVectorIndex.load(index_path)), 5)
+            self.assertEqual(build_search_index(index_path=index_path, min_rows_ratio=0), 1)
+
+    @mock.patch.object(index_builder, "MAX_COMPANY_CHUNKS", 2)
+    @mock.patch.object(index_builder, "get_preprocessor")
+    def test_chunk_fields_are_indexed_as_chunks(self, get_preprocessor):
+        def split(split_length=512, split_overlap=32):
+            preprocessor = mock.Mock()
+            preprocessor.process.side_effect = lambda docs: [
+                Document(content=" ".join(doc.content.split()[start:start + split_length]), meta=dict(doc.meta))
+                for doc in docs for start in range(0, len(doc.content.split()), split_length)]
+            return preprocessor
+        get_preprocessor.side_effect = split
+        Company.objects.filter(company="Test Company 0").update(products="one two three", founders="Jane Doe")
+
+        with mock.patch.object(index_builder, "CHUNK_WORDS", 2):
+            documents = index_builder.preprocess_company_documents(next(iter_company_documents(batch_size=2)))
+
+        self.assertEqual([(document.meta.get("field"), document.content) for document in documents], [
+            (None, "Test Company 0 Test Description Test Sector 0, Test Sector 1"),
+            (None, "Test Company 1 Test Description Test Sector 0, Test Sector 1"),
+            ("products", "Test Company 0: one two"),
+            ("products", "Test Company 0: three"),
+        ])
+
+    @mock.patch("api.management.commands.build_search_index.build_search_index", return_value=5)
+    def test_command(self, build):
+        stdout = StringIO()
+        call_command("build_search_index", "--batch-size", "2", "--index-type", "HNSW", stdout=stdout)
+
+        self.assertEqual(build.call_args.kwargs["batch_size"], 2)
+        self.assertEqual(build.call_args.kwargs["index_type"], "HNSW")
+        self.assertEqual(build.call_args.kwargs["min_rows_ratio"], index_builder.MIN_ROWS_RATIO)
+        self.assertIn("Search index built with 5 companies.", stdout.getvalue())
@@ -0,0 +1,79 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from api.models import Company, Entity, FinanceStage, MainOffice, TechSector
+from api.pagination import company_count_cache
+
+
+class CompanyFacetTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.software, cls.hardware = [TechSector.objects.create(sector_name=name) for name in ("Software", "Hardware")]
+        cls.fund, cls.growth = [Entity.objects.create(entity_name=name) for name in ("Fund", "Growth")]
+        cls.china, cls.india = [MainOffice.objects.create(hq_name=name) for name in ("China", "India")]
+        cls.seed, cls.series_a = [FinanceStage.objects.create(stage_name=name) for name in ("Seed", "Series A")]
+        # Both is in both sectors and both entities, so a join on either would list it twice.
+        cls.both = cls.create_company("Both", [cls.software, cls.hardware], [cls.fund, cls.growth], cls.china,
+                                      cls.seed, "active")
+        cls.soft = cls.create_company("Soft", [cls.software], [cls.fund], cls.india, cls.series_a, "active")
+        cls.hard = cls.create_company("Hard", [cls.hardware], [cls.growth], cls.india, cls.seed, "pending")
+
+    @classmethod
+    def create_company(cls, name, tech_sectors, entities, office, finance_stage, company_status):
+        company = Company.objects.create(company=name, description="A company", hq_main_office=office,
+                                         finance_stage=finance_stage, status=company_status,
+                                         website="https://test.test")
+        company.tech_sector.set(tech_sectors)
+        company.vertex_entity.set(entities)
+        return company
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('company-list')
+        company_count_cache.clear()
+
+    def get_companies(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [company['company'] for company in response.data['results']]
+
+    def test_many_to_many_filters_list_each_company_once(self):
+        all_companies = ["Both", "Soft", "Hard"]
+        self.assertEqual(self.get_companies(tech_sectors=[self.software.id, self.hardware.id]), all_companies)
+        self.assertEqual(self.get_companies(vertex_entities=[self.fund.id, self.growth.id]), all_companies)
+        self.assertEqual(self.get_companies(vertex_entities=[self.growth.id]), ["Both", "Hard"])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_companies(tech_sectors=[self.software.id, self.hardware.id])
+        self.assertFalse(any("DISTINCT" in query['sql'] for query in queries.captured_queries))
+
+    def test_column_filters(self):
+        self.assertEqual(self.get_companies(finance_stages=[self.seed.id]), ["Both", "Hard"])
+        self.assertEqual(self.get_companies(status=["pending"]), ["Hard"])
+        self.assertEqual(self.get_companies(hq_main_offices=[self.india.id], tech_sectors=[self.software.id]), ["Soft"])
+        self.assertEqual(self.get_companies(status=["active"], finance_stages=[self.series_a.id], company="both"), [])
+
+    def test_invalid_ids(self):
+        response = self.client.get(self.url, {'finance_stages': ['seed']})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('finance_stages', response.data)
+
+    def test_facet_counts_are_returned_with_the_page(self):
+        response = self.client.get(self.url, {'facets': 'true', 'count': 'true', 'hq_main_offices': [self.india.id]})
+        facets = response.data['facets']
+
+        self.assertEqual(response.data['count'], 2)
+        # The counts of a facet ignore its own selection, the other facets apply.
+        self.assertEqual(facets['hq_main_offices'], {self.china.id: 1, self.india.id: 2})
+        self.assertEqual(facets['tech_sectors'], {self.software.id: 1, self.hardware.id: 1})
+        self.assertEqual(facets['vertex_entities'], {self.fund.id: 1, self.growth.id: 1})
+        self.assertEqual(facets['finance_stages'], {self.seed.id: 1, self.series_a.id: 1})
+        self.assertEqual(facets['status'], {"active": 1, "pending": 1})
+
+        self.assertNotIn('facets', self.client.get(self.url).data)
+
+    def test_facet_counts_run_one_query_per_facet(self):
+        with self.assertNumQueries(3 + 5):
+            self.client.get(self.url, {'facets': 'true', 'tech_sectors': [self.software.id]})
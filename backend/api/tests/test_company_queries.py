@@ -0,0 +1,168 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from api.models import Company, Entity, FinanceStage, MainOffice, TechSector
+from api.pagination import COMPANY_MAX_PAGE_SIZE, company_count_cache
+from api.views import get_company_cards
+
+# One query for the companies with their offices and finance stages and one per M2M relation.
+LIST_QUERIES = 3
+RETRIEVE_QUERIES = 3
+
+
+class CompanyFixtures:
+    # Eight companies with one to three sectors, both entities and rotating offices and finance stages.
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech_sectors = [TechSector.objects.create(sector_name=f"Sector {i}") for i in range(3)]
+        cls.entities = [Entity.objects.create(entity_name=f"Entity {i}") for i in range(2)]
+        cls.offices = [MainOffice.objects.create(hq_name=f"Office {i}") for i in range(3)]
+        cls.finance_stages = [FinanceStage.objects.create(stage_name=f"Stage {i}") for i in range(2)]
+        cls.companies = [cls.create_company(i) for i in range(8)]
+
+    @classmethod
+    def create_company(cls, i):
+        company = Company.objects.create(company=f"Company {i}", description="A company",
+                                         hq_main_office=cls.offices[i % 3], finance_stage=cls.finance_stages[i % 2],
+                                         status="active", website="https://test.test")
+        company.tech_sector.set(cls.tech_sectors[:i % 3 + 1])
+        company.vertex_entity.set(cls.entities)
+        return company
+
+    def setUp(self):
+        self.client = APIClient()
+        company_count_cache.clear()
+
+
+class CompanyQueryCountTest(CompanyFixtures, APITestCase):
+    '''
+        The company endpoints must run a fixed number of queries, however many companies a page holds.
+    '''
+
+    def test_list_queries_do_not_grow_with_the_page(self):
+        url = reverse('company-list')
+        with self.assertNumQueries(LIST_QUERIES):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(response.data['results'][2]['tech_sector'], ["Sector 0", "Sector 1", "Sector 2"])
+
+        Company.objects.filter(id__in=[company.id for company in self.companies[1:]]).delete()
+        with self.assertNumQueries(LIST_QUERIES):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_next_pages_cost_the_same_queries(self):
+        response = self.client.get(reverse('company-list'), {'page_size': 3})
+        self.assertNotIn('count', response.data)
+        names = [company['company'] for company in response.data['results']]
+        while response.data['next']:
+            with self.assertNumQueries(LIST_QUERIES):
+                response = self.client.get(response.data['next'])
+            names += [company['company'] for company in response.data['results']]
+        self.assertEqual(names, [f"Company {i}" for i in range(8)])
+
+    def test_page_size_is_capped(self):
+        Company.objects.bulk_create([Company(company=f"Bulk {i}", description="A company",
+                                             hq_main_office=self.offices[0], finance_stage=self.finance_stages[0],
+                                             website="https://test.test") for i in range(COMPANY_MAX_PAGE_SIZE)])
+        response = self.client.get(reverse('company-list'), {'page_size': COMPANY_MAX_PAGE_SIZE * 2})
+        self.assertEqual(len(response.data['results']), COMPANY_MAX_PAGE_SIZE)
+
+    def test_count_is_cached_until_a_company_changes(self):
+        url = reverse('company-list')
+        with self.assertNumQueries(LIST_QUERIES + 1):
+            self.assertEqual(self.client.get(url, {'count': 'true'}).data['count'], 8)
+        with self.assertNumQueries(LIST_QUERIES):
+            self.assertEqual(self.client.get(url, {'count': 'true'}).data['count'], 8)
+        # Another filter is another count.
+        with self.assertNumQueries(LIST_QUERIES + 1):
+            response = self.client.get(url, {'count': 'true', 'tech_sectors': [self.tech_sectors[2].id]})
+        self.assertEqual(response.data['count'], 2)
+
+        self.companies[0].delete()
+        self.assertEqual(self.client.get(url, {'count': 'true'}).data['count'], 7)
+
+    def test_filtered_list_queries(self):
+        with self.assertNumQueries(LIST_QUERIES):
+            response = self.client.get(reverse('company-list'), {
+                'tech_sectors': [self.tech_sectors[2].id], 'hq_main_offices': [self.offices[2].id, self.offices[1].id]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([company['company'] for company in response.data['results']], ["Company 2", "Company 5"])
+
+    def test_retrieve_queries(self):
+        with self.assertNumQueries(RETRIEVE_QUERIES):
+            response = self.client.get(reverse('company-detail', args=[self.companies[4].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['hq_main_office'], "Office 1")
+        self.assertEqual(response.data['finance_stage'], "Stage 0")
+        self.assertEqual(response.data['vertex_entity'], ["Entity 0", "Entity 1"])
+
+    def test_model_training_list_queries(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('company-for-model-training-list'))
+        self.assertEqual(len(response.data), 8)
+
+    def test_search_result_cards_queries(self):
+        company_ids = [company.id for company in reversed(self.companies)]
+        # The companies with their offices and finance stages, and their tech sectors.
+        with CaptureQueriesContext(connection) as queries, self.assertNumQueries(2):
+            cards = get_company_cards(company_ids)
+        self.assertEqual([card['id'] for card in cards], company_ids)
+        self.assertEqual(list(cards[0]),
+                         ['id', 'company', 'description', 'tech_sector', 'hq_main_office', 'finance_stage', 'status'])
+        self.assertNotIn('"api_company"."founders"', " ".join(query['sql'] for query in queries.captured_queries))
+
+
+class CompanySparseFieldsTest(CompanyFixtures, APITestCase):
+    '''
+        fields, omit and view=card return fewer fields and read only their columns and relations.
+    '''
+
+    def get_companies(self, expected_queries, **params):
+        with CaptureQueriesContext(connection) as queries, self.assertNumQueries(expected_queries):
+            response = self.client.get(reverse('company-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results'], " ".join(query['sql'] for query in queries.captured_queries)
+
+    def test_fields(self):
+        companies, sql = self.get_companies(1, fields='company,finance_stage')
+        self.assertEqual(list(companies[0]), ['id', 'company', 'finance_stage'])
+        self.assertEqual(companies[0]['finance_stage'], "Stage 0")
+        self.assertNotIn('"api_company"."description"', sql)
+
+    def test_omit(self):
+        companies, sql = self.get_companies(2, omit='description,tech_sector,products,id')
+        self.assertNotIn('description', companies[0])
+        self.assertNotIn('tech_sector', companies[0])
+        self.assertIn('id', companies[0])
+        self.assertEqual(companies[0]['vertex_entity'], ["Entity 0", "Entity 1"])
+        self.assertNotIn('"api_company"."products"', sql)
+
+    def test_card_view(self):
+        companies, sql = self.get_companies(2, view='card')
+        self.assertEqual(list(companies[0]),
+                         ['id', 'company', 'description', 'tech_sector', 'hq_main_office', 'finance_stage', 'status'])
+        self.assertNotIn('"api_company"."founders"', sql)
+
+        companies, _ = self.get_companies(1, view='card', fields='company')
+        self.assertEqual(list(companies[0]), ['id', 'company'])
+
+    def test_retrieve_fields(self):
+        response = self.client.get(reverse('company-detail', args=[self.companies[0].id]), {'fields': 'website'})
+        self.assertEqual(response.data, {'id': self.companies[0].id, 'website': "https://test.test"})
+
+    def test_unknown_fields(self):
+        for params in ({'fields': 'company,password'}, {'omit': 'secret'}, {'view': 'card', 'fields': 'products'}):
+            response = self.client.get(reverse('company-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('fields', response.data)
+
+    def test_writes_return_every_field(self):
+        company = self.companies[0]
+        response = self.client.patch(f"{reverse('company-detail', args=[company.id])}?fields=company",
+                                     {'status': 'inactive'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('description', response.data)
@@ -0,0 +1,95 @@
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from api.models import Company, FinanceStage, MainOffice, TechSector
+from api.semantic_search import vector_index
+from api.semantic_search.engine import SemanticSearchEngine
+from api.semantic_search.facet_index import FacetIndex, FacetIndexWriter, iter_company_facets, normalize_filters
+from api.semantic_search.keyword_index import KeywordIndexWriter
+from api.semantic_search.rerank import RerankPolicy
+from api.semantic_search.vector_index import CompanyVectorIndex, VectorIndexWriter
+
+# Company id: facets. Company 3 has two rows in the index.
+FACETS = {
+    1: {"tech_sectors": [1, 2], "hq_main_offices": [1], "finance_stages": [1], "status": ["active"]},
+    2: {"tech_sectors": [2], "hq_main_offices": [2], "finance_stages": [1], "status": ["pending"]},
+    3: {"tech_sectors": [3], "hq_main_offices": [1], "finance_stages": [2], "status": ["active"]},
+}
+ROW_COMPANY_IDS = [1, 2, 3, 3]
+
+
+class FacetIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = os.path.join(self.temp_dir.name, "index")
+        self.vectors = np.eye(4, 8, dtype=np.float32)
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add(ROW_COMPANY_IDS, ["Alpha", "Beta", "Gamma", "Gamma"], ["alpha", "beta", "gamma", "gamma 2"],
+                       self.vectors)
+            writer.finish("Flat", keywords=KeywordIndexWriter().add_companies(
+                (company_id, {"company": "robotics", "description": f"company {company_id}"}) for company_id in FACETS),
+                facets=FacetIndexWriter().add_companies(FACETS.items()))
+        self.index = CompanyVectorIndex.load(self.index_path)
+
+    def test_values_of_a_facet_are_or_and_facets_are_and(self):
+        mask = self.index.facets.mask(normalize_filters({"tech_sectors": [2, 3], "hq_main_offices": ["1"]}), 4)
+        self.assertEqual(mask.tolist(), [True, False, True, True])
+        mask = self.index.facets.mask(normalize_filters({"status": "pending"}), 4)
+        self.assertEqual(mask.tolist(), [False, True, False, False])
+
+    def test_unknown_values_and_facets(self):
+        self.assertFalse(self.index.facets.mask(normalize_filters({"finance_stages": [99]}), 4).any())
+        with self.assertRaises(ValueError):
+            normalize_filters({"website": ["x"]})
+        self.assertEqual(normalize_filters({"status": [], "tech_sectors": ["2", 1, ""]}), {"tech_sectors": ("1", "2")})
+
+    def test_index_without_facets(self):
+        self.assertIsNone(FacetIndex.load(self.temp_dir.name))
+
+    def test_filtered_search_returns_the_top_k_of_the_allowed_rows(self):
+        allowed = self.index.facets.mask(normalize_filters({"hq_main_offices": [1]}), 4)
+        expected = [[0, 2], [2, 0]]
+        self.assertEqual([[row for row, _ in hits] for hits in
+                          self.index.search_batch(self.vectors[[0, 2]] + 0.1, 2, allowed)], expected)
+        # Same results through the FAISS index with a row bitmap.
+        with mock.patch.object(vector_index, "FILTER_EXACT_ROWS", 0):
+            self.assertEqual([[row for row, _ in hits] for hits in
+                              self.index.search_batch(self.vectors[[0, 2]] + 0.1, 2, allowed)], expected)
+
+    def test_engine_only_returns_matching_companies(self):
+        with mock.patch("api.semantic_search.engine.create_embedder") as embedder_factory, \
+                mock.patch("api.semantic_search.engine.create_ranker") as ranker_factory:
+            embedder_factory.return_value.embed_queries.side_effect = lambda queries: self.vectors[[1] * len(queries)]
+            ranker_factory.return_value.predict.side_effect = lambda query, documents, top_k: documents[:top_k]
+            search_engine = SemanticSearchEngine(self.index_path)
+            search_engine.rerank_policy = RerankPolicy("fixed")
+
+            results = search_engine.search("beta", 3, 3, keyword_query="robotics", filters={"status": ["active"]})
+            self.assertEqual(sorted(document.meta["company_id"] for document in results), [1, 3])
+            match = search_engine.keyword_match("company 3", 3, filters={"finance_stages": [1]})
+            self.assertIsNone(match)
+
+    def test_filters_need_an_index_with_facets(self):
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add([1], ["Alpha"], ["alpha"], self.vectors[:1])
+            writer.finish("Flat")
+        with self.assertRaises(ValueError):
+            SemanticSearchEngine.allowed(CompanyVectorIndex.load(self.index_path), {"status": ["active"]})
+
+
+class CompanyFacetsTestCase(TestCase):
+    def test_facets_are_read_from_the_database(self):
+        hq_main_office = MainOffice.objects.create(hq_name="Test HQ")
+        finance_stage = FinanceStage.objects.create(stage_name="Test Stage")
+        tech_sector = TechSector.objects.create(sector_name="Test Sector")
+        company = Company.objects.create(company="Test Company", description="Test Description", status="active",
+                                         hq_main_office=hq_main_office, finance_stage=finance_stage,
+                                         website="https://test.test")
+        company.tech_sector.add(tech_sector)
+
+        self.assertEqual(list(iter_company_facets()), [(company.id, {
+            "tech_sectors": [tech_sector.id], "hq_main_offices": [hq_main_office.id],
+            "finance_stages": [finance_stage.id], "status": ["active"]})])
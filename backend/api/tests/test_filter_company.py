@@ -157,7 +157,7 @@ class FilterCompanyTestCase(APITestCase):
     def create_test_function(test_case):
         def test_function(self):
             url = reverse('company-list')
-            response = self.client.get(url)
+            response = self.client.get(url, {'count': 'true'})
             self.assertEqual(response.status_code, test_case["expected_response_status_code"])
             self.assertEqual(response.data['count'], test_case["count"])
 
@@ -0,0 +1,91 @@
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase
+from haystack.schema import Document
+from api.semantic_search import inference
+from api.semantic_search.inference import compare_backends, create_embedder, create_ranker, mean_pool_normalize
+
+
+class FakeEmbedder:
+    def __init__(self, noise=0.0):
+        self.noise = noise
+
+    def embed_queries(self, queries):
+        return np.array([[len(query), 1.0 + self.noise] for query in queries])
+
+
+class FakeRanker:
+    def __init__(self, scores):
+        self.scores = scores
+
+    def predict(self, query, documents, top_k):
+        for document in documents:
+            document.score = self.scores[document.content]
+        return sorted(documents, key=lambda document: document.score, reverse=True)[:top_k]
+
+
+class InferenceBackendTestCase(SimpleTestCase):
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            create_embedder("tensorrt")
+        with self.assertRaises(ValueError):
+            create_ranker("tensorrt")
+
+    @mock.patch.object(inference, "quantize_dynamic")
+    @mock.patch.object(inference, "SentenceTransformersRanker")
+    @mock.patch.object(inference, "EmbeddingRetriever")
+    def test_quantized_backend_quantizes_both_models(self, retriever_class, ranker_class, quantize_dynamic):
+        retriever = create_embedder("quantized")
+        ranker = create_ranker("quantized")
+
+        self.assertEqual(quantize_dynamic.call_count, 2)
+        self.assertIs(retriever.embedding_encoder.embedding_model, quantize_dynamic.return_value)
+        self.assertIs(ranker.transformer_model, quantize_dynamic.return_value)
+        self.assertFalse(retriever_class.call_args.kwargs["use_gpu"])
+
+    @mock.patch.object(inference, "quantize_dynamic")
+    @mock.patch.object(inference, "EmbeddingRetriever")
+    def test_torch_backend_keeps_the_model(self, retriever_class, quantize_dynamic):
+        create_embedder("torch")
+        quantize_dynamic.assert_not_called()
+
+    def test_onnx_backend_without_exported_models(self):
+        with mock.patch.object(inference, "ONNX_MODEL_DIR", "/nonexistent"):
+            with self.assertRaises((ImportError, FileNotFoundError)):
+                create_embedder("onnx")
+
+    def test_mean_pooling_ignores_padding(self):
+        token_embeddings = np.array([[[3.0, 0.0], [1.0, 0.0], [100.0, 100.0]]])
+        embedding = mean_pool_normalize(token_embeddings, np.array([[1, 1, 0]]))
+        np.testing.assert_allclose(embedding, [[1.0, 0.0]])
+
+
+class CompareBackendsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.queries = ["ai", "fintech"]
+        self.candidates = [[Document(content=content) for content in ("a", "b", "c")] for _ in self.queries]
+
+    def test_identical_backends_agree(self):
+        backends = {
+            "torch": (FakeEmbedder(), FakeRanker({"a": 0.9, "b": 0.5, "c": 0.1})),
+            "onnx": (FakeEmbedder(), FakeRanker({"a": 0.9, "b": 0.5, "c": 0.1})),
+        }
+        report = {row["backend"]: row for row in compare_backends(backends, self.queries, self.candidates, top_k=2)}
+
+        self.assertAlmostEqual(report["onnx"]["embedding_cosine_min"], 1.0, places=5)
+        self.assertEqual(report["onnx"]["rerank_top_k_agreement"], 1.0)
+        self.assertEqual(report["onnx"]["rerank_max_score_diff"], 0.0)
+        self.assertGreaterEqual(report["onnx"]["embed_p95_ms"], report["onnx"]["embed_p50_ms"])
+
+    def test_differences_are_reported(self):
+        backends = {
+            "torch": (FakeEmbedder(), FakeRanker({"a": 0.9, "b": 0.5, "c": 0.1})),
+            "quantized": (FakeEmbedder(noise=5.0), FakeRanker({"a": 0.8, "b": 0.1, "c": 0.6})),
+        }
+        report = {row["backend"]: row for row in compare_backends(backends, self.queries, self.candidates, top_k=2)}
+
+        self.assertLess(report["quantized"]["embedding_cosine_min"], 1.0)
+        self.assertEqual(report["quantized"]["rerank_top_k_agreement"], 0.5)
+        self.assertAlmostEqual(report["quantized"]["rerank_max_score_diff"], 0.5)
+        # The candidates of the caller keep their scores.
+        self.assertIsNone(self.candidates[0][0].score)
@@ -0,0 +1,132 @@
+import os
+import tempfile
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase
+from api.semantic_search.engine import SemanticSearchEngine
+from api.semantic_search.keyword_index import KeywordIndex, KeywordIndexWriter, reciprocal_rank_fusion
+from api.semantic_search.rerank import KEYWORD, RerankPolicy
+from api.semantic_search.semantic_search import search_companies
+from api.semantic_search.vector_index import CompanyVectorIndex, VectorIndexWriter
+
+COMPANIES = [
+    (1, {"company": "Acme Robotics", "description": "Warehouse robots for logistics", "products": "PickBot",
+         "founders": "Jane Doe"}),
+    (2, {"company": "MediScan", "description": "AI imaging for hospitals", "products": "ScanCloud",
+         "founders": None}),
+    (3, {"company": "Logistics Cloud", "description": "Logistics software for warehouse teams", "products": None,
+         "founders": "John Roe"}),
+]
+
+
+class KeywordIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        KeywordIndexWriter().add_companies(COMPANIES).write(self.temp_dir.name)
+        self.index = KeywordIndex.load(self.temp_dir.name)
+
+    def test_product_and_founder_names_are_found(self):
+        self.assertEqual(self.index.search("pickbot", top_k=3), [(1, mock.ANY, True)])
+        self.assertEqual([hit[0] for hit in self.index.search("John Roe", top_k=3)], [3])
+
+    def test_company_name_counts_more(self):
+        hits = self.index.search("logistics", top_k=3)
+        self.assertEqual([hit[0] for hit in hits], [3, 1])
+
+    def test_partial_matches_are_flagged(self):
+        hits = self.index.search("warehouse robots hospitals", top_k=3)
+        self.assertEqual([all_terms for _, _, all_terms in hits], [False, False, False])
+        self.assertEqual(hits[0][0], 1)
+
+    def test_top_k_and_unknown_words(self):
+        self.assertEqual(len(self.index.search("logistics warehouse ai", top_k=1)), 1)
+        self.assertEqual(self.index.search("blockchain", top_k=3), [])
+
+    def test_company_and_product_names(self):
+        self.assertEqual(self.index.name_matches("MediScan"), [2])
+        self.assertEqual(self.index.name_matches("scancloud"), [2])
+        self.assertEqual(self.index.name_matches("ScanCloud", company_ids=np.array([1, 3])), [])
+        self.assertEqual(self.index.name_matches("imaging"), [])
+
+    def test_index_without_keywords(self):
+        self.assertIsNone(KeywordIndex.load(os.path.join(self.temp_dir.name, "missing")))
+
+    def test_reciprocal_rank_fusion(self):
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=1)
+        self.assertEqual([item for item, _ in fused], [1, 3, 2])
+        self.assertAlmostEqual(fused[0][1], 1 / 2 + 1 / 3)
+
+
+class HybridSearchTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = os.path.join(self.temp_dir.name, "index")
+        vectors = np.eye(3, 8, dtype=np.float32)
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add([company_id for company_id, _ in COMPANIES], [fields["company"] for _, fields in COMPANIES],
+                       [fields["description"] for _, fields in COMPANIES], vectors)
+            writer.finish("Flat", keywords=KeywordIndexWriter().add_companies(COMPANIES))
+
+        patchers = [mock.patch("api.semantic_search.engine.create_embedder"),
+                    mock.patch("api.semantic_search.engine.create_ranker")]
+        embedder_factory, ranker_factory = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        # Every query is closest to MediScan then Acme Robotics, Logistics Cloud comes from the keyword index.
+        query_vector = vectors[1] + 0.5 * vectors[0]
+        embedder_factory.return_value.embed_queries.side_effect = lambda queries: [query_vector for _ in queries]
+        self.predict = ranker_factory.return_value.predict
+        self.predict.side_effect = lambda query, documents, top_k: documents[:top_k]
+
+        self.search_engine = SemanticSearchEngine(self.index_path)
+        self.search_engine.rerank_policy = RerankPolicy("fixed")
+
+    def test_keywords_are_written_with_the_vectors(self):
+        self.assertEqual(len(CompanyVectorIndex.load(self.index_path).keywords), 3)
+
+    def test_product_and_company_names_are_matched(self):
+        results = self.search_engine.keyword_match("PickBot", top_k=6)
+
+        self.assertEqual([document.meta["company_id"] for document in results], [1])
+        self.assertEqual(results.rerank, KEYWORD)
+        self.assertEqual(results[0].content, "Warehouse robots for logistics")
+        self.assertEqual([document.meta["company_id"] for document in
+                          self.search_engine.keyword_match("  logistics-cloud ", top_k=6)], [3])
+
+    def test_other_keywords_are_not_a_match(self):
+        self.assertIsNone(self.search_engine.keyword_match("logistics warehouse", top_k=6))
+        self.assertIsNone(self.search_engine.keyword_match("quantum computing", top_k=6))
+        # Only MediScan's description has these words, they are still searched and expanded.
+        self.assertIsNone(self.search_engine.keyword_match("hospitals", top_k=6))
+        self.assertIsNone(self.search_engine.keyword_match("imaging", top_k=6))
+
+    def test_name_matches_are_padded_with_the_search_results(self):
+        with mock.patch("api.semantic_search.query_expansion.expand_query") as expand_query:
+            results = search_companies("PickBot", search_engine=self.search_engine, top_k_retrieve=2)
+
+        expand_query.assert_not_called()
+        self.assertEqual([result["id"] for result in results], [1, 2])
+        self.assertEqual(results.rerank, KEYWORD)
+
+    def test_uncommon_description_words_are_expanded_and_searched(self):
+        with mock.patch("api.semantic_search.query_expansion.expand_query",
+                        return_value=("generated description", False)) as expand_query:
+            results = search_companies("hospitals", search_engine=self.search_engine, top_k_retrieve=2)
+
+        expand_query.assert_called_once()
+        self.assertEqual([result["id"] for result in results], [2, 1])
+        self.assertNotEqual(results.rerank, KEYWORD)
+
+    def test_keyword_matches_are_fused_with_dense_results(self):
+        results = self.search_engine.search("generated description", top_k_retrieve=2, top_k_rank=2,
+                                            keyword_query="John Roe")
+
+        candidates = self.predict.call_args.kwargs["documents"]
+        self.assertEqual([document.meta["company_id"] for document in candidates], [2, 3])
+        self.assertEqual([document.meta["company_id"] for document in results], [2, 3])
+
+    def test_dense_only_without_keyword_query(self):
+        results = self.search_engine.search("generated description", top_k_retrieve=1, top_k_rank=1)
+        self.assertEqual([document.meta["company_id"] for document in results], [2])
@@ -1,7 +1,10 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from api.models import Company, TechSector, MainOffice, Entity, FinanceStage
+from api.serializers import CompanySerializer
 
 
 class CompanyQueryViewSetTest(APITestCase):
@@ -86,3 +89,40 @@ class CompanyQueryViewSetTest(APITestCase):
         response = self.client.get(url, {'company': 'Ghost Company'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data.get('results', [])), 0)
+
+    def test_prefix_name_search(self):
+        url = reverse('company-search')
+        response = self.client.get(url, {'q': 'tech'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([company['company'] for company in response.data['results']], ['Tech Innovations'])
+
+        response = self.client.get(url, {'q': 'in', 'mode': 'prefix', 'limit': 1})
+        self.assertEqual([company['company'] for company in response.data['results']], ['Innovative Tech'])
+
+    def test_fuzzy_name_search(self):
+        # A typo in one word of the name still matches, the closest names first.
+        response = self.client.get(reverse('company-search'), {'q': 'inovations', 'mode': 'fuzzy'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(results[0]['company'], 'Tech Innovations')
+        self.assertEqual(results, sorted(results, key=lambda company: -company['score']))
+
+    def test_invalid_name_search(self):
+        url = reverse('company-search')
+        for params in ({}, {'q': 'tech', 'mode': 'regex'}, {'q': 'tech', 'limit': 0}, {'q': 'tech', 'limit': 'all'}):
+            self.assertEqual(self.client.get(url, params).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_names_are_unique_ignoring_case(self):
+        self.assertTrue(Company.name_exists('TECH innovations'))
+        company = Company.objects.get(company='Tech Innovations')
+        self.assertFalse(Company.name_exists('tech innovations', exclude_pk=company.pk))
+
+        serializer = CompanySerializer(data={'company': 'tech INNOVATIONS'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('company', serializer.errors)
+        with self.assertRaises(ValidationError):
+            Company(company='Tech innovations', description='Copy', hq_main_office=company.hq_main_office,
+                    finance_stage=company.finance_stage, website='http://copy.com').save()
+        # Writes that skip Company.save are stopped by the unique index.
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Company.objects.filter(company='Innovative Tech').update(company='TECH INNOVATIONS')
@@ -0,0 +1,85 @@
+import threading
+from unittest import mock
+from django.test import SimpleTestCase
+from api.semantic_search import query_expansion
+from api.semantic_search.query_expansion import (KeywordExpander, NoOpExpander, RemoteFalconExpander,
+                                                 expand_queries, expand_query, get_query_expander)
+
+
+class QueryExpansionTestCase(SimpleTestCase):
+    def test_no_op_expander(self):
+        self.assertEqual(NoOpExpander().expand("AI healthcare"), "AI healthcare")
+
+    def test_keyword_expander_adds_sector_vocabulary(self):
+        description = KeywordExpander().expand("AI company in the healthcare sector")
+        self.assertIn("ai healthcare", description)
+        self.assertIn("artificial intelligence machine learning", description)
+        self.assertNotIn(" the ", description)
+
+    def test_get_query_expander(self):
+        self.assertIsInstance(get_query_expander("keyword"), KeywordExpander)
+        with self.assertRaises(ValueError):
+            get_query_expander("unknown")
+
+    @mock.patch.object(query_expansion.time, "sleep")
+    @mock.patch.object(query_expansion, "prompt_node", side_effect=[TimeoutError(), "generated description"])
+    def test_remote_expander_retries(self, prompt_node, sleep):
+        expander = RemoteFalconExpander(timeout=1, retries=1)
+        self.assertEqual(expander.expand("AI healthcare"), "generated description")
+        self.assertEqual(prompt_node.call_count, 2)
+        self.assertEqual(prompt_node.call_args.kwargs["timeout"], 1)
+
+    @mock.patch.object(query_expansion.time, "sleep")
+    @mock.patch.object(query_expansion, "prompt_node", side_effect=ConnectionError())
+    def test_remote_expander_falls_back_to_query(self, prompt_node, sleep):
+        expander = RemoteFalconExpander(timeout=1, retries=2)
+        self.assertEqual(expand_query("AI healthcare", expander=expander), ("AI healthcare", True))
+        self.assertEqual(prompt_node.call_count, 3)
+
+    @mock.patch.object(query_expansion.time, "sleep")
+    @mock.patch.object(query_expansion, "prompt_node", side_effect=TimeoutError())
+    def test_remote_attempts_fit_in_the_deadline(self, prompt_node, sleep):
+        expander = RemoteFalconExpander(timeout=5, retries=2)
+        self.assertEqual(expander.expand("AI healthcare", query_expansion.time.monotonic() + 1), "AI healthcare")
+        self.assertTrue(all(call.kwargs["timeout"] <= 1 for call in prompt_node.call_args_list))
+
+        # No attempt is started once the deadline has passed, by a search that waited for a worker for example.
+        prompt_node.reset_mock()
+        self.assertEqual(expander.expand("AI healthcare", query_expansion.time.monotonic() - 1), "AI healthcare")
+        prompt_node.assert_not_called()
+
+    def test_expand_query_stays_within_budget(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch.object(query_expansion, "prompt_node", side_effect=lambda *args, **kwargs: release.wait()):
+            result = expand_query("AI healthcare", expander=RemoteFalconExpander(retries=0), budget=0.05)
+        self.assertEqual(result, ("AI healthcare", True))
+
+    def test_expand_query_falls_back_right_away_when_too_many_are_pending(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch.object(query_expansion, "_pending", threading.BoundedSemaphore(1)), \
+                mock.patch.object(query_expansion, "prompt_node",
+                                  side_effect=lambda *args, **kwargs: release.wait()) as prompt_node:
+            expander = RemoteFalconExpander(retries=0)
+            self.assertEqual(expand_query("AI healthcare", expander=expander, budget=0.2), ("AI healthcare", True))
+            # The first expansion still holds its worker.
+            self.assertEqual(expand_query("fintech", expander=expander, budget=5), ("fintech", True))
+        self.assertEqual(prompt_node.call_count, 1)
+
+    def test_local_expander_runs_inline(self):
+        self.assertEqual(expand_query("AI healthcare", expander=NoOpExpander()), ("AI healthcare", False))
+
+    def test_expand_queries_share_one_budget(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def prompt_node(prompt, **kwargs):
+            if "slow" in prompt:
+                release.wait()
+            return "generated description"
+
+        with mock.patch.object(query_expansion, "prompt_node", side_effect=prompt_node):
+            results = expand_queries(["fast query", "slow query"], expander=RemoteFalconExpander(retries=0),
+                                     budget=0.2)
+        self.assertEqual(results, [("generated description", False), ("slow query", True)])
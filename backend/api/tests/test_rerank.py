@@ -0,0 +1,75 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from haystack.schema import Document
+from api.semantic_search import rerank
+from api.semantic_search.rerank import BUDGET, DEEP, DENSE, RERANKED, RerankPolicy
+
+
+def candidates(*scores):
+    return [Document(content=f"company {i}", score=score) for i, score in enumerate(scores)]
+
+
+class ReverseRanker:
+    # Cross-encoder preferring the worst dense candidates, so reranked results are easy to tell apart.
+    def __init__(self):
+        self.pairs = 0
+
+    def predict(self, query, documents, top_k):
+        return self.predict_batch([query], [documents], top_k)[0]
+
+    def predict_batch(self, queries, documents, top_k):
+        results = []
+        for query_documents in documents:
+            self.pairs += len(query_documents)
+            for document in query_documents:
+                document.score = -document.score
+            results.append(sorted(query_documents, key=lambda document: document.score, reverse=True)[:top_k])
+        return results
+
+
+class RerankPolicyTestCase(SimpleTestCase):
+    def setUp(self):
+        self.policy = RerankPolicy("adaptive", skip_margin=0.1, deep_margin=0.01, max_depth=6, budget_ms=0)
+
+    def test_clear_dense_gap_skips_the_cross_encoder(self):
+        self.assertEqual(self.policy.depth([0.9, 0.85, 0.5, 0.45], top_k_retrieve=3, top_k_rank=2), (0, DENSE))
+
+    def test_small_margins_rerank_deeper(self):
+        scores = [0.9, 0.88, 0.86, 0.855, 0.85, 0.84, 0.8]
+        self.assertEqual(self.policy.depth(scores, top_k_retrieve=3, top_k_rank=2), (6, DEEP))
+
+    def test_usual_depth(self):
+        scores = [0.9, 0.88, 0.86, 0.8, 0.7]
+        self.assertEqual(self.policy.depth(scores, top_k_retrieve=3, top_k_rank=2), (3, RERANKED))
+
+    def test_fixed_policy_always_reranks_the_usual_depth(self):
+        policy = RerankPolicy("fixed")
+        self.assertEqual(policy.depth([0.9, 0.1, 0.05], top_k_retrieve=2, top_k_rank=1), (2, RERANKED))
+        self.assertEqual(policy.retrieve_depth(12), 12)
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            RerankPolicy("sometimes")
+
+    def test_rerank_reports_each_query_path(self):
+        ranker = ReverseRanker()
+        results = self.policy.rerank(ranker, ["easy", "usual"], [candidates(0.9, 0.85, 0.5, 0.45),
+                                                                  candidates(0.9, 0.88, 0.86, 0.8, 0.7)],
+                                     top_k_retrieve=3, top_k_rank=2)
+
+        (easy, easy_path), (usual, usual_path) = results
+        self.assertEqual((easy_path, usual_path), (DENSE, RERANKED))
+        self.assertEqual([document.content for document in easy], ["company 0", "company 1"])
+        self.assertEqual([document.content for document in usual], ["company 2", "company 1"])
+        self.assertEqual(ranker.pairs, 3)
+
+    def test_budget_keeps_dense_order_for_the_rest(self):
+        policy = RerankPolicy("fixed", budget_ms=5)
+        ranker = ReverseRanker()
+        with mock.patch.object(rerank.time, "perf_counter", side_effect=[0, 1]):
+            [(documents, path)] = policy.rerank(ranker, ["query"], [candidates(0.9, 0.8, 0.7, 0.6)],
+                                                top_k_retrieve=4, top_k_rank=3)
+
+        self.assertEqual(path, BUDGET)
+        self.assertEqual(ranker.pairs, 3)
+        self.assertEqual([document.content for document in documents], ["company 2", "company 1", "company 0"])
@@ -0,0 +1,95 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+from api.semantic_search.benchmark import (compare_reports, labelled_queries, ndcg_at_k, recall_at_k,
+                                           reciprocal_rank, run_benchmark, synthetic_companies)
+
+
+class RelevanceMetricsTestCase(SimpleTestCase):
+    def test_recall_counts_the_highly_relevant_companies_that_fit_in_k(self):
+        relevance = {1: 2, 2: 2, 3: 2, 4: 1}
+        self.assertEqual(recall_at_k([1, 4, 2], relevance, k=2), 0.5)
+        self.assertEqual(recall_at_k([1, 2, 9], relevance, k=2), 1.0)
+
+    def test_ndcg_is_one_for_the_ideal_order(self):
+        relevance = {1: 2, 2: 1}
+        self.assertAlmostEqual(ndcg_at_k([1, 2, 3], relevance, k=3), 1.0)
+        self.assertLess(ndcg_at_k([2, 1, 3], relevance, k=3), 1.0)
+        self.assertEqual(ndcg_at_k([3, 4], relevance, k=2), 0.0)
+
+    def test_reciprocal_rank_of_the_first_relevant_company(self):
+        self.assertEqual(reciprocal_rank([5, 6, 1], {1: 1}), 1 / 3)
+        self.assertEqual(reciprocal_rank([5, 6], {1: 1}), 0.0)
+
+
+class SyntheticCorpusTestCase(SimpleTestCase):
+    def test_corpus_and_labels_are_deterministic(self):
+        self.assertEqual(synthetic_companies(40, seed=1), synthetic_companies(40, seed=1))
+        companies = synthetic_companies(40)
+        queries = labelled_queries(companies)
+        self.assertEqual(len({company["company"] for company in companies}), 40)
+        self.assertTrue(all(relevance for query, relevance in queries))
+
+
+class SearchBenchmarkTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def run_small_benchmark(self, **kwargs):
+        return run_benchmark(self.temp_dir.name, ["Flat"], ["fixed"], [8], ["off", "stub"], [False, True],
+                             companies=48, repeat=2, **kwargs)
+
+    def test_every_configuration_is_reported_with_quality_and_latency(self):
+        report = self.run_small_benchmark()
+
+        self.assertEqual(len(report["results"]), 4)
+        self.assertEqual(report["indexes"]["Flat"]["built_as"], "Flat")
+        for result in report["results"]:
+            for metric in ("recall", "ndcg", "mrr"):
+                self.assertGreaterEqual(result[metric], 0.0)
+                self.assertLessEqual(result[metric], 1.0)
+            self.assertLessEqual(result["p50_ms"], result["p99_ms"])
+            self.assertGreater(result["qps"], 0)
+            self.assertIn("total", result["stages_ms"])
+        # The stub models find companies by their words, so the labelled queries get relevant results.
+        self.assertGreater(max(result["ndcg"] for result in report["results"]), 0.3)
+        json.dumps(report)
+
+    def test_compare_reports_flags_quality_and_latency_regressions(self):
+        baseline = {"results": [{"name": "a", "recall": 0.8, "ndcg": 0.7, "mrr": 0.9, "p95_ms": 10.0}]}
+        same = {"results": [{"name": "a", "recall": 0.79, "ndcg": 0.7, "mrr": 0.9, "p95_ms": 12.0},
+                            {"name": "new", "recall": 0.0, "ndcg": 0.0, "mrr": 0.0, "p95_ms": 99.0}]}
+        worse = {"results": [{"name": "a", "recall": 0.6, "ndcg": 0.7, "mrr": 0.9, "p95_ms": 30.0}]}
+
+        self.assertEqual(compare_reports(same, baseline), [])
+        regressions = compare_reports(worse, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertEqual(compare_reports(worse, baseline, max_latency_ratio=0), regressions[:1])
+
+    def test_command_writes_the_report_and_checks_the_baseline(self):
+        report_path = os.path.join(self.temp_dir.name, "report.json")
+        arguments = ["--index-types", "Flat", "--rerank-depths", "8", "--expansions", "off", "--caches", "off",
+                     "--companies", "48", "--repeat", "1", "--max-latency-ratio", "0"]
+        call_command("search_benchmark", *arguments, "--json", report_path, stdout=StringIO())
+        with open(report_path) as f:
+            report = json.load(f)
+        self.assertEqual(report["results"][0]["name"], "Flat/adaptive@8/expansion=off/cache=off")
+
+        out = StringIO()
+        call_command("search_benchmark", *arguments, "--baseline", report_path, stdout=out)
+        self.assertIn("No regressions", out.getvalue())
+
+        report["results"][0]["ndcg"] = 2.0
+        with open(report_path, "w") as f:
+            json.dump(report, f)
+        with self.assertRaises(CommandError):
+            call_command("search_benchmark", *arguments, "--baseline", report_path, stdout=StringIO())
+
+    def test_command_rejects_a_rerank_depth_below_the_number_of_results(self):
+        with self.assertRaises(CommandError):
+            call_command("search_benchmark", "--rerank-depths", "1", stdout=StringIO())
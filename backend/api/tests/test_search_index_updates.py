@@ -0,0 +1,100 @@
+import threading
+from unittest import mock
+from django.test import SimpleTestCase, TestCase
+from api.models import Company, TechSector, MainOffice, FinanceStage
+from api.semantic_search.index_updates import IndexUpdateQueue, UPSERT, DELETE, index_update_queue
+
+
+class IndexUpdateQueueTestCase(SimpleTestCase):
+    def test_drain_applies_batches_latest_action_wins(self):
+        batches = []
+        queue = IndexUpdateQueue(batch_size=2, delay=0, apply=batches.append)
+        with mock.patch("threading.Thread"):
+            queue.enqueue_upsert(1)
+            queue.enqueue_upsert(2)
+            queue.enqueue_upsert(1)
+            queue.enqueue_delete(3)
+            queue.enqueue_delete(2)
+        queue.drain()
+
+        self.assertEqual(batches, [{1: UPSERT, 2: DELETE}, {3: DELETE}])
+        self.assertEqual(queue.pending(), {})
+
+    def test_interest_refresh_applies_a_batch_without_companies(self):
+        batches = []
+        queue = IndexUpdateQueue(batch_size=2, delay=0, apply=batches.append)
+        with mock.patch("threading.Thread"):
+            queue.enqueue_interests()
+            queue.enqueue_interests()
+        queue.drain()
+        self.assertEqual(batches, [{}])
+
+    def test_background_worker_applies_updates(self):
+        applied = threading.Event()
+        batches = []
+
+        def apply(batch):
+            batches.append(batch)
+            applied.set()
+
+        queue = IndexUpdateQueue(batch_size=10, delay=0, apply=apply)
+        queue.enqueue_upsert(1)
+        self.assertTrue(applied.wait(timeout=5))
+        self.assertEqual(batches, [{1: UPSERT}])
+
+    def test_failed_batch_does_not_stop_the_queue(self):
+        queue = IndexUpdateQueue(batch_size=1, delay=0, apply=mock.Mock(side_effect=[Exception(), None]))
+        with mock.patch("threading.Thread"):
+            queue.enqueue_upsert(1)
+            queue.enqueue_upsert(2)
+        queue.drain()
+        self.assertEqual(queue.apply.call_count, 2)
+
+
+@mock.patch("api.signals.AUTO_INDEX", True)
+class CompanyIndexSignalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tech_sector = TechSector.objects.create(sector_name="Test Sector")
+        cls.hq_main_office = MainOffice.objects.create(hq_name="Test HQ")
+        cls.finance_stage = FinanceStage.objects.create(stage_name="Test Stage")
+
+    def create_company(self, name):
+        return Company.objects.create(company=name, description="Test Description", hq_main_office=self.hq_main_office,
+                                      finance_stage=self.finance_stage, website="https://test.test")
+
+    def test_company_create_update_delete_are_queued(self):
+        with mock.patch.object(index_update_queue, "enqueue_upsert") as enqueue_upsert, \
+                mock.patch.object(index_update_queue, "enqueue_delete") as enqueue_delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                company = self.create_company("Test Company")
+                company.tech_sector.add(self.tech_sector)
+            company_id = company.id
+            with self.captureOnCommitCallbacks(execute=True):
+                company.delete()
+
+        self.assertEqual(enqueue_upsert.call_args_list, [mock.call(company_id), mock.call(company_id)])
+        enqueue_delete.assert_called_once_with(company_id)
+
+    def test_tech_sector_rename_queues_its_companies(self):
+        company = self.create_company("Test Company")
+        company.tech_sector.add(self.tech_sector)
+        with mock.patch.object(index_update_queue, "enqueue_upsert") as enqueue_upsert:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.tech_sector.sector_name = "Renamed Sector"
+                self.tech_sector.save()
+        enqueue_upsert.assert_called_once_with(company.id)
+
+    def test_reverse_clear_queues_the_removed_companies(self):
+        company = self.create_company("Test Company")
+        company.tech_sector.add(self.tech_sector)
+        with mock.patch.object(index_update_queue, "enqueue_upsert") as enqueue_upsert:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.tech_sector.companies_tech_sector.clear()
+        enqueue_upsert.assert_called_once_with(company.id)
+
+    def test_rolled_back_edit_is_not_queued(self):
+        with mock.patch.object(index_update_queue, "enqueue_upsert") as enqueue_upsert:
+            with self.captureOnCommitCallbacks(execute=False):
+                self.create_company("Test Company")
+        enqueue_upsert.assert_not_called()
@@ -0,0 +1,107 @@
+from unittest import mock
+from django.test import SimpleTestCase
+from api.semantic_search import cache, semantic_search
+from api.semantic_search.cache import LRUCache, normalize_query
+from api.semantic_search.semantic_search import SearchResults
+
+
+class LRUCacheTestCase(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        lru_cache = LRUCache(max_size=2)
+        lru_cache.set("a", 1)
+        lru_cache.set("b", 2)
+        lru_cache.get("a")
+        lru_cache.set("c", 3)
+
+        self.assertEqual(lru_cache.get("a"), 1)
+        self.assertIsNone(lru_cache.get("b"))
+        self.assertEqual(lru_cache.get("c"), 3)
+        self.assertEqual(len(lru_cache), 2)
+
+    def test_entry_expires_after_ttl(self):
+        lru_cache = LRUCache(max_size=2, ttl=10)
+        with mock.patch.object(cache.time, "monotonic", return_value=100):
+            lru_cache.set("a", 1)
+        with mock.patch.object(cache.time, "monotonic", return_value=105):
+            self.assertEqual(lru_cache.get("a"), 1)
+        with mock.patch.object(cache.time, "monotonic", return_value=111):
+            self.assertIsNone(lru_cache.get("a"))
+
+    def test_hit_and_miss_counters(self):
+        lru_cache = LRUCache(max_size=2)
+        lru_cache.set("a", 1)
+        lru_cache.get("a")
+        lru_cache.get("b")
+        stats = lru_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 1, 1))
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query("  AI   Healthcare\n"), "ai healthcare")
+
+
+class SearchModelCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        self.search_engine = mock.Mock()
+        self.search_engine.index_version = (1, 1)
+        self.search_engine.result_cache = LRUCache(max_size=10)
+        self.search_engine.keyword_match.return_value = None
+        document = mock.Mock(meta={"title": "Test Company", "company_id": 7})
+        self.search_engine.search.return_value = SearchResults([document], rerank="reranked")
+
+        patchers = [
+            mock.patch("api.semantic_search.engine.get_search_engine", return_value=self.search_engine),
+            mock.patch("api.semantic_search.query_expansion.expand_query",
+                       return_value=("generated description", False)),
+        ]
+        _, self.expand_query = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_query_is_served_from_cache(self):
+        self.assertEqual(semantic_search.search_model("AI Healthcare"), ["Test Company"])
+        self.assertEqual(semantic_search.search_model("  ai healthcare "), ["Test Company"])
+
+        self.assertEqual(self.expand_query.call_count, 1)
+        self.assertEqual(self.search_engine.search.call_count, 1)
+
+    def test_cached_results_keep_company_ids(self):
+        semantic_search.search_companies("AI Healthcare")
+        results = semantic_search.search_companies("AI Healthcare")
+        self.assertEqual(results, [{"id": 7, "company": "Test Company"}])
+        self.assertEqual(results.rerank, "reranked")
+        self.assertEqual(self.search_engine.search.call_count, 1)
+
+    def test_new_index_version_misses_cache(self):
+        semantic_search.search_model("AI Healthcare")
+        self.search_engine.index_version = (2, 2)
+        semantic_search.search_model("AI Healthcare")
+
+        self.assertEqual(self.search_engine.search.call_count, 2)
+
+
+class SearchCompaniesBatchTestCase(SimpleTestCase):
+    def setUp(self):
+        self.search_engine = mock.Mock()
+        self.search_engine.index_version = (1, 1)
+        self.search_engine.result_cache = LRUCache(max_size=10)
+        self.search_engine.keyword_match.return_value = None
+        self.search_engine.search_batch.side_effect = lambda queries, **kwargs: [SearchResults(
+            [mock.Mock(meta={"title": f"{query} Company", "company_id": len(query)})], rerank="dense") for query in queries]
+
+        patchers = [
+            mock.patch("api.semantic_search.engine.get_search_engine", return_value=self.search_engine),
+            mock.patch("api.semantic_search.query_expansion.expand_queries",
+                       side_effect=lambda queries: [(query, False) for query in queries]),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cached_and_duplicated_queries_are_searched_once(self):
+        semantic_search.search_companies_batch(["fintech"])
+        results = semantic_search.search_companies_batch(["fintech", "AI", "ai ", "fintech"])
+
+        self.assertEqual(results, [[{"id": 7, "company": "fintech Company"}], [{"id": 2, "company": "AI Company"}],
+                                   [{"id": 2, "company": "AI Company"}], [{"id": 7, "company": "fintech Company"}]])
+        self.assertEqual(self.search_engine.search_batch.call_args_list[-1].args[0], ["AI"])
+        self.assertEqual([query_results.rerank for query_results in results], ["dense"] * 4)
@@ -0,0 +1,67 @@
+import os
+import tempfile
+from unittest import mock
+from django.test import SimpleTestCase
+from api.semantic_search import engine
+from api.semantic_search.engine import SemanticSearchEngine, SearchIndexNotFound
+
+
+class SemanticSearchEngineTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index_path = self.temp_dir.name
+
+        # Replace the models and the index so no model is downloaded.
+        patchers = [
+            mock.patch.object(engine, "create_embedder"),
+            mock.patch.object(engine, "create_ranker"),
+            mock.patch.object(engine.CompanyVectorIndex, "load"),
+        ]
+        self.retriever_class, self.ranker_class, self.store_load = [patcher.start() for patcher in patchers]
+        self.retriever_class.return_value.embed_queries.side_effect = lambda queries: [[0.0] * 384 for _ in queries]
+        index = self.store_load.return_value
+        index.keywords = None
+        index.company_count = index.__len__.return_value = 2
+        index.search_batch.side_effect = lambda embeddings, top_k, allowed=None: [[(0, 0.9), (1, 0.5)] for _ in embeddings]
+        index.company_id.side_effect = lambda row: row
+        index.title.side_effect = index.content.side_effect = lambda row: f"Company {row}"
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def write_index(self, mtime):
+        path = os.path.join(self.index_path, "meta.json")
+        with open(path, "w") as f:
+            f.write("{}")
+        os.utime(path, (mtime, mtime))
+
+    def test_search_without_index(self):
+        search_engine = SemanticSearchEngine(self.index_path)
+        with self.assertRaises(SearchIndexNotFound):
+            search_engine.search("query", top_k_retrieve=12, top_k_rank=6)
+
+    def test_models_and_index_loaded_once(self):
+        self.write_index(1000)
+        search_engine = SemanticSearchEngine(self.index_path)
+        for _ in range(3):
+            search_engine.search("query", top_k_retrieve=12, top_k_rank=6)
+
+        self.assertEqual(self.retriever_class.call_count, 1)
+        self.assertEqual(self.ranker_class.call_count, 1)
+        self.assertEqual(self.store_load.call_count, 1)
+        self.assertEqual(self.ranker_class.return_value.predict.call_count, 3)
+
+    def test_index_reloaded_when_file_changes(self):
+        self.write_index(1000)
+        search_engine = SemanticSearchEngine(self.index_path)
+        search_engine.search("query", top_k_retrieve=12, top_k_rank=6)
+
+        self.write_index(2000)
+        search_engine.search("query", top_k_retrieve=12, top_k_rank=6)
+
+        self.assertEqual(self.store_load.call_count, 2)
+        self.assertEqual(self.retriever_class.call_count, 1)
+
+    def test_get_search_engine_is_shared(self):
+        with mock.patch.object(engine, "_engine", None):
+            self.assertIs(engine.get_search_engine(), engine.get_search_engine())
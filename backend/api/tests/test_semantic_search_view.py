@@ -0,0 +1,165 @@
+from unittest import mock
+from django.urls import reverse
+from rest_framework.test import APITestCase, APIClient
+from rest_framework import status
+from api.models import Company, TechSector, MainOffice, Entity, FinanceStage
+from api.semantic_search.semantic_search import SearchResults
+
+
+class SemanticSearchViewTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        tech_sector = TechSector.objects.create(sector_name="Software")
+        entity = Entity.objects.create(entity_name="Entity1")
+        hq_main_office = MainOffice.objects.create(hq_name="New York")
+        finance_stage = FinanceStage.objects.create(stage_name="Seed")
+        cls.companies = []
+        for name in ("Tech Innovations", "Innovative Tech", "NonTech Company"):
+            company = Company.objects.create(company=name, description="A company", hq_main_office=hq_main_office,
+                                             finance_stage=finance_stage, website="http://test.com")
+            company.tech_sector.add(tech_sector)
+            company.vertex_entity.add(entity)
+            cls.companies.append(company)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('semantic_search_portfolio_companies')
+        results = SearchResults(({"id": company.id, "company": company.company} for company in reversed(self.companies)),
+                                rerank="dense")
+        patcher = mock.patch("api.views.search_companies", return_value=results)
+        self.search_companies = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_search_returns_names_and_ids(self):
+        response = self.client.get(self.url, {'query': 'tech'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['company'], ["NonTech Company", "Innovative Tech", "Tech Innovations"])
+        self.assertEqual(response.data['company_ids'], [company.id for company in reversed(self.companies)])
+        self.assertEqual(response.data['rerank'], "dense")
+        self.assertNotIn('results', response.data)
+
+    def test_cards_are_fetched_in_one_batch(self):
+        # The companies, then their tech sectors and entities.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, {'query': 'tech', 'cards': 'true'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cards = response.data['results']
+        self.assertEqual([card['company'] for card in cards], response.data['company'])
+        self.assertEqual(cards[0]['tech_sector'], ["Software"])
+        self.assertEqual(cards[0]['hq_main_office'], "New York")
+
+    def test_deleted_companies_are_left_out_of_cards(self):
+        self.companies[0].delete()
+        response = self.client.get(self.url, {'query': 'tech', 'cards': 'true'})
+        self.assertEqual([card['company'] for card in response.data['results']], ["NonTech Company", "Innovative Tech"])
+
+    def test_facet_filters_are_passed_to_the_search(self):
+        self.client.get(self.url, {'query': 'tech', 'tech_sectors': [1, 2], 'status': 'active', 'other': 'x'})
+        self.search_companies.assert_called_once_with('tech', filters={'tech_sectors': ['1', '2'], 'status': ['active']})
+
+    def test_missing_query(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchSemanticSearchViewTest(SemanticSearchViewTest):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('batch_semantic_search_portfolio_companies')
+        first, second, third = [{"id": company.id, "company": company.company} for company in self.companies]
+        results = [SearchResults([first, second], rerank="reranked"), SearchResults([third, first], rerank="deep")]
+        patcher = mock.patch("api.views.search_companies_batch", return_value=results)
+        self.search_companies_batch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_search_returns_names_and_ids(self):
+        response = self.client.post(self.url, {'queries': ['tech', 'other']}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.search_companies_batch.assert_called_once_with(['tech', 'other'], filters={})
+        searches = response.data['searches']
+        self.assertEqual([search['query'] for search in searches], ['tech', 'other'])
+        self.assertEqual(searches[1]['company'], ["NonTech Company", "Tech Innovations"])
+        self.assertEqual(searches[1]['company_ids'], [self.companies[2].id, self.companies[0].id])
+        self.assertEqual([search['rerank'] for search in searches], ["reranked", "deep"])
+
+    def test_cards_are_fetched_in_one_batch(self):
+        # The companies of every query together, then their tech sectors and entities.
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url, {'queries': ['tech', 'other'], 'cards': True}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for search in response.data['searches']:
+            self.assertEqual([card['company'] for card in search['results']], search['company'])
+
+    def test_deleted_companies_are_left_out_of_cards(self):
+        self.companies[0].delete()
+        response = self.client.post(self.url, {'queries': ['tech', 'other'], 'cards': True}, format='json')
+        self.assertEqual([card['company'] for card in response.data['searches'][1]['results']], ["NonTech Company"])
+
+    def test_missing_query(self):
+        for data in ({}, {'queries': []}, {'queries': 'tech'}, {'queries': ['tech', '']}):
+            response = self.client.post(self.url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_facet_filters_are_passed_to_the_search(self):
+        filters = {'hq_main_offices': [1], 'finance_stages': [2]}
+        self.client.post(self.url, {'queries': ['tech'], 'filters': filters}, format='json')
+        self.search_companies_batch.assert_called_once_with(['tech'], filters=filters)
+
+        response = self.client.post(self.url, {'queries': ['tech'], 'filters': ['status']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch("api.views.MAX_BATCH_QUERIES", 2)
+    def test_too_many_queries(self):
+        response = self.client.post(self.url, {'queries': ['a', 'b', 'c']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.search_companies_batch.assert_not_called()
+
+
+class AsyncSemanticSearchViewTest(SemanticSearchViewTest):
+    def setUp(self):
+        self.url = reverse('async_semantic_search_portfolio_companies')
+        results = SearchResults(({"id": company.id, "company": company.company} for company in reversed(self.companies)),
+                                rerank="dense")
+        self.search_companies_async = mock.AsyncMock(return_value=results)
+        patcher = mock.patch("api.views.search_companies_async", self.search_companies_async)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_search_returns_names_and_ids(self):
+        response = await self.async_client.get(self.url, {'query': 'tech'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.json()
+        self.assertEqual(data['company'], ["NonTech Company", "Innovative Tech", "Tech Innovations"])
+        self.assertEqual(data['company_ids'], [company.id for company in reversed(self.companies)])
+        self.assertEqual(data['rerank'], "dense")
+        self.assertNotIn('results', data)
+
+    async def test_cards_are_fetched_in_one_batch(self):
+        response = await self.async_client.get(self.url, {'query': 'tech', 'cards': 'true'})
+
+        data = response.json()
+        self.assertEqual([card['company'] for card in data['results']], data['company'])
+        self.assertEqual(data['results'][0]['tech_sector'], ["Software"])
+
+    async def test_deleted_companies_are_left_out_of_cards(self):
+        await self.companies[0].adelete()
+        response = await self.async_client.get(self.url, {'query': 'tech', 'cards': 'true'})
+        self.assertEqual([card['company'] for card in response.json()['results']],
+                         ["NonTech Company", "Innovative Tech"])
+
+    async def test_facet_filters_are_passed_to_the_search(self):
+        await self.async_client.get(self.url, {'query': 'tech', 'finance_stages': [3]})
+        self.search_companies_async.assert_awaited_once_with('tech', filters={'finance_stages': ['3']})
+
+    async def test_missing_query(self):
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_only_get_is_allowed(self):
+        response = await self.async_client.post(self.url, {'query': 'tech'})
+        self.assertEqual(response.status_code, 405)
@@ -0,0 +1,123 @@
+import os
+import tempfile
+from unittest import mock
+import faiss
+import numpy as np
+from django.test import SimpleTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from api.semantic_search.engine import SemanticSearchEngine
+from api.semantic_search.facet_index import FacetIndexWriter
+from api.semantic_search.neighbour_index import PRECOMPUTED, SEARCHED, NeighbourIndex, write_neighbours
+from api.semantic_search.vector_index import CompanyVectorIndex, VectorIndexWriter
+
+
+def line_vectors(count, dim=8):
+    # Unit vectors along an arc, so each company's nearest neighbours are the next ones along it.
+    angles = np.linspace(0, np.pi / 2, count)
+    vectors = np.zeros((count, dim), dtype=np.float32)
+    vectors[:, 0], vectors[:, 1] = np.cos(angles), np.sin(angles)
+    return vectors
+
+
+class SimilarCompaniesTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = os.path.join(self.temp_dir.name, "index")
+        vectors = line_vectors(6)
+        # Company 3 has a second chunk, which must not make it its own neighbour.
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add([1, 2, 3, 4, 5, 6, 3], [f"Company {i}" for i in (1, 2, 3, 4, 5, 6, 3)],
+                       ["main"] * 6 + ["chunk"], np.vstack([vectors, vectors[2:3]]))
+            writer.finish("Flat", facets=FacetIndexWriter().add_companies(
+                (company_id, {"status": ["active" if company_id % 2 else "closed"]}) for company_id in range(1, 7)))
+
+        patchers = [mock.patch("api.semantic_search.engine.create_embedder"),
+                    mock.patch("api.semantic_search.engine.create_ranker")]
+        self.create_embedder, self.create_ranker = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.search_engine = SemanticSearchEngine(self.index_path)
+
+    def test_neighbours_are_written_with_the_index(self):
+        neighbours = CompanyVectorIndex.load(self.index_path).neighbours
+        self.assertEqual({company_id for company_id, _ in neighbours.get(3)[:2]}, {2, 4})
+        self.assertEqual(len(neighbours.get(1)), 5)
+        self.assertIsNone(neighbours.get(7))
+
+    def test_precomputed_neighbours_answer_without_the_models(self):
+        documents, source = self.search_engine.similar_companies(1, top_k=2)
+
+        self.assertEqual(source, PRECOMPUTED)
+        self.assertEqual([document.meta["company_id"] for document in documents], [2, 3])
+        self.assertEqual(documents[0].meta["title"], "Company 2")
+        self.create_embedder.assert_not_called()
+        self.create_ranker.assert_not_called()
+
+    def test_filtered_lookups_search_the_index_when_neighbours_run_out(self):
+        documents, source = self.search_engine.similar_companies(1, top_k=2, filters={"status": ["active"]})
+        self.assertEqual(source, PRECOMPUTED)
+        self.assertEqual([document.meta["company_id"] for document in documents], [3, 5])
+
+        with mock.patch("api.semantic_search.neighbour_index.NeighbourIndex.get", return_value=[(2, 0.9)]):
+            documents, source = self.search_engine.similar_companies(1, top_k=2, filters={"status": ["active"]})
+        self.assertEqual(source, SEARCHED)
+        self.assertEqual([document.meta["company_id"] for document in documents], [3, 5])
+
+    def test_only_the_neighbours_near_a_changed_company_are_searched_again(self):
+        company_ids = np.arange(1, 11)
+
+        def write(name, vectors, **kwargs):
+            # Returns the neighbours written and the number of companies searched.
+            directory = os.path.join(self.temp_dir.name, name)
+            os.makedirs(directory)
+            faiss_index = faiss.IndexFlatIP(8)
+            faiss_index.add(vectors)
+            search = mock.Mock(side_effect=faiss_index.search)
+            write_neighbours(directory, mock.Mock(search=search), vectors, company_ids, top_n=2, **kwargs)
+            return NeighbourIndex(directory), sum(len(call.args[0]) for call in search.call_args_list)
+
+        vectors = line_vectors(10)
+        previous, _ = write("previous", vectors)
+        # Company 10 moves from the end of the arc to between companies 1 and 2.
+        vectors[9] = line_vectors(19)[1]
+        updated, searched = write("updated", vectors, previous=previous, changed_ids=[10])
+        expected, _ = write("expected", vectors)
+
+        self.assertEqual([updated.get(company_id) for company_id in company_ids],
+                         [expected.get(company_id) for company_id in company_ids])
+        self.assertEqual([company_id for company_id, _ in updated.get(1)], [10, 2])
+        # Company 10, company 9 which had it as a neighbour and companies 1 and 2 which it is now closest to.
+        self.assertEqual(searched, 4)
+
+    def test_company_missing_from_the_index(self):
+        self.assertIsNone(self.search_engine.similar_companies(42, top_k=2))
+
+
+class SimilarCompaniesViewTest(SimpleTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('similar_portfolio_companies', args=[1])
+        patcher = mock.patch("api.views.find_similar_companies",
+                             return_value=([{"id": 2, "company": "Company 2", "score": 0.9}], PRECOMPUTED))
+        self.find_similar_companies = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_similar_companies_are_returned(self):
+        response = self.client.get(self.url, {'top_k': 3, 'tech_sectors': ['4']})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['company'], ["Company 2"])
+        self.assertEqual(response.data['company_ids'], [2])
+        self.assertEqual(response.data['source'], PRECOMPUTED)
+        self.find_similar_companies.assert_called_once_with(1, 3, filters={"tech_sectors": ["4"]})
+
+    def test_unknown_company(self):
+        self.find_similar_companies.return_value = None
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_top_k(self):
+        for top_k in ('0', '1000', 'many'):
+            self.assertEqual(self.client.get(self.url, {'top_k': top_k}).status_code, status.HTTP_400_BAD_REQUEST)
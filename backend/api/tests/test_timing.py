@@ -0,0 +1,95 @@
+import asyncio
+import json
+from unittest import mock
+from django.test import SimpleTestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+from api.semantic_search import timing
+from api.semantic_search.async_search import run_inference
+from api.semantic_search.semantic_search import SearchResults
+from api.semantic_search.timing import StageHistograms, span, timed_search
+
+
+class StageHistogramsTestCase(SimpleTestCase):
+    def test_prometheus_buckets_are_cumulative(self):
+        histograms = StageHistograms(buckets=(10, 100))
+        for duration_ms in (5, 50, 50, 500):
+            histograms.observe("embed", duration_ms)
+
+        text = histograms.to_prometheus()
+        self.assertIn('semantic_search_stage_seconds_bucket{stage="embed",le="0.01"} 1', text)
+        self.assertIn('semantic_search_stage_seconds_bucket{stage="embed",le="0.1"} 3', text)
+        self.assertIn('semantic_search_stage_seconds_bucket{stage="embed",le="+Inf"} 4', text)
+        self.assertIn('semantic_search_stage_seconds_sum{stage="embed"} 0.605000', text)
+        self.assertIn('semantic_search_stage_seconds_count{stage="embed"} 4', text)
+
+
+class SearchTimingsTestCase(SimpleTestCase):
+    def test_spans_are_collected_per_request_and_logged(self):
+        with self.assertLogs("api.semantic_search.timing", level="INFO") as logs:
+            with timed_search("search") as timings:
+                with span("embed"):
+                    pass
+                with span("rerank"):
+                    pass
+                with span("embed"):
+                    pass
+                timing.annotate(rerank="dense")
+        with span("embed"):
+            pass  # Outside of a request, only the histograms see it.
+
+        self.assertEqual([stage for stage, _ in timings.spans], ["embed", "rerank", "embed", "total"])
+        self.assertEqual(list(timings.stages()), ["embed", "rerank", "total"])
+        self.assertRegex(timings.server_timing(), r"^embed;dur=\d+\.\d, rerank;dur=\d+\.\d, total;dur=\d+\.\d$")
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record["endpoint"], record["rerank"]), ("search", "dense"))
+        self.assertEqual(set(record["stages_ms"]), {"embed", "rerank", "total"})
+
+    def test_inference_threads_add_spans_to_the_request(self):
+        def embed():
+            with span("embed"):
+                return 1
+
+        async def search():
+            with timed_search("async_search") as timings:
+                await run_inference(embed)
+            return timings
+
+        timings = asyncio.run(search())
+        self.assertIn("embed", timings.stages())
+
+
+class SearchTimingViewTestCase(SimpleTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        patcher = mock.patch("api.views.search_companies", return_value=SearchResults([], rerank="dense"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(timing, "SERVER_TIMING", True)
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('semantic_search_portfolio_companies'), {'query': 'tech'})
+        self.assertRegex(response["Server-Timing"], r"total;dur=\d+\.\d")
+
+    def test_no_server_timing_header_by_default(self):
+        response = self.client.get(reverse('semantic_search_portfolio_companies'), {'query': 'tech'})
+        self.assertNotIn("Server-Timing", response)
+
+    def test_metrics_are_off_by_default(self):
+        response = self.client.get(reverse('semantic_search_metrics'), REMOTE_ADDR="127.0.0.1")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @mock.patch("api.views.METRICS_TOKEN", "secret")
+    @mock.patch("api.views.METRICS_ACCESS", "token")
+    def test_metrics_need_the_token(self):
+        self.client.get(reverse('semantic_search_portfolio_companies'), {'query': 'tech'})
+
+        response = self.client.get(reverse('semantic_search_metrics'), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('semantic_search_stage_seconds_count{stage="total"}', response.content.decode())
+
+        # Requests relayed by a local proxy are not trusted for their address.
+        for headers in ({"REMOTE_ADDR": "127.0.0.1"}, {"HTTP_AUTHORIZATION": "Bearer wrong"}):
+            response = self.client.get(reverse('semantic_search_metrics'), **headers)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
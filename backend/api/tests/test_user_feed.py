@@ -0,0 +1,164 @@
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+import numpy as np
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from haystack.schema import Document
+from rest_framework import status
+from rest_framework.test import APIClient
+from api.models import Interest, User, UserFeed
+from api.semantic_search import engine
+from api.semantic_search.engine import SemanticSearchEngine
+from api.semantic_search.feeds import (get_user_feed, rank_feed, refresh_user_feed, refresh_user_feed_on_commit,
+                                       refresh_user_feeds)
+from api.semantic_search.interest_index import InterestIndexWriter
+from api.semantic_search.vector_index import CompanyVectorIndex, VectorIndexWriter
+
+
+def axis_vector(axis, dim=8):
+    vector = np.zeros(dim, dtype=np.float32)
+    vector[axis] = 1.0
+    return vector
+
+
+class UserFeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fintech = Interest.objects.create(name="fintech")
+        cls.health = Interest.objects.create(name="health")
+        cls.climate = Interest.objects.create(name="climate")
+        cls.user = User.objects.create(email="feed@test.test", first_name="Feed", last_name="User", company="Test",
+                                       contact_number="+65 9123 4567")
+        cls.user.interests.set([cls.fintech, cls.health])
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = os.path.join(self.temp_dir.name, "index")
+        # Company 1 is fintech, 3 health, 4 second for both and 2 third for both.
+        vectors = np.array([axis_vector(0), axis_vector(0) * 0.5 + axis_vector(1) * 0.3 + axis_vector(2) * 0.81,
+                            axis_vector(1), (axis_vector(0) + axis_vector(1)) / np.sqrt(2)], dtype=np.float32)
+        axes = {"fintech": 0, "health": 1}
+        self.embed_queries = mock.Mock(side_effect=lambda names: [axis_vector(axes.get(name, 3)) for name in names])
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add([1, 2, 3, 4], ["Pay", "Lend", "Care", "PayCare"], ["pay", "lend", "care", "paycare"], vectors)
+            writer.finish("Flat", interests=InterestIndexWriter().add_interests(
+                self.embed_queries, [(self.fintech.id, "fintech"), (self.health.id, "health")]))
+
+        patchers = [mock.patch.object(engine, "create_embedder"), mock.patch.object(engine, "create_ranker")]
+        self.create_embedder = patchers[0].start()
+        patchers[1].start()
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.create_embedder.return_value.embed_queries.side_effect = self.embed_queries.side_effect
+        self.search_engine = SemanticSearchEngine(self.index_path)
+        patcher = mock.patch.object(engine, "_engine", self.search_engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_interest_companies_are_written_with_the_index(self):
+        interests = CompanyVectorIndex.load(self.index_path).interests
+        fintech_companies = interests.companies(self.fintech.id, "fintech")
+        self.assertEqual([company_id for company_id, _ in fintech_companies], [1, 4, 2, 3])
+        self.assertIsNone(interests.companies(self.fintech.id, "renamed"))
+        self.assertIsNone(interests.companies(self.climate.id, "climate"))
+
+    def test_unchanged_interests_are_not_embedded_again(self):
+        previous = CompanyVectorIndex.load(self.index_path).interests
+        self.embed_queries.reset_mock()
+        interests = [(self.fintech.id, "fintech"), (self.health.id, "health"), (self.climate.id, "climate")]
+        writer = InterestIndexWriter().add_interests(self.embed_queries, interests, previous=previous)
+
+        self.embed_queries.assert_called_once_with(["climate"])
+        self.assertEqual(sorted(writer.interests), [self.fintech.id, self.health.id, self.climate.id])
+
+    def test_rank_feed_puts_companies_of_several_interests_first(self):
+        def documents(*company_ids):
+            return [Document(content="", meta={"company_id": company_id, "title": f"Company {company_id}"})
+                    for company_id in company_ids]
+
+        feed = rank_feed({1: documents(1, 4, 2), 2: documents(3, 4)})
+        self.assertEqual([result["id"] for result in feed][:2], [4, 1])
+        self.assertEqual(feed[0]["company"], "Company 4")
+
+    def test_feed_is_stored_without_running_a_model(self):
+        feed = get_user_feed(self.user)
+
+        self.assertEqual(feed.interest_ids, sorted([self.fintech.id, self.health.id]))
+        self.assertEqual(feed.results[0]["id"], 4)
+        self.assertEqual(feed.index_version, CompanyVectorIndex.load(self.index_path).version)
+        self.create_embedder.assert_not_called()
+
+        # Read again from the database while nothing changed.
+        with mock.patch("api.semantic_search.feeds.refresh_user_feed") as refresh:
+            self.assertEqual(get_user_feed(self.user).pk, feed.pk)
+        refresh.assert_not_called()
+
+    def test_feed_is_refreshed_when_interests_change(self):
+        get_user_feed(self.user)
+        self.user.interests.set([self.fintech, self.climate])
+
+        with mock.patch("api.semantic_search.feeds.AUTO_INDEX", True), \
+                mock.patch("api.semantic_search.feeds.index_update_queue") as index_update_queue:
+            feed = get_user_feed(self.user)
+        self.assertEqual(feed.interest_ids, sorted([self.fintech.id, self.climate.id]))
+        # climate is missing from the index, it is left out until an index update embeds it.
+        self.assertEqual([result["id"] for result in feed.results], [1, 4, 2, 3])
+        index_update_queue.enqueue_interests.assert_called_once_with()
+        self.create_embedder.assert_not_called()
+
+    def test_renamed_interest_keeps_its_companies(self):
+        self.user.interests.set([self.fintech])
+        Interest.objects.filter(pk=self.fintech.pk).update(name="payments")
+
+        with mock.patch("api.semantic_search.feeds.index_update_queue"):
+            feed = get_user_feed(self.user)
+        self.assertEqual(feed.results[0]["id"], 1)
+        self.create_embedder.assert_not_called()
+
+    def test_feed_of_an_older_index_is_served_and_refreshed_in_the_background(self):
+        feed = get_user_feed(self.user)
+        UserFeed.objects.update(index_version="old")
+
+        with mock.patch("api.semantic_search.feeds.refresh_user_feed_in_background") as refresh_in_background, \
+                mock.patch("api.semantic_search.feeds.refresh_user_feed") as refresh:
+            # Updated moments ago, by an earlier company edit for instance.
+            self.assertEqual(get_user_feed(self.user).results, feed.results)
+            refresh_in_background.assert_not_called()
+
+            UserFeed.objects.update(updated_at=timezone.now() - timedelta(days=1))
+            self.assertEqual(get_user_feed(self.user).index_version, "old")
+            refresh_in_background.assert_called_once_with(self.user)
+        refresh.assert_not_called()
+
+    def test_feed_is_refreshed_on_commit_and_for_every_user(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_user_feed_on_commit(self.user)
+        self.assertTrue(UserFeed.objects.filter(user=self.user).exists())
+
+        UserFeed.objects.update(index_version="old")
+        self.assertEqual(refresh_user_feeds(), 1)
+        self.assertNotEqual(UserFeed.objects.get(user=self.user).index_version, "old")
+
+    def test_feed_endpoint(self):
+        client = APIClient()
+        url = reverse('user-feed', args=[self.user.id])
+        self.assertEqual(client.get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        client.force_authenticate(self.user)
+        response = client.get(url, {'top_k': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['company_ids'][0], 4)
+        self.assertEqual(len(response.data['company']), 2)
+        self.assertEqual(client.get(url, {'top_k': 1000}).status_code, status.HTTP_400_BAD_REQUEST)
+
+        other = User.objects.create(email="other@test.test", first_name="Other", last_name="User", company="Test",
+                                    contact_number="+65 9123 4568")
+        self.assertEqual(client.get(reverse('user-feed', args=[other.id])).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_feed_without_interests_is_empty(self):
+        self.user.interests.clear()
+        self.assertEqual(refresh_user_feed(self.user).results, [])
@@ -0,0 +1,316 @@
+import os
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from api.models import Company, MainOffice, FinanceStage
+from api.semantic_search.engine import SemanticSearchEngine
+from api.semantic_search.facet_index import FacetIndexWriter, normalize_filters
+from api.semantic_search.index_updates import apply_index_updates, UPSERT, DELETE
+from api.semantic_search.keyword_index import KeywordIndexWriter
+from api.semantic_search.rerank import RerankPolicy
+from api.semantic_search.semantic_search import CHUNK_OVERFETCH
+from api.semantic_search.vector_index import (CompanyVectorIndex, IndexValidationError, IndexVersionConflict,
+                                              VectorIndexWriter, current_version, index_lock, list_versions,
+                                              prune_versions, rollback_version)
+
+
+def unit_vectors(count, dim=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class CompanyVectorIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = os.path.join(self.temp_dir.name, "index")
+        self.vectors = unit_vectors(5)
+
+    def write_index(self, company_ids=(10, 11, 12, 12, 13)):
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add(company_ids[:2], ["Zeta", "Ünïcode"], ["zeta text", "unicode text"], self.vectors[:2])
+            writer.add(company_ids[2:], ["Gamma", "Gamma", "Delta"], ["gamma 1", "gamma 2", "delta"], self.vectors[2:])
+            writer.finish("Flat")
+        return CompanyVectorIndex.load(self.index_path)
+
+    def test_rows_round_trip(self):
+        index = self.write_index()
+
+        self.assertEqual(len(index), 5)
+        self.assertEqual([index.company_id(row) for row in range(5)], [10, 11, 12, 12, 13])
+        self.assertEqual(index.title(1), "Ünïcode")
+        self.assertEqual(index.content(3), "gamma 2")
+        np.testing.assert_array_equal(index.vectors, self.vectors)
+        self.assertEqual(os.listdir(self.temp_dir.name), ["index"])
+
+    def test_search_returns_nearest_rows(self):
+        index = self.write_index()
+        results = index.search(self.vectors[3], top_k=2)
+        self.assertEqual(results[0][0], 3)
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertEqual(len(results), 2)
+
+    def test_search_batch(self):
+        index = self.write_index()
+        results = index.search_batch(self.vectors[[4, 0]], top_k=1)
+        self.assertEqual([[row for row, _ in hits] for hits in results], [[4], [0]])
+
+    def test_engine_batch_search_batches_each_model_call(self):
+        self.write_index()
+        with mock.patch("api.semantic_search.engine.create_embedder") as retriever_class, \
+                mock.patch("api.semantic_search.engine.create_ranker") as ranker_class:
+            retriever_class.return_value.embed_queries.side_effect = lambda queries: self.vectors[[4, 0]]
+            predict_batch = ranker_class.return_value.predict_batch
+            predict_batch.side_effect = lambda queries, documents, top_k: [docs[:top_k] for docs in documents]
+
+            search_engine = SemanticSearchEngine(self.index_path)
+            search_engine.rerank_policy = RerankPolicy("fixed")
+            results = search_engine.search_batch(["delta", "zeta", "delta"], top_k_retrieve=2, top_k_rank=1)
+
+        retriever_class.return_value.embed_queries.assert_called_once_with(["delta", "zeta"])
+        predict_batch.assert_called_once()
+        self.assertEqual([[doc.meta["title"] for doc in docs] for docs in results], [["Delta"], ["Zeta"], ["Delta"]])
+
+    def test_failed_write_keeps_the_current_index(self):
+        self.write_index()
+        signature = CompanyVectorIndex.signature(self.index_path)
+        with self.assertRaises(ValueError):
+            with VectorIndexWriter(self.index_path, 8) as writer:
+                writer.add([1], ["Only"], ["only"], self.vectors[:2])
+
+        self.assertEqual(CompanyVectorIndex.signature(self.index_path), signature)
+        self.assertEqual(os.listdir(self.temp_dir.name), ["index"])
+
+    def test_small_ivfpq_index_is_built_as_flat(self):
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add([1, 2], ["A", "B"], ["a", "b"], self.vectors[:2])
+            writer.finish("IVFPQ")
+        self.assertEqual(CompanyVectorIndex.load(self.index_path).index_type, "Flat")
+
+    def test_empty_index(self):
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.finish("Flat")
+        index = CompanyVectorIndex.load(self.index_path)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.search(self.vectors[0], top_k=3), [])
+
+    def test_engine_keeps_best_document_per_company(self):
+        index = self.write_index()
+        documents = SemanticSearchEngine.retrieve(index, self.vectors[2], top_k=5)
+
+        company_ids = [document.meta["company_id"] for document in documents]
+        self.assertEqual(sorted(company_ids), [10, 11, 12, 13])
+        gamma = documents[company_ids.index(12)]
+        self.assertEqual((gamma.meta["title"], gamma.content), ("Gamma", "gamma 1"))
+
+
+    def test_company_chunks_are_pooled(self):
+        index = self.write_index()
+        self.assertEqual((index.company_count, len(index)), (4, 5))
+        self.assertEqual(SemanticSearchEngine.row_depth(index, 2), 2 * CHUNK_OVERFETCH)
+        hits = [(4, 0.8), (2, 0.5), (3, 0.45)]
+
+        max_pooled = SemanticSearchEngine.to_documents(index, hits, "max")
+        self.assertEqual([(doc.meta["company_id"], doc.score) for doc in max_pooled], [(13, 0.8), (12, 0.5)])
+        sum_pooled = SemanticSearchEngine.to_documents(index, hits, "sum")
+        self.assertEqual([(doc.meta["company_id"], round(doc.score, 2)) for doc in sum_pooled], [(12, 0.95), (13, 0.8)])
+        self.assertEqual(sum_pooled[0].content, "gamma 1")
+
+        with self.assertRaises(ValueError):
+            SemanticSearchEngine(self.index_path, chunk_pooling="mean")
+
+
+class IndexVersionsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = os.path.join(self.temp_dir.name, "index")
+        self.vectors = unit_vectors(3)
+
+    def write_version(self, titles, min_count=0):
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add(range(len(titles)), titles, titles, self.vectors[:len(titles)])
+            writer.finish("Flat", min_count=min_count)
+        return writer.version
+
+    @mock.patch("api.semantic_search.engine.create_ranker")
+    @mock.patch("api.semantic_search.engine.create_embedder")
+    def test_each_write_activates_a_new_version(self, create_embedder, create_ranker):
+        first = self.write_version(["A", "B"])
+        engine = SemanticSearchEngine(self.index_path)
+        engine.load()
+        self.assertEqual(engine._index.version, first)
+
+        second = self.write_version(["C", "D", "E"])
+        self.assertEqual(list_versions(self.index_path), [first, second])
+        self.assertEqual(current_version(self.index_path), second)
+        self.assertFalse(engine.is_loaded())
+        engine.load()
+        self.assertEqual(engine._index.title(0), "C")
+
+    def test_rollback_and_activate(self):
+        first = self.write_version(["A", "B"])
+        second = self.write_version(["C", "D"])
+        signature = CompanyVectorIndex.signature(self.index_path)
+
+        self.assertEqual(rollback_version(self.index_path), first)
+        self.assertNotEqual(CompanyVectorIndex.signature(self.index_path), signature)
+        self.assertEqual(CompanyVectorIndex.load(self.index_path).title(0), "A")
+        with self.assertRaises(ValueError):
+            rollback_version(self.index_path)
+
+        stdout = StringIO()
+        with mock.patch("api.management.commands.search_index_versions.SEARCH_INDEX_PATH", self.index_path):
+            call_command("search_index_versions", "--activate", second, stdout=stdout)
+        self.assertEqual(current_version(self.index_path), second)
+        self.assertIn(f"* {second}  2 rows  Flat", stdout.getvalue())
+
+    def test_old_versions_are_pruned(self):
+        with mock.patch("api.semantic_search.vector_index.KEEP_VERSIONS", 2):
+            versions = [self.write_version(["A", "B"]) for _ in range(3)]
+            self.assertEqual(list_versions(self.index_path), versions[1:])
+
+
+        rollback_version(self.index_path)
+        prune_versions(self.index_path, keep=1)
+        self.assertEqual(list_versions(self.index_path), [versions[1]])
+
+    def test_invalid_version_is_not_activated(self):
+        first = self.write_version(["A", "B"])
+        with self.assertRaises(IndexValidationError):
+            self.write_version(["C"], min_count=2)
+
+        self.assertEqual(list_versions(self.index_path), [first])
+        self.assertEqual(CompanyVectorIndex.load(self.index_path).title(0), "A")
+
+    def test_smoke_query_must_find_the_rows(self):
+        with mock.patch.object(CompanyVectorIndex, "search_batch", side_effect=lambda queries, top_k: [[]] * len(queries)):
+            with self.assertRaises(IndexValidationError):
+                self.write_version(["A", "B"])
+        self.assertIsNone(CompanyVectorIndex.signature(self.index_path))
+
+    def test_writer_based_on_a_replaced_version_is_not_activated(self):
+        first = self.write_version(["A", "B"])
+        with VectorIndexWriter(self.index_path, 8) as stale_writer:
+            stale_writer.add([0], ["Stale"], ["stale"], self.vectors[:1])
+            second = self.write_version(["C", "D"])
+            self.assertTrue(os.path.isdir(stale_writer.tmp_path))
+            with self.assertRaises(IndexVersionConflict):
+                stale_writer.finish("Flat")
+
+        self.assertEqual(current_version(self.index_path), second)
+        self.assertEqual(list_versions(self.index_path), [first, second])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.index_path, "versions"))), [first, second])
+
+    def test_index_lock_is_held_by_one_writer_at_a_time(self):
+        acquired = threading.Event()
+
+        def wait_for_lock():
+            with index_lock(self.index_path):
+                acquired.set()
+
+        with index_lock(self.index_path):
+            thread = threading.Thread(target=wait_for_lock)
+            thread.start()
+            self.assertFalse(acquired.wait(timeout=0.2))
+        thread.join(timeout=5)
+        self.assertTrue(acquired.is_set())
+
+    def test_unversioned_index_is_still_read(self):
+        self.write_version(["A", "B"])
+        legacy_path = os.path.join(self.temp_dir.name, "legacy")
+        os.rename(os.path.join(self.index_path, "versions", current_version(self.index_path)), legacy_path)
+
+        self.assertIsNotNone(CompanyVectorIndex.signature(legacy_path))
+        self.assertEqual(CompanyVectorIndex.load(legacy_path).title(1), "B")
+
+
+class ApplyIndexUpdatesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        hq_main_office = MainOffice.objects.create(hq_name="Test HQ")
+        finance_stage = FinanceStage.objects.create(stage_name="Test Stage")
+        cls.companies = [Company.objects.create(company=f"Test Company {i}", description="Test Description",
+                                                hq_main_office=hq_main_office, finance_stage=finance_stage,
+                                                website="https://test.test") for i in range(3)]
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.index_path = os.path.join(self.temp_dir.name, "index")
+        self.vectors = unit_vectors(3)
+        with VectorIndexWriter(self.index_path, 8) as writer:
+            writer.add([company.id for company in self.companies], [company.company for company in self.companies],
+                       ["old"] * 3, self.vectors)
+            writer.finish("Flat", keywords=KeywordIndexWriter().add_companies(),
+                          facets=FacetIndexWriter().add_companies())
+
+        patchers = [
+            mock.patch("api.semantic_search.index_builder.get_preprocessor"),
+            mock.patch("api.semantic_search.engine.get_search_engine"),
+        ]
+        get_preprocessor, get_search_engine = [patcher.start() for patcher in patchers]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        get_preprocessor.return_value.process.side_effect = lambda docs: docs
+        self.embed_documents = get_search_engine.return_value.embed_documents
+        self.embed_documents.side_effect = lambda docs: np.ones((len(docs), 8))
+
+    def test_only_upserted_companies_are_embedded(self):
+        first, second, third = self.companies
+        first.company = "Renamed Company"
+        first.save()
+
+        apply_index_updates({first.id: UPSERT, second.id: DELETE}, index_path=self.index_path)
+
+        index = CompanyVectorIndex.load(self.index_path)
+        self.assertEqual([index.company_id(row) for row in range(len(index))], [third.id, first.id])
+        self.assertEqual(index.title(1), "Renamed Company")
+        np.testing.assert_array_equal(index.vectors[0], self.vectors[2])
+        self.assertEqual(len(self.embed_documents.call_args.args[0]), 1)
+
+    def test_keywords_and_facets_of_the_other_companies_are_carried_over(self):
+        first, second, third = self.companies
+        first.company = "Renamed Company"
+        first.finance_stage = FinanceStage.objects.create(stage_name="Other Stage")
+        first.save()
+        Company.objects.filter(pk=third.pk).update(description="Quantum")  # Not queued, so not read again.
+
+        apply_index_updates({first.id: UPSERT, second.id: DELETE}, index_path=self.index_path)
+
+        index = CompanyVectorIndex.load(self.index_path)
+        self.assertEqual([hit[0] for hit in index.keywords.search("renamed description", 3)], [first.id, third.id])
+        self.assertEqual(index.keywords.search("quantum", 3), [])
+        self.assertEqual(index.keywords.name_matches("test company 2"), [third.id])
+        self.assertEqual(index.keywords.name_matches("test company 1"), [])
+        for stage, rows in ((first.finance_stage_id, [False, True]), (third.finance_stage_id, [True, False])):
+            mask = index.facets.mask(normalize_filters({"finance_stages": [stage]}), len(index))
+            self.assertEqual(mask.tolist(), rows)
+
+    def test_full_build_outlives_the_update_versions(self):
+        build = current_version(self.index_path)
+        first = self.companies[0]
+        with mock.patch("api.semantic_search.vector_index.KEEP_VERSIONS", 2):
+            for i in range(4):
+                first.company = f"Renamed Company {i}"
+                first.save()
+                apply_index_updates({first.id: UPSERT}, index_path=self.index_path)
+
+        versions = list_versions(self.index_path)
+        self.assertEqual(len(versions), 3)
+        self.assertEqual(versions[0], build)
+
+        self.assertEqual(rollback_version(self.index_path, to_build=True), build)
+        index = CompanyVectorIndex.load(self.index_path)
+        self.assertEqual([index.title(row) for row in range(len(index))],
+                         ["Test Company 0", "Test Company 1", "Test Company 2"])
+        with self.assertRaises(ValueError):
+            rollback_version(self.index_path, to_build=True)
+
+    def test_no_index_is_a_no_op(self):
+        apply_index_updates({self.companies[0].id: UPSERT}, index_path=os.path.join(self.temp_dir.name, "missing"))
+        self.embed_documents.assert_not_called()
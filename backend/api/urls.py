@@ -2,6 +2,8 @@ from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework_simplejwt.views import TokenRefreshView
 from .views import UserViewSet, LoginView, GetUserIDFromToken, CompanyViewSet, InterestViewSet, SemanticSearchPortfolioCompanies, GetInterestIDFromName
+from .views import BatchSemanticSearchPortfolioCompanies, semantic_search_portfolio_companies_async, semantic_search_metrics
+from .views import SimilarPortfolioCompanies
 from .views import TechSectorViewSet, MainOfficeViewSet, EntityViewSet, FinanceStageViewSet, CompanyViewSetForModelTraining
 
 router = DefaultRouter()
@@ -22,4 +24,11 @@ urlpatterns = [
     path('interestId/interestName', GetInterestIDFromName.as_view(), name='get_interest_id_by_name'),
     path('semantic-search-portfolio-companies/', SemanticSearchPortfolioCompanies.as_view(),
          name='semantic_search_portfolio_companies'),
+    path('semantic-search-portfolio-companies/batch/', BatchSemanticSearchPortfolioCompanies.as_view(),
+         name='batch_semantic_search_portfolio_companies'),
+    path('semantic-search-portfolio-companies/async/', semantic_search_portfolio_companies_async,
+         name='async_semantic_search_portfolio_companies'),
+    path('semantic-search-portfolio-companies/metrics/', semantic_search_metrics, name='semantic_search_metrics'),
+    path('semantic-search-portfolio-companies/similar/<int:company_id>/', SimilarPortfolioCompanies.as_view(),
+         name='similar_portfolio_companies'),
 ]
@@ -1,17 +1,32 @@
 from rest_framework import viewsets, serializers
+from rest_framework.decorators import action
 from rest_framework.views import APIView
 from .models import User, Company, Interest
 from .models import TechSector, MainOffice, Entity, FinanceStage, Company
 from .serializers import UserSerializer, CompanySerializer, InterestSerializer
 from .serializers import TechSectorSerializer, MainOfficeSerializer, EntitySerializer, FinanceStageSerializer, CompanySerializer, CompanySerializerForModelTraining
+from .serializers import CompanyCardSerializer
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, BasePermission, IsAuthenticated
 from django.contrib.auth import authenticate
 from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
-from rest_framework.pagination import PageNumberPagination
 from django.db import transaction
-from api.semantic_search.semantic_search import search_model
+from .company_filters import (FUZZY, NAME_SEARCH_LIMIT, NAME_SEARCH_MODES, PREFIX, count_facets, filter_companies,
+                              get_company_filters, search_company_names)
+from .pagination import COMPANY_MAX_PAGE_SIZE, CompanyCursorPagination
+from api.semantic_search.semantic_search import (FEED_SIZE, MAX_BATCH_QUERIES, MAX_SIMILAR_COMPANIES,
+                                                 NUM_OF_RESULTS_TO_RETURN, find_similar_companies, search_companies,
+                                                 search_companies_batch)
+from api.semantic_search.async_search import search_companies_async
+from api.semantic_search.facet_index import FACETS
+from api.semantic_search.feeds import get_user_feed, refresh_user_feed_on_commit
+from api.semantic_search.timing import (CARDS, METRICS_ACCESS, METRICS_TOKEN, add_server_timing, span, stage_histograms,
+                                        timed_search)
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+import hmac
 import json
 import os
 from django.conf import settings
@@ -24,29 +39,28 @@ class IsUser(BasePermission):
         return obj.id == request.user.id
 
 
-# Custom pagination class
-class CustomPagination(PageNumberPagination):
-    page_size = 6  # Set the number of items per page
-
-
 class CompanyViewSet(viewsets.ModelViewSet):
     queryset = Company.objects.all().order_by('id')
     serializer_class = CompanySerializer
-    pagination_class = CustomPagination  # Use your custom pagination class
+    pagination_class = CompanyCursorPagination
 
-    # filter companies by tech sectors and main offices
+    # filter companies by facets and names
     def get_queryset(self):
-        queryset = super().get_queryset()
-        tech_sectors = self.request.query_params.getlist('tech_sectors')
-        hq_main_offices = self.request.query_params.getlist('hq_main_offices')
+        return filter_companies(self.get_named_queryset(), get_company_filters(self.request.query_params))
+
+    def get_serializer_class(self):
+        # view=card lists the compact companies of the directory cards.
+        if self.request.method == 'GET' and self.request.query_params.get('view') == 'card':
+            return CompanyCardSerializer
+        return super().get_serializer_class()
+
+    def get_named_queryset(self):
+        serializer_class = self.get_serializer_class()
+        # Reads only the columns of the returned fields, see SparseFieldsMixin.
+        fields = serializer_class.selected_fields(self.request.query_params) if self.request.method == 'GET' else None
+        queryset = serializer_class.eager_load(super().get_queryset(), fields)
         company_names = self.request.query_params.get('company', '')
 
-        if tech_sectors:
-            queryset = queryset.filter(tech_sector__id__in=tech_sectors).distinct()
-
-        if hq_main_offices:
-            queryset = queryset.filter(hq_main_office__id__in=hq_main_offices).distinct()
-
         if company_names:
             company_names = company_names.split(',')  # Split the comma-separated names into a list
             # Create a Q object for case-insensitive search for each company name
@@ -58,11 +72,44 @@ class CompanyViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        # facets=true adds the number of companies of each filter value, for the filter panel.
+        if request.query_params.get('facets', '').lower() == 'true':
+            response.data['facets'] = count_facets(self.get_named_queryset(), get_company_filters(request.query_params))
+        return response
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        # Companies whose name starts with (mode=prefix) or is close to (mode=fuzzy) the text `q`, best first.
+        text = request.query_params.get('q', '').strip()
+        mode = request.query_params.get('mode', PREFIX)
+        if not text:
+            return Response({'detail': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if mode not in NAME_SEARCH_MODES:
+            return Response({'detail': f'mode must be one of {", ".join(NAME_SEARCH_MODES)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', NAME_SEARCH_LIMIT))
+        except ValueError:
+            return Response({'detail': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= COMPANY_MAX_PAGE_SIZE:
+            return Response({'detail': f'limit must be between 1 and {COMPANY_MAX_PAGE_SIZE}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        companies = filter_companies(Company.objects.all(), get_company_filters(request.query_params))
+        fields = ('id', 'company', 'score') if mode == FUZZY else ('id', 'company')
+        results = list(search_company_names(companies, text, mode).values(*fields)[:limit])
+        return Response({'mode': mode, 'results': results}, status=status.HTTP_200_OK)
+
 
 class CompanyViewSetForModelTraining(viewsets.ModelViewSet):
     queryset = Company.objects.all()
     serializer_class = CompanySerializerForModelTraining
 
+    def get_queryset(self):
+        return CompanySerializerForModelTraining.eager_load(super().get_queryset())
+
 
 # ViewSet for TechSector
 class TechSectorViewSet(viewsets.ModelViewSet):
@@ -143,6 +190,7 @@ class UserViewSet(viewsets.ModelViewSet):
                 return Response({"interests": ["One or more interests do not exist."]}, status=status.HTTP_400_BAD_REQUEST)
 
             instance.interests.set(existing_interests)
+            refresh_user_feed_on_commit(instance)
 
         # Handle profile picture
         if 'profile_pic' in request.data:
@@ -167,6 +215,36 @@ class UserViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['get'])
+    def feed(self, request, pk=None):
+        '''
+            Companies recommended to the user from their interests, precomputed so no model runs.
+            Expected input: `top_k` (optional) and `cards=true` (optional).
+        '''
+        user = self.get_object()
+        try:
+            top_k = int(request.query_params.get('top_k', NUM_OF_RESULTS_TO_RETURN))
+        except ValueError:
+            return Response({'detail': 'top_k must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= top_k <= FEED_SIZE:
+            return Response({'detail': f'top_k must be between 1 and {FEED_SIZE}'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with timed_search("feed") as timings:
+                feed = get_user_feed(user)
+                results = feed.results[:top_k]
+                response = {
+                    "company": [result["company"] for result in results],
+                    "company_ids": [result["id"] for result in results],
+                    "scores": [result["score"] for result in results],
+                    "updated_at": feed.updated_at,
+                }
+                if request.query_params.get('cards') == 'true':
+                    with span(CARDS):
+                        response["results"] = get_company_cards(response["company_ids"])
+            return add_server_timing(Response(response, status=status.HTTP_200_OK), timings)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 
 class InterestViewSet(viewsets.ModelViewSet):
     queryset = Interest.objects.all()
@@ -247,8 +325,148 @@ class SemanticSearchPortfolioCompanies(APIView):
         if query is None or query == "":
             return Response({'detail': 'Please provide a query'}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            result_list = search_model(query)
-            response = {"company": result_list}
-            return Response(response, status=status.HTTP_200_OK)
+            with timed_search("search") as timings:
+                results = search_companies(query, filters=get_search_filters(request.query_params))
+                if not isinstance(results, list):
+                    return Response({"company": results}, status=status.HTTP_200_OK)
+
+                response = {
+                    "company": [result["company"] for result in results],
+                    "company_ids": [result["id"] for result in results],
+                    "rerank": results.rerank,
+                }
+                if request.query_params.get('cards') == 'true':
+                    with span(CARDS):
+                        response["results"] = get_company_cards(response["company_ids"])
+            return add_server_timing(Response(response, status=status.HTTP_200_OK), timings)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@require_GET
+async def semantic_search_portfolio_companies_async(request):
+    # Async version of SemanticSearchPortfolioCompanies for ASGI servers, with the same parameters and response.
+    query = request.GET.get('query')
+    if query is None or query == "":
+        return JsonResponse({'detail': 'Please provide a query'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        with timed_search("async_search") as timings:
+            results = await search_companies_async(query, filters=get_search_filters(request.GET))
+            if not isinstance(results, list):
+                return JsonResponse({"company": results}, status=status.HTTP_200_OK)
+
+            response = {
+                "company": [result["company"] for result in results],
+                "company_ids": [result["id"] for result in results],
+                "rerank": results.rerank,
+            }
+            if request.GET.get('cards') == 'true':
+                with span(CARDS):
+                    response["results"] = await sync_to_async(get_company_cards)(response["company_ids"])
+        return add_server_timing(JsonResponse(response, status=status.HTTP_200_OK), timings)
+    except Exception as e:
+        return JsonResponse({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class BatchSemanticSearchPortfolioCompanies(APIView):
+    def post(self, request, format=None):
+        queries = request.data.get('queries')
+        if not isinstance(queries, list) or not queries or \
+                not all(isinstance(query, str) and query != "" for query in queries):
+            return Response({'detail': 'Please provide a list of queries'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(queries) > MAX_BATCH_QUERIES:
+            return Response({'detail': f'At most {MAX_BATCH_QUERIES} queries can be searched at once'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            filters = request.data.get('filters') or {}
+            if not isinstance(filters, dict):
+                return Response({'detail': 'filters must be an object'}, status=status.HTTP_400_BAD_REQUEST)
+            with timed_search("batch_search") as timings:
+                results = search_companies_batch(queries, filters=filters)
+                if not isinstance(results, list):
+                    return Response({'detail': results}, status=status.HTTP_400_BAD_REQUEST)
+
+                searches = [{
+                    "query": query,
+                    "company": [result["company"] for result in query_results],
+                    "company_ids": [result["id"] for result in query_results],
+                    "rerank": query_results.rerank,
+                } for query, query_results in zip(queries, results)]
+                if request.data.get('cards') is True:
+                    with span(CARDS):
+                        cards = fetch_company_cards(
+                            [company_id for search in searches for company_id in search["company_ids"]])
+                    for search in searches:
+                        search["results"] = [cards[company_id] for company_id in search["company_ids"]
+                                             if company_id in cards]
+            return add_server_timing(Response({"searches": searches}, status=status.HTTP_200_OK), timings)
+        except Exception as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class SimilarPortfolioCompanies(APIView):
+    '''
+        Companies most similar to a company, from the vectors of the search index. No model runs.
+        Expected input: `top_k` (optional), the facet filters of the semantic search and `cards=true` (optional).
+    '''
+
+    def get(self, request, company_id, format=None):
+        try:
+            top_k = int(request.query_params.get('top_k', NUM_OF_RESULTS_TO_RETURN))
+        except ValueError:
+            return Response({'detail': 'top_k must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= top_k <= MAX_SIMILAR_COMPANIES:
+            return Response({'detail': f'top_k must be between 1 and {MAX_SIMILAR_COMPANIES}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with timed_search("similar") as timings:
+                found = find_similar_companies(company_id, top_k, filters=get_search_filters(request.query_params))
+                if found is None:
+                    return Response({'detail': 'Company not found in the search index'},
+                                    status=status.HTTP_404_NOT_FOUND)
+                if not isinstance(found, tuple):
+                    return Response({'detail': found}, status=status.HTTP_400_BAD_REQUEST)
+
+                results, source = found
+                response = {
+                    "company_id": company_id,
+                    "company": [result["company"] for result in results],
+                    "company_ids": [result["id"] for result in results],
+                    "scores": [result["score"] for result in results],
+                    "source": source,
+                }
+                if request.query_params.get('cards') == 'true':
+                    with span(CARDS):
+                        response["results"] = get_company_cards(response["company_ids"])
+            return add_server_timing(Response(response, status=status.HTTP_200_OK), timings)
         except Exception as e:
             return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@require_GET
+def semantic_search_metrics(request):
+    # Histograms of the search stage durations of this worker process, in the Prometheus text format.
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    token_valid = bool(METRICS_TOKEN) and hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+    if not (METRICS_ACCESS == 'all' or (METRICS_ACCESS == 'token' and token_valid)):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(stage_histograms.to_prometheus(), content_type='text/plain; version=0.0.4')
+
+
+def get_search_filters(query_params):
+    # Facet filters of a semantic search, from the same repeated query parameters as CompanyViewSet.
+    return {facet: query_params.getlist(facet) for facet in FACETS if query_params.getlist(facet)}
+
+
+def fetch_company_cards(company_ids):
+    # {company id: compact company of the directory cards}, fetched together instead of one request per company.
+    # Only the card columns and relations are read. Companies deleted since they were indexed are missing.
+    fields = CompanyCardSerializer.Meta.fields
+    companies = list(CompanyCardSerializer.eager_load(Company.objects.all(), fields).in_bulk(set(company_ids)).values())
+    return {company.id: card for company, card in zip(companies, CompanyCardSerializer(companies, many=True).data)}
+
+
+def get_company_cards(company_ids):
+    # Serialized companies in the order of company_ids.
+    cards = fetch_company_cards(company_ids)
+    return [cards[company_id] for company_id in company_ids if company_id in cards]
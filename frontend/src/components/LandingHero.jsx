@@ -5,9 +5,15 @@ import CompanyProfileCard from './CompanyProfileCard';
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome';
 import { faSearch } from '@fortawesome/free-solid-svg-icons';
 import checkAuthentication from '../utils/checkAuthentication.js';
+import * as storageKeys from '../constants/storageKeys.js';
 
 const API_URL = import.meta.env.VITE_API_URL;
 
+const getCookie = name => {
+  const cookieValue = document.cookie.match(`(^|;) ?${name}=([^;]*)(;|$)`);
+  return cookieValue ? cookieValue[2] : null;
+};
+
 export const LandingHero = () => {
   const navigate = useNavigate();
 
@@ -23,9 +29,13 @@ export const LandingHero = () => {
       if (auth) {
         setLoading(true);
         try {
-          // Get interests from local storage
-          const interests = localStorage.getItem('interests');
-          fetch(`${API_URL}semantic-search-portfolio-companies/?query=${encodeURIComponent(interests)}`)
+          // The feed is precomputed from the user's interests, cards=true returns the card of each company with it.
+          const userId = getCookie(storageKeys.USER_ID);
+          fetch(`${API_URL}users/${userId}/feed/?cards=true`, {
+            headers: {
+              authorization: `Bearer ${localStorage.getItem(storageKeys.ACCESS_TOKEN)}`,
+            },
+          })
             .then(response => {
               if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -33,21 +43,10 @@ export const LandingHero = () => {
               return response.json();
             })
             .then(data => {
-              let company_name_list = data.company;
-              for (let i = 0; i < company_name_list.length; i++) {
-                fetch(`${API_URL}companies/?company=${encodeURIComponent(company_name_list[i])}`)
-                  .then(response => {
-                    if (!response.ok) {
-                      throw new Error(`HTTP error! status: ${response.status}`);
-                    }
-                    return response.json();
-                  })
-                  .then(data => {
-                    setCompanies(prevCompanies => [...prevCompanies, ...data.results]);
-                    setHasCompanies(true);
-                  });
-                setLoading(false);
-              }
+              const results = data.results || [];
+              setCompanies(results);
+              setHasCompanies(results.length > 0);
+              setLoading(false);
             })
             .catch(error => {
               console.error('Failed to fetch data:', error);
@@ -20,6 +20,8 @@ const Directory = () => {
   });
   const [countriesData, setCountriesData] = useState([]);
   const [sectorsData, setSectorsData] = useState([]);
+  // Number of companies of each country and sector, from the company list
+  const [facets, setFacets] = useState({});
 
   // useEffect for handling search query
   useEffect(() => {
@@ -122,8 +124,14 @@ const Directory = () => {
         countriesData={countriesData}
         sectorsData={sectorsData}
         selectedFilters={selectedFilters}
+        facets={facets}
+      />
+      <CompanyPanel
+        filters={selectedFilters}
+        searchQuery={searchQuery}
+        isSearching={isSearching}
+        onFacetsChange={setFacets}
       />
-      <CompanyPanel filters={selectedFilters} searchQuery={searchQuery} isSearching={isSearching} />
     </div>
   );
 };
@@ -2,7 +2,15 @@ import { useState, useEffect } from 'react';
 import { FontAwesomeIcon } from '@fortawesome/react-fontawesome';
 import { faTimes, faEarthAmericas, faIndustry } from '@fortawesome/free-solid-svg-icons';
 
-const FilterPanel = ({ isOpen, setIsOpen, onFiltersChange, countriesData, sectorsData, selectedFilters }) => {
+const FilterPanel = ({
+  isOpen,
+  setIsOpen,
+  onFiltersChange,
+  countriesData,
+  sectorsData,
+  selectedFilters,
+  facets = {},
+}) => {
   const [isCountryOpen, setIsCountryOpen] = useState(false);
   const [isSectorOpen, setIsSectorOpen] = useState(false);
   const countries = countriesData;
@@ -15,6 +23,9 @@ const FilterPanel = ({ isOpen, setIsOpen, onFiltersChange, countriesData, sector
     setSelectedSectors(selectedFilters.sectors);
   }, [selectedFilters]);
 
+  // Number of companies of a filter value, shown once the company list returned the counts
+  const facetCount = (facet, id) => (facets[facet] ? ` (${facets[facet][id] || 0})` : '');
+
   const handleCountryChange = id => {
     const newSelection = selectedCountries.includes(id)
       ? selectedCountries.filter(countryId => countryId !== id)
@@ -120,7 +131,10 @@ const FilterPanel = ({ isOpen, setIsOpen, onFiltersChange, countriesData, sector
                     checked={selectedCountries.includes(id)}
                     onChange={() => handleCountryChange(id)}
                   />
-                  <span className='ml-2'>{hq_name}</span>
+                  <span className='ml-2'>
+                    {hq_name}
+                    {facetCount('hq_main_offices', id)}
+                  </span>
                 </label>
               ))}
             </div>
@@ -138,7 +152,10 @@ const FilterPanel = ({ isOpen, setIsOpen, onFiltersChange, countriesData, sector
                     checked={selectedSectors.includes(id)}
                     onChange={() => handleSectorChange(id)}
                   />
-                  <span className='ml-2 overflow-hidden sm:line-clamp-1'>{sector_name}</span>
+                  <span className='ml-2 overflow-hidden sm:line-clamp-1'>
+                    {sector_name}
+                    {facetCount('tech_sectors', id)}
+                  </span>
                 </label>
               ))}
             </div>
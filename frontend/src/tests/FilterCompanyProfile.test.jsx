@@ -38,21 +38,21 @@ describe('FilterCompany', () => {
       },
     ];
 
-    fetchMock.get(`${API_URL}companies/?page=1&tech_sectors=35&hq_main_offices=5`, {
+    fetchMock.get(`${API_URL}companies/?view=card&tech_sectors=35&hq_main_offices=5&count=true&facets=true`, {
       status: 200,
       body: {
         results: companyData,
       },
     });
 
-    fetchMock.get(`${API_URL}companies/?page=1&hq_main_offices=5`, {
+    fetchMock.get(`${API_URL}companies/?view=card&hq_main_offices=5&count=true&facets=true`, {
       status: 200,
       body: {
         results: companyData,
       },
     });
 
-    fetchMock.get(`${API_URL}companies/?page=1`, {
+    fetchMock.get(`${API_URL}companies/?view=card&count=true&facets=true`, {
       status: 200,
       body: {
         results: companyData,
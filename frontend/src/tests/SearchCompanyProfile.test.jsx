@@ -0,0 +1,63 @@
+import fetchMock from 'fetch-mock';
+import { render, screen, waitFor } from '@testing-library/react';
+import { describe, test, expect, beforeEach, afterEach } from 'vitest';
+import Directory from '../routes/Directory';
+import { MemoryRouter as Router } from 'react-router-dom';
+
+const API_URL = import.meta.env.VITE_API_URL;
+
+describe('SearchCompany', () => {
+  beforeEach(() => {
+    fetchMock.get(`${API_URL}semantic-search-portfolio-companies/?query=ayurveda&cards=true`, {
+      status: 200,
+      body: {
+        company: ['Kapiva Ayurveda', 'BeepKart'],
+        company_ids: [130, 20],
+        rerank: 'reranked',
+        results: [
+          {
+            id: 130,
+            company: 'Kapiva Ayurveda',
+            description: 'Kapiva Ayurveda is a fast-growing Ayurvedic food brand.',
+            tech_sector: ['Consumer Products & Services', 'Healthcare'],
+            hq_main_office: 'India',
+            finance_stage: 'Series C',
+            status: 'active',
+          },
+          {
+            id: 20,
+            company: 'BeepKart',
+            description: 'A full-stack online retailer of used 2-wheelers.',
+            tech_sector: ['Consumer Products & Services'],
+            hq_main_office: 'India',
+            finance_stage: 'Series A',
+            status: 'active',
+          },
+        ],
+      },
+    });
+    fetchMock.get(`${API_URL}main-offices/`, []);
+    fetchMock.get(`${API_URL}tech-sectors/`, []);
+
+    render(
+      <Router initialEntries={['/directory?query=ayurveda']}>
+        <Directory />
+      </Router>,
+    );
+  });
+
+  afterEach(() => {
+    fetchMock.reset();
+  });
+
+  test('shows the cards returned with the search results', async () => {
+    await waitFor(() => {
+      expect(screen.getByText('Kapiva Ayurveda')).toBeInTheDocument();
+      expect(screen.getByText('BeepKart')).toBeInTheDocument();
+    });
+
+    // One search request, and no request per result
+    expect(fetchMock.calls(`begin:${API_URL}semantic-search-portfolio-companies/`)).toHaveLength(1);
+    expect(fetchMock.calls(`begin:${API_URL}companies/`)).toHaveLength(0);
+  });
+});
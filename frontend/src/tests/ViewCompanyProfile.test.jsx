@@ -53,7 +53,7 @@ describe('ViewCompanyProfile', () => {
       },
     });
 
-    fetchMock.get(`${API_URL}companies/?page=1`, {
+    fetchMock.get(`${API_URL}companies/?view=card&count=true&facets=true`, {
       status: 200,
       body: {
         count: 268,
@@ -76,13 +76,6 @@ export const renderWithAuthContext = (
 
     localStorageMock.setItem('interests', JSON.stringify(['fintech']));
 
-    fetchMock.get(API_URL + 'semantic-search-portfolio-companies/?query=%5B%22fintech%22%5D', {
-      status: 200,
-      body: {
-        company: ['MatchMade'],
-      },
-    });
-
     let companyData;
 
     companyData = {
@@ -98,6 +91,15 @@ export const renderWithAuthContext = (
       website: 'matchmade.io',
     };
 
+    fetchMock.get(`${API_URL}users/63/feed/?cards=true`, {
+      status: 200,
+      body: {
+        company: ['MatchMade'],
+        company_ids: [1],
+        results: [companyData],
+      },
+    });
+
     fetchMock.get(`${API_URL}companies/?company=${companyData.company}`, {
       status: 200,
       body: { count: 1, next: null, previous: null, results: [companyData] },